@@ -0,0 +1,542 @@
+import numpy as np
+from lip2d import LIP2D
+from swing_leg import SwingLeg
+import step_to_step as STS
+import ankle as ANKLE
+
+
+class BatchSimulator(object):
+    """
+    Simulates many independent walkers at once. The horizon scan of
+    Simulator.run is evaluated for all walkers in one go, with the walkers
+    along the first axis of every array, so that the chosen CoP offsets and
+    swing times are identical to those of a Simulator per walker.
+    """
+
+    # Names of the per-walker state arrays
+    state_names = ('com_pos_ap', 'com_vel_ap', 'foot_pos_ap', 'com_pos_ml', 'com_vel_ml',
+                   'foot_pos_ml', 'leg_angle_ap', 'leg_angle_ml', 'is_right_swing')
+
+    def __init__(self, settings, n_walker, cop_modulation=False):
+        """
+        =INPUT=
+            settings - SimulationSettings
+            n_walker - int
+                Number of walkers, all starting at the initial conditions
+                in settings
+            cop_modulation - bool [False]
+                See Simulator
+        """
+        self.settings = settings
+        self.n_walker = n_walker
+
+        # set time horizon
+        self.t_step = settings.t_step
+        self.horizon = settings.horizon
+
+        # precision of the horizon scan, see choose
+        self.dtype = np.dtype(settings.scan_dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError('scan_dtype must be float32 or float64')
+
+        # set possible CoP offsets
+        if cop_modulation is True:
+            self.cop_offsets_ap = settings.cop_offsets_ap
+            self.cop_offsets_ml = settings.cop_offsets_ml
+        else:
+            self.cop_offsets_ap = np.array([0])
+            self.cop_offsets_ml = np.array([0])
+
+        # walker states, one entry per walker
+        ones = np.ones(n_walker)
+        self.com_pos_ap = settings.initial_com_pos_ap * ones
+        self.com_vel_ap = settings.initial_com_vel_ap * ones
+        self.foot_pos_ap = settings.initial_foot_pos_ap * ones
+        self.com_pos_ml = settings.initial_com_pos_ml * ones
+        self.com_vel_ml = settings.initial_com_vel_ml * ones
+        self.foot_pos_ml = settings.initial_foot_pos_ml * ones
+        self.leg_angle_ap = settings.initial_leg_angle_ap * ones
+        self.leg_angle_ml = settings.initial_leg_angle_ml * ones
+        self.is_right_swing = np.ones(n_walker, dtype=bool)
+
+        self.swing_leg_ap = SwingLeg(
+            mass=settings.mass_swing_leg,
+            gravity=settings.gravity,
+            leg_length=settings.swing_leg_length)
+        self.swing_leg_ml = SwingLeg(
+            mass=settings.mass_swing_leg,
+            gravity=settings.gravity,
+            leg_length=settings.swing_leg_length)
+        return
+
+
+    @classmethod
+    def from_simulator(cls, simulation, n_walker, cop_modulation=False):
+        """
+        Create a batch of walkers that all start in the current state of
+        a Simulator, e.g. a steady state gait.
+        """
+        batch = cls(simulation.settings, n_walker, cop_modulation=cop_modulation)
+        ones = np.ones(n_walker)
+
+        batch.com_pos_ap = simulation.lip_ap.com_pos * ones
+        batch.com_vel_ap = simulation.lip_ap.com_vel * ones
+        batch.foot_pos_ap = simulation.lip_ap.cop_origin * ones
+        batch.com_pos_ml = simulation.lip_ml.com_pos * ones
+        batch.com_vel_ml = simulation.lip_ml.com_vel * ones
+        batch.foot_pos_ml = simulation.lip_ml.cop_origin * ones
+        batch.is_right_swing = simulation.is_right_swing * np.ones(n_walker, dtype=bool)
+
+        # Simulator.run continues from the initial angle its swing legs hold
+        for (angle, swing_leg, direction) in (('leg_angle_ap', simulation.swing_leg_ap, 'ap'),
+                                              ('leg_angle_ml', simulation.swing_leg_ml, 'ml')):
+            if swing_leg.initial_angle is None:
+                setattr(batch, angle, getattr(simulation.settings, 'initial_leg_angle_' + direction) * ones)
+            else:
+                setattr(batch, angle, np.ravel(swing_leg.initial_angle)[0] * ones)
+
+        return batch
+
+
+    def copy_state_to(self, batch, walkers=None, index=0):
+        """
+        Copy the state of one of the walkers to (some of) the walkers of
+        another batch.
+
+        =INPUT=
+            batch - BatchSimulator
+            walkers - ndarray of int [None]
+                Walkers of batch to overwrite. If None, all walkers.
+            index - int [0]
+                Walker of this batch to copy
+        """
+        if walkers is None:
+            walkers = np.arange(batch.n_walker)
+        for name in self.state_names:
+            getattr(batch, name)[walkers] = getattr(self, name)[index]
+        return
+
+
+    def mirror(self, walkers=None):
+        """
+        Mirror (some of) the walkers in the ML direction: the ML state
+        changes sign and the other leg swings. The model is symmetric, so
+        a mirrored walker takes the mirrored steps, see
+        viability.is_mirror_symmetric.
+
+        =INPUT=
+            walkers - ndarray of int [None]
+                Indices of the walkers to mirror. If None, all walkers.
+        """
+        if walkers is None:
+            walkers = np.arange(self.n_walker)
+        for name in ('com_pos_ml', 'com_vel_ml', 'foot_pos_ml', 'leg_angle_ml'):
+            getattr(self, name)[walkers] *= -1
+        self.is_right_swing[walkers] = np.logical_not(self.is_right_swing[walkers])
+        return
+
+
+    def scan(self, walkers=None):
+        """
+        Horizon scan for a subset of walkers.
+
+        =INPUT=
+            walkers - ndarray of int [None]
+                Indices of the walkers to scan. If None, all walkers.
+        =OUTPUT=
+            scan - dict
+                'total_cost' of shape (M, C, N) for M walkers, C CoP offsets
+                and N horizon samples, plus the LIPs, step locations and
+                separate costs the total is made of, and the walkers
+        =NOTES=
+            All arrays are of the scan precision, self.dtype.
+        """
+        if walkers is None:
+            walkers = np.arange(self.n_walker)
+        settings = self.settings
+        dtype = self.dtype.type
+        column = lambda values: values[walkers].reshape(-1, 1).astype(dtype)
+        horizon = self.horizon.astype(dtype)
+        (gravity, leg_length) = (dtype(settings.gravity), dtype(settings.leg_length))
+
+        # ML direction, only the first CoP offset is used (see Simulator.run)
+        offset_multiplier_ml = np.where(self.is_right_swing[walkers], 1, -1).reshape(-1, 1)
+        lip_ml = LIP2D(column(self.com_pos_ml), column(self.com_vel_ml),
+            column(self.foot_pos_ml), column(self.foot_pos_ml),
+            gravity=gravity, leg_length=leg_length)
+        lip_ml.simulate(horizon, dtype(self.cop_offsets_ml[0]))
+        step_ml = lip_ml.step_location_xcom(offset=(settings.xcom_offset_ml * offset_multiplier_ml).astype(dtype))
+        final_leg_angle_ml = lip_ml.to_leg_angle(step_ml)
+        swing_cost_ml = self.swing_leg_ml.compute_swing_cost_batch(
+            self.t_step, horizon, self.leg_angle_ml[walkers], final_leg_angle_ml, dtype=dtype)
+        ankle_cost_ml = ANKLE.compute_ankle_costs(
+            mass=settings.mass_total, gravity=settings.gravity,
+            cop_offset=dtype(self.cop_offsets_ml[0]), time=horizon)
+
+        lips_ap = []
+        steps_ap = []
+        final_leg_angles_ap = []
+        costs = {'swing_cost_ap': [], 'sts_cost': [], 'ankle_cost_ap': []}
+        total_cost = []
+        for cop_offset in self.cop_offsets_ap:
+            lip_ap = LIP2D(column(self.com_pos_ap), column(self.com_vel_ap),
+                column(self.foot_pos_ap), column(self.foot_pos_ap),
+                gravity=gravity, leg_length=leg_length)
+            lip_ap.simulate(horizon, dtype(cop_offset))
+            step_ap = lip_ap.step_location_xcom(offset=settings.xcom_offset_ap)
+            final_leg_angle_ap = lip_ap.to_leg_angle(step_ap)
+
+            swing_cost_ap = self.swing_leg_ap.compute_swing_cost_batch(
+                self.t_step, horizon, self.leg_angle_ap[walkers], final_leg_angle_ap, dtype=dtype)
+            sts_cost = abs(STS.transition_cost(settings.mass_total, lip_ap, lip_ml, step_ap, step_ml))
+            ankle_cost_ap = ANKLE.compute_ankle_costs(
+                mass=settings.mass_total, gravity=settings.gravity,
+                cop_offset=dtype(cop_offset), time=horizon)
+
+            lips_ap.append(lip_ap)
+            steps_ap.append(step_ap)
+            final_leg_angles_ap.append(final_leg_angle_ap)
+            costs['swing_cost_ap'].append(swing_cost_ap)
+            costs['sts_cost'].append(sts_cost)
+            costs['ankle_cost_ap'].append(ankle_cost_ap * np.ones_like(swing_cost_ap))
+            total_cost.append(
+                settings.gain_swing_cost_ap * swing_cost_ap +
+                settings.gain_swing_cost_ml * swing_cost_ml +
+                settings.gain_sts_cost * sts_cost +
+                settings.gain_ankle_cost_ap * ankle_cost_ap +
+                settings.gain_ankle_cost_ml * ankle_cost_ml)
+
+        scan = {name: np.stack(values, axis=1) for (name, values) in costs.items()}
+        scan.update({
+            'total_cost': np.stack(total_cost, axis=1),
+            'swing_cost_ml': swing_cost_ml,
+            'ankle_cost_ml': ankle_cost_ml * np.ones_like(swing_cost_ml),
+            'lips_ap': lips_ap,
+            'lip_ml': lip_ml,
+            'step_pos_ap': np.stack(steps_ap, axis=1),
+            'step_pos_ml': step_ml,
+            'final_leg_angle_ap': np.stack(final_leg_angles_ap, axis=1),
+            'final_leg_angle_ml': final_leg_angle_ml,
+            'walkers': walkers})
+        return scan
+
+
+    def choose(self, scan, n_feasible=None):
+        """
+        Find the lowest cost CoP offset and swing time of each walker.
+
+        =INPUT=
+            scan - dict
+                See scan
+            n_feasible - ndarray of int of shape (M,) [None]
+                Only the first n_feasible samples of the horizon can be chosen.
+                If None, the full horizon.
+        =OUTPUT=
+            best_cop_idx, best_time_idx - ndarray of int of shape (M,)
+        =NOTES=
+            With a float32 scan, the steps whose total cost is within a
+            fraction settings.scan_recheck_margin of the lowest are costed
+            again in float64 (see evaluate), and the lowest of those is
+            chosen. The choice is then that of a float64 scan, as long as
+            the float32 rounding errors are within the margin.
+        """
+        total_cost = scan['total_cost']
+        (n_active, n_cop, n_time) = total_cost.shape
+        if n_feasible is not None:
+            is_beyond = np.arange(n_time) >= np.reshape(n_feasible, (-1, 1))
+            total_cost = np.where(is_beyond[:, None, :], np.inf, total_cost)
+
+        # Same tie-breaking as Simulator.run: first CoP, then first time
+        total_cost = total_cost.reshape(n_active, -1)
+        best = np.argmin(total_cost, axis=1)
+        if total_cost.dtype == np.float64:
+            return best // n_time, best % n_time
+
+        # Candidates of the float32 scan, per walker in order of CoP, then time
+        lowest = total_cost[np.arange(n_active), best].reshape(-1, 1)
+        is_candidate = np.isfinite(lowest) & (total_cost <= lowest + self.settings.scan_recheck_margin * abs(lowest))
+        (rows, candidates) = np.nonzero(is_candidate)
+        exact_cost = self.evaluate(scan['walkers'][rows], candidates // n_time, candidates % n_time,
+                                   costs=True)['total_cost']
+
+        # Lowest float64 cost per walker, the first candidate of ties
+        order = np.lexsort((candidates, exact_cost, rows))
+        is_first = np.ones(order.size, dtype=bool)
+        is_first[1:] = rows[order[1:]] != rows[order[:-1]]
+        best[rows[order[is_first]]] = candidates[order[is_first]]
+        return best // n_time, best % n_time
+
+
+    def evaluate(self, walkers, cop_idx, time_idx, costs=False):
+        """
+        Single steps of walkers, in float64, with the same values as the
+        corresponding elements of a float64 scan.
+
+        =INPUT=
+            walkers, cop_idx, time_idx - ndarray of int of shape (K,)
+                Walker, CoP offset and horizon index of every step, walkers
+                may repeat
+            costs - bool [False]
+                Also compute the costs
+        =OUTPUT=
+            step - dict of ndarrays of shape (K,)
+                com_pos, com_vel, cop_pos, step_pos and final_leg_angle of
+                both directions (e.g. com_pos_ap) at the end of the step,
+                and if costs, the costs of scan and the total_cost
+        """
+        settings = self.settings
+        t_swing = self.horizon[time_idx]
+        offset_multiplier_ml = np.where(self.is_right_swing[walkers], 1, -1)
+        step = {}
+        lips = {}
+        for (direction, cop_offset, xcom_offset) in (
+                ('ap', self.cop_offsets_ap[cop_idx], settings.xcom_offset_ap),
+                ('ml', self.cop_offsets_ml[0], settings.xcom_offset_ml * offset_multiplier_ml)):
+            foot_pos = getattr(self, 'foot_pos_' + direction)[walkers]
+            lip = LIP2D(getattr(self, 'com_pos_' + direction)[walkers], getattr(self, 'com_vel_' + direction)[walkers],
+                foot_pos, foot_pos, gravity=settings.gravity, leg_length=settings.leg_length)
+            lip.simulate(t_swing, cop_offset)
+            lips[direction] = lip
+            step['com_pos_' + direction] = lip.com_pos
+            step['com_vel_' + direction] = lip.com_vel
+            step['cop_pos_' + direction] = lip.cop_pos * np.ones(walkers.size)
+            step['step_pos_' + direction] = lip.step_location_xcom(offset=xcom_offset)
+            step['final_leg_angle_' + direction] = lip.to_leg_angle(step['step_pos_' + direction])
+        if not costs:
+            return step
+
+        for (direction, swing_leg) in (('ap', self.swing_leg_ap), ('ml', self.swing_leg_ml)):
+            step['swing_cost_' + direction] = swing_leg.compute_swing_cost_pointwise(self.t_step, self.horizon.max(),
+                t_swing, getattr(self, 'leg_angle_' + direction)[walkers], step['final_leg_angle_' + direction])
+        step['sts_cost'] = abs(STS.transition_cost(settings.mass_total, lips['ap'], lips['ml'],
+                                                   step['step_pos_ap'], step['step_pos_ml']))
+        step['ankle_cost_ap'] = ANKLE.compute_ankle_costs(
+            mass=settings.mass_total, gravity=settings.gravity, cop_offset=self.cop_offsets_ap[cop_idx], time=t_swing)
+        step['ankle_cost_ml'] = ANKLE.compute_ankle_costs(
+            mass=settings.mass_total, gravity=settings.gravity, cop_offset=self.cop_offsets_ml[0], time=t_swing)
+        step['total_cost'] = (
+            settings.gain_swing_cost_ap * step['swing_cost_ap'] +
+            settings.gain_swing_cost_ml * step['swing_cost_ml'] +
+            settings.gain_sts_cost * step['sts_cost'] +
+            settings.gain_ankle_cost_ap * step['ankle_cost_ap'] +
+            settings.gain_ankle_cost_ml * step['ankle_cost_ml'])
+        return step
+
+
+    def step(self, walkers=None):
+        """
+        Take one step with a subset of walkers, using the lowest cost
+        CoP offset and swing time of the horizon scan.
+
+        =INPUT=
+            walkers - ndarray of int [None]
+                Indices of the walkers to step with. If None, all walkers.
+        =OUTPUT=
+            result - dict of ndarrays of shape (M,)
+                Chosen CoP and time indices, swing time, step locations,
+                CoM state at the moment of stepping and the chosen total cost
+        """
+        if walkers is None:
+            walkers = np.arange(self.n_walker)
+        scan = self.scan(walkers)
+        (best_cop_idx, best_time_idx) = self.choose(scan)
+
+        return self.take_step(walkers, scan, np.arange(walkers.size), best_cop_idx, best_time_idx)
+
+
+    def perturb(self, t_pert, pert_ap=0, pert_ml=0, walkers=None):
+        """
+        Walk until and including the swing during which a CoM velocity
+        perturbation is applied, see Simulator.perturb.
+
+        =INPUT=
+            t_pert, pert_ap, pert_ml - float or ndarray of shape (M,)
+                Perturbation time after the start of the current swing and
+                velocity changes of each walker
+            walkers - ndarray of int [None]
+                Indices of the walkers to perturb. If None, all walkers.
+        =OUTPUT=
+            result - dict of ndarrays of shape (M,)
+                See step, for the step of the perturbed swing. The swing time
+                includes the time before the perturbation.
+        """
+        if walkers is None:
+            walkers = np.arange(self.n_walker)
+        (t_pert, pert_ap, pert_ml) = [np.array(np.broadcast_to(values, walkers.shape), dtype=float)
+                                      for values in (t_pert, pert_ap, pert_ml)]
+        result = {}
+
+        pending = np.arange(walkers.size)
+        while pending.size > 0:
+            # Perturbations at the start of a swing need no planned step
+            is_start = t_pert[pending] <= 0
+            planned = pending[np.logical_not(is_start)]
+            if planned.size > 0:
+                scan = self.scan(walkers[planned])
+                (best_cop_idx, best_time_idx) = self.choose(scan)
+                t_swing = self.horizon[best_time_idx]
+
+                # Walkers that are perturbed in a later swing take the planned step
+                is_later = t_pert[planned] >= t_swing
+                rows = np.flatnonzero(is_later)
+                self.take_step(walkers[planned[rows]], scan, rows, best_cop_idx[rows], best_time_idx[rows])
+                t_pert[planned[rows]] -= t_swing[rows]
+
+                # State at the perturbation instant of the others, from the planned step
+                rows = np.flatnonzero(np.logical_not(is_later))
+                mid_swing = walkers[planned[rows]]
+                self._advance(mid_swing, scan, rows, best_cop_idx[rows], best_time_idx[rows],
+                              t_pert[planned[rows]])
+                is_start[np.isin(pending, planned[rows])] = True
+
+            # Perturb and plan the remaining swing, within the time horizon
+            perturbed = pending[is_start]
+            if perturbed.size > 0:
+                self.com_vel_ap[walkers[perturbed]] += pert_ap[perturbed]
+                self.com_vel_ml[walkers[perturbed]] += pert_ml[perturbed]
+                t_offset = np.maximum(t_pert[perturbed], 0)
+                n_feasible = np.searchsorted(self.horizon, self.horizon[-1] - t_offset + 1e-9 * self.t_step, side='right')
+
+                scan = self.scan(walkers[perturbed])
+                (best_cop_idx, best_time_idx) = self.choose(scan, n_feasible=n_feasible)
+                step = self.take_step(walkers[perturbed], scan, np.arange(perturbed.size),
+                                      best_cop_idx, best_time_idx, t_offset=t_offset)
+                for (name, values) in step.items():
+                    result.setdefault(name, np.empty(walkers.size, dtype=values.dtype))[perturbed] = values
+
+            pending = pending[np.logical_not(is_start)]
+
+        return result
+
+
+    def _advance(self, walkers, scan, rows, best_cop_idx, best_time_idx, t_leg):
+        """
+        Move walkers t_leg seconds into their planned swing. The LIP state
+        is evaluated analytically under the planned CoP, and the swing leg
+        angles follow the planned swing leg profiles.
+        """
+        if walkers.size == 0:
+            return
+        settings = self.settings
+        t_swing = self.horizon[best_time_idx]
+        if scan['total_cost'].dtype != np.float64:
+            step = self.evaluate(walkers, best_cop_idx, best_time_idx)
+            (final_leg_angle_ap, final_leg_angle_ml) = (step['final_leg_angle_ap'], step['final_leg_angle_ml'])
+        else:
+            final_leg_angle_ap = scan['final_leg_angle_ap'][rows, best_cop_idx, best_time_idx]
+            final_leg_angle_ml = scan['final_leg_angle_ml'][rows, best_time_idx]
+
+        self.leg_angle_ap[walkers] = self.swing_leg_ap.angle_at(t_leg, t_swing, self.leg_angle_ap[walkers],
+            final_leg_angle_ap)
+        self.leg_angle_ml[walkers] = self.swing_leg_ml.angle_at(t_leg, t_swing, self.leg_angle_ml[walkers],
+            final_leg_angle_ml)
+
+        for (direction, cop_offset) in (('ap', self.cop_offsets_ap[best_cop_idx]),
+                                        ('ml', self.cop_offsets_ml[0])):
+            foot_pos = getattr(self, 'foot_pos_' + direction)[walkers]
+            lip = LIP2D(getattr(self, 'com_pos_' + direction)[walkers],
+                getattr(self, 'com_vel_' + direction)[walkers], foot_pos, foot_pos,
+                gravity=settings.gravity, leg_length=settings.leg_length)
+            lip.simulate(t_leg, cop_offset)
+            getattr(self, 'com_pos_' + direction)[walkers] = lip.com_pos
+            getattr(self, 'com_vel_' + direction)[walkers] = lip.com_vel
+        return
+
+
+    def take_step(self, walkers, scan, rows, best_cop_idx, best_time_idx, t_offset=0):
+        """
+        Step to the chosen CoP offset and swing time.
+
+        =INPUT=
+            walkers - ndarray of int of shape (K,)
+                Indices of the walkers that step
+            scan - dict
+                See scan
+            rows - ndarray of int of shape (K,)
+                Rows of the scan that belong to the walkers
+            best_cop_idx, best_time_idx - ndarray of int of shape (K,)
+                See choose
+            t_offset - float or ndarray of shape (K,) [0]
+                Time already spent in this swing before the scan
+        =OUTPUT=
+            result - dict of ndarrays of shape (K,)
+                See step
+        """
+        if scan['total_cost'].dtype != np.float64:
+            # A reduced precision scan only chooses the steps, these are taken in float64
+            step = self.evaluate(walkers, best_cop_idx, best_time_idx, costs=True)
+            (com_pos_ap, com_vel_ap, cop_pos_ap, com_pos_ml, com_vel_ml, step_pos_ap, step_pos_ml, total_cost) = [
+                step[name] for name in ('com_pos_ap', 'com_vel_ap', 'cop_pos_ap', 'com_pos_ml', 'com_vel_ml',
+                                        'step_pos_ap', 'step_pos_ml', 'total_cost')]
+        else:
+            n_active = walkers.size
+            com_pos_ap = np.empty(n_active)
+            com_vel_ap = np.empty(n_active)
+            cop_pos_ap = np.empty(n_active)
+            for (i, lip_ap) in enumerate(scan['lips_ap']):
+                chosen = best_cop_idx == i
+                com_pos_ap[chosen] = lip_ap.com_pos[rows[chosen], best_time_idx[chosen]]
+                com_vel_ap[chosen] = lip_ap.com_vel[rows[chosen], best_time_idx[chosen]]
+                cop_pos_ap[chosen] = lip_ap.cop_pos[rows[chosen], 0]
+            lip_ml = scan['lip_ml']
+            com_pos_ml = lip_ml.com_pos[rows, best_time_idx]
+            com_vel_ml = lip_ml.com_vel[rows, best_time_idx]
+            step_pos_ap = scan['step_pos_ap'][rows, best_cop_idx, best_time_idx]
+            step_pos_ml = scan['step_pos_ml'][rows, best_time_idx]
+            total_cost = scan['total_cost'][rows, best_cop_idx, best_time_idx]
+
+        # Initial swing leg angle for next step, then update to new global state
+        self.leg_angle_ap[walkers] = np.arctan(
+            (self.foot_pos_ap[walkers] - com_pos_ap) / self.settings.leg_length)
+        self.leg_angle_ml[walkers] = np.arctan(
+            (self.foot_pos_ml[walkers] - com_pos_ml) / self.settings.leg_length)
+        self.com_pos_ap[walkers] = com_pos_ap
+        self.com_vel_ap[walkers] = com_vel_ap
+        self.foot_pos_ap[walkers] = step_pos_ap
+        self.com_pos_ml[walkers] = com_pos_ml
+        self.com_vel_ml[walkers] = com_vel_ml
+        self.foot_pos_ml[walkers] = step_pos_ml
+        self.is_right_swing[walkers] = np.logical_not(self.is_right_swing[walkers])
+
+        return {
+            'cop_idx': best_cop_idx,
+            'time_idx': best_time_idx,
+            'swing_time': t_offset + self.horizon[best_time_idx],
+            'cop_pos_ap': cop_pos_ap,
+            'step_pos_ap': step_pos_ap,
+            'step_pos_ml': step_pos_ml,
+            'com_pos_ap': com_pos_ap,
+            'com_pos_ml': com_pos_ml,
+            'com_vel_ap': com_vel_ap,
+            'com_vel_ml': com_vel_ml,
+            'total_cost': total_cost}
+
+
+def sweep_perturbation_onset(simulation, t_pert, magnitudes, direction='ap', cop_modulation=True):
+    """
+    Perturb a simulation at every combination of onset time and magnitude,
+    as a single batched call.
+
+    =INPUT=
+        simulation - Simulator
+            Simulator to start from, e.g. in steady state gait
+        t_pert - ndarray of shape (P,)
+            Perturbation times after the start of the next swing
+        magnitudes - ndarray of shape (Q,)
+            Velocity changes
+        direction - str ['ap']
+            'ap' or 'ml'
+        cop_modulation - bool [True]
+            See Simulator
+    =OUTPUT=
+        result - dict of ndarrays of shape (P, Q)
+            See BatchSimulator.step, for the perturbed swing
+    """
+    (t_grid, magnitude_grid) = np.meshgrid(t_pert, magnitudes, indexing='ij')
+    batch = BatchSimulator.from_simulator(simulation, t_grid.size, cop_modulation=cop_modulation)
+
+    pert = {'ap': 0, 'ml': 0}
+    pert[direction] = magnitude_grid.reshape(-1)
+    result = batch.perturb(t_grid.reshape(-1), pert['ap'], pert['ml'])
+
+    return {name: values.reshape(t_grid.shape) for (name, values) in result.items()}
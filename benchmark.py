@@ -0,0 +1,48 @@
+"""
+Benchmark of the horizon scan: timing of the steady state walk and of
+perturbed walks, with and without pruning of infeasible steps
+(settings.prune_infeasible_steps) and branch and bound over the CoP offsets
+(settings.branch_and_bound), and with the scan on 4 threads
+(settings.n_scan_workers), for the default and a fine CoP grid.
+Run as python benchmark.py
+"""
+
+import time
+from settings import SimulationSettings
+from simulator_v2 import Simulator
+
+
+def time_walk(settings, n_step, pert_ap=0, pert_ml=0, n_repeat=3):
+    """
+    =OUTPUT=
+        t_scan - float
+            Best of n_repeat wall clock times [s] per step, of n_step steps
+            after a perturbation of the steady state gait
+    """
+    baseline = Simulator(settings, cop_modulation=settings.cop_modulation_steady_state)
+    baseline.run(n_step=settings.n_step_to_steady_state, verbose=False)
+
+    t_scan = float('inf')
+    for _ in range(n_repeat):
+        sim = Simulator(settings, cop_modulation=settings.cop_modulation_perturbation)
+        baseline.copy_state_to(sim)
+        start = time.perf_counter()
+        sim.perturb(0, pert_ap=pert_ap, pert_ml=pert_ml, n_step=n_step, verbose=False)
+        t_scan = min(t_scan, (time.perf_counter() - start) / n_step)
+    return t_scan
+
+
+if __name__ == '__main__':
+    cases = [('steady state', 0, 0)] + [('pert ap %+.2f' % pert, pert, 0) for pert in (-0.24, 0.24)] + \
+        [('pert ml %+.2f' % pert, 0, pert) for pert in (-0.24, 0.24)]
+    settings = SimulationSettings()
+    variants = (settings.replace(prune_infeasible_steps=False, branch_and_bound=False),
+                settings.replace(prune_infeasible_steps=True, branch_and_bound=False),
+                settings.replace(prune_infeasible_steps=True, branch_and_bound=True),
+                settings.replace(prune_infeasible_steps=True, branch_and_bound=True, n_scan_workers=4))
+    for cop_steps in (settings.cop_steps, 24):
+        print('%d AP CoP offsets [ms/step]: full scan, pruned, + branch and bound, + 4 threads' % cop_steps)
+        for (name, pert_ap, pert_ml) in cases:
+            times = [1e3 * time_walk(variant.replace(cop_steps=cop_steps), 5, pert_ap, pert_ml)
+                     for variant in variants]
+            print('    %-16s %8.1f %8.1f %8.1f %8.1f   speed-up %.1f' % ((name,) + tuple(times) + (times[0] / times[3],)))
@@ -0,0 +1,169 @@
+"""
+Calibration of the XCoM offsets to a target steady state gait. Without CoP
+modulation, the steady state gait for a given swing time is a periodic
+solution of the LIP step-to-step map that follows in closed form, with step
+length proportional to xcom_offset_ap and step width to xcom_offset_ml. The
+only unknown left is the swing time, which the horizon scan chooses; it is
+found as a root on the time grid, with a single scan per evaluation instead
+of a simulation to steady state.
+"""
+
+import numpy as np
+from simulator_v2 import Simulator
+
+
+def calibrate(settings, step_width, step_length=None, speed=None, set_initial_state=True, max_scans=50):
+    """
+    Find the XCoM offsets for which the steady state gait has the requested
+    step width and either step length or speed.
+
+    =INPUT=
+        settings - SimulationSettings
+            Without CoP modulation in steady state
+        step_width - float
+        step_length, speed - float [None]
+            Exactly one of these. speed is the AP CoM velocity at the steps,
+            as in StepAnalysis.metrics. The swing time is chosen by the
+            horizon scan, and the other follows from it.
+        set_initial_state - bool [True]
+            Also set the initial CoM states and swing leg angles to the
+            steady state gait, so that simulations start without transient
+        max_scans - int [50]
+            Maximum number of horizon scans
+    =OUTPUT=
+        calibrated - SimulationSettings
+            settings with the calibrated xcom_offset_ap and xcom_offset_ml
+        gait - dict
+            The steady state gait and its swing time t_swing, see periodic_gait
+    =NOTES=
+        The sign of xcom_offset_ml is kept. If the swing time chosen from the
+        steady state gait of every swing time differs from it, there is no
+        steady state on the time grid and a ValueError is raised.
+    """
+    if settings.cop_modulation_steady_state:
+        raise ValueError('calibration needs a steady state without CoP modulation')
+    if (step_length is None) == (speed is None):
+        raise ValueError('give either step_length or speed')
+
+    scratch = Simulator(settings, cop_modulation=False)
+    horizon = scratch.horizon
+    sign_ml = np.sign(settings.xcom_offset_ml) or 1.0
+
+    def offsets(time_idx):
+        # Step length and width are proportional to the offsets for a given swing time
+        t_swing = horizon[time_idx]
+        unit_gait = periodic_gait(settings, t_swing, 1.0, 0.0)
+        if speed is None:
+            xcom_offset_ap = step_length / unit_gait['step_length']
+        else:
+            xcom_offset_ap = speed / unit_gait['speed']
+        xcom_offset_ml = sign_ml * step_width / periodic_gait(settings, t_swing, 0.0, 1.0)['step_width']
+        return xcom_offset_ap, xcom_offset_ml
+
+    chosen = {}
+
+    def choose(time_idx):
+        # Swing time the horizon scan chooses from the steady state gait of time_idx
+        if time_idx not in chosen:
+            if len(chosen) >= max_scans:
+                raise ValueError('no steady state found within %d scans' % max_scans)
+            (xcom_offset_ap, xcom_offset_ml) = offsets(time_idx)
+            scratch.settings = settings.replace(xcom_offset_ap=xcom_offset_ap, xcom_offset_ml=xcom_offset_ml)
+            gait = periodic_gait(scratch.settings, horizon[time_idx])
+            scratch.lip_ap.override_state(gait['com_pos_ap'], gait['com_vel_ap'], 0, 0, cop_shift=0)
+            scratch.lip_ml.override_state(gait['com_pos_ml'], gait['com_vel_ml'], 0, 0, cop_shift=0)
+            scratch.is_right_swing = True
+            chosen[time_idx] = scratch.scan_horizon(gait['leg_angle_ap'], gait['leg_angle_ml'])['best_time_idx']
+        return chosen[time_idx]
+
+    time_idx = _fixed_point(choose, choose(int(np.argmin(abs(horizon - 0.5)))))
+
+    (xcom_offset_ap, xcom_offset_ml) = offsets(time_idx)
+    calibrated = settings.replace(xcom_offset_ap=xcom_offset_ap, xcom_offset_ml=xcom_offset_ml)
+    gait = periodic_gait(calibrated, horizon[time_idx])
+    gait['t_swing'] = horizon[time_idx]
+
+    if set_initial_state:
+        calibrated = calibrated.replace(
+            initial_com_pos_ap=gait['com_pos_ap'] + calibrated.initial_foot_pos_ap,
+            initial_com_vel_ap=gait['com_vel_ap'],
+            initial_cop_pos_ap=calibrated.initial_foot_pos_ap,
+            initial_leg_angle_ap=gait['leg_angle_ap'],
+            initial_com_pos_ml=gait['com_pos_ml'] + calibrated.initial_foot_pos_ml,
+            initial_com_vel_ml=gait['com_vel_ml'],
+            initial_cop_pos_ml=calibrated.initial_foot_pos_ml,
+            initial_leg_angle_ml=gait['leg_angle_ml'])
+
+    return calibrated, gait
+
+
+def periodic_gait(settings, t_swing, xcom_offset_ap=None, xcom_offset_ml=None):
+    """
+    Steady state gait with a constant swing time, the ML motion mirroring
+    every step.
+
+    =INPUT=
+        settings - SimulationSettings
+        t_swing - float
+        xcom_offset_ap, xcom_offset_ml - float [None]
+            If None, those of settings
+    =OUTPUT=
+        gait - dict
+            com_pos_ap, com_vel_ap, com_pos_ml, com_vel_ml: CoM state relative
+            to the stance foot at the start of a right swing, leg_angle_ap
+            and leg_angle_ml: the initial swing leg angles of that swing, and
+            step_length, step_width and speed: the AP CoM velocity at the
+            steps, as in StepAnalysis.metrics (not step_length / t_swing)
+    """
+    if xcom_offset_ap is None:
+        xcom_offset_ap = settings.xcom_offset_ap
+    if xcom_offset_ml is None:
+        xcom_offset_ml = settings.xcom_offset_ml
+    w0 = np.sqrt(settings.gravity / settings.leg_length)
+    (cosh, sinh, tanh) = (np.cosh(w0 * t_swing), np.sinh(w0 * t_swing), np.tanh(w0 * t_swing / 2))
+
+    # AP: the CoM velocity at every step is the same, the step is at XCoM + offset
+    com_vel_ap = -xcom_offset_ap * w0 / (1 - tanh)
+    com_pos_ap = -(com_vel_ap / w0 + xcom_offset_ap)
+    end_pos_ap = com_pos_ap * cosh + com_vel_ap / w0 * sinh
+
+    # ML: the CoM state at the next step is mirrored
+    com_vel_ml = xcom_offset_ml * w0 / (1 - 1 / tanh)
+    com_pos_ml = -com_vel_ml / w0 + xcom_offset_ml
+    end_pos_ml = com_pos_ml * cosh + com_vel_ml / w0 * sinh
+
+    # Swing leg angles from the end of the previous (mirrored) swing, see Simulator.take_step
+    step_length = end_pos_ap - com_pos_ap
+    return {
+        'com_pos_ap': com_pos_ap, 'com_vel_ap': com_vel_ap,
+        'com_pos_ml': com_pos_ml, 'com_vel_ml': com_vel_ml,
+        'leg_angle_ap': np.arctan(-end_pos_ap / settings.leg_length),
+        'leg_angle_ml': np.arctan(end_pos_ml / settings.leg_length),
+        'step_length': step_length,
+        'step_width': abs(end_pos_ml + com_pos_ml),
+        'speed': com_vel_ap}
+
+
+def _fixed_point(choose, time_idx):
+    """
+    Index i on the time grid with choose(i) == i. Iterates choose from
+    time_idx, and bisects if that ends in a cycle.
+    """
+    visited = []
+    while time_idx not in visited:
+        visited.append(time_idx)
+        if choose(time_idx) == time_idx:
+            return time_idx
+        time_idx = choose(time_idx)
+
+    # choose(i) - i changes sign between the lowest and highest index of the cycle
+    (low, high) = (min(visited), max(visited))
+    while high - low > 1:
+        middle = (low + high) // 2
+        if choose(middle) == middle:
+            return middle
+        if choose(middle) > middle:
+            low = middle
+        else:
+            high = middle
+    raise ValueError('no steady state on the time grid between swing times index %d and %d' % (low, high))
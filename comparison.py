@@ -0,0 +1,170 @@
+"""
+Model against experiment (Vlutters et al, 2017) for all perturbations,
+experiments, events and plates at once. The experimental tensors are taken
+as a whole instead of one value per ExperimentReadout call, and the results
+are tidy tables: dicts of equally long column arrays, one row per
+observation, see write_table.
+"""
+
+import csv
+import numpy as np
+
+
+EVENTS = ('Prt start', 'Prt end', 'Heel-strike r', 'Toe-off r', 'Heel-strike l', 'Toe-off l')
+
+DIRECTIONS = ('ml', 'ap')
+
+
+def experiment_step_offsets(com_mean_perturbation):
+    """
+    =INPUT=
+        com_mean_perturbation - ndarray
+            See ExperimentReadout.com_step_read
+    =OUTPUT=
+        exp_step_offsets - ndarray of shape (E, 2, P)
+            Step positions relative to the CoM (ML, AP) of every experiment
+            and perturbation, see ExperimentReadout.exp_step_pos
+    """
+    return np.moveaxis(np.asarray(com_mean_perturbation)[2, 6, 0:2], -1, 0)
+
+
+def experiment_cop(cop_mean_perturbation):
+    """
+    =INPUT=
+        cop_mean_perturbation - ndarray of shape (n_event, 2 * n_plate, P, E)
+            See ExperimentReadout.cop_read
+    =OUTPUT=
+        exp_cop - ndarray of shape (E, n_plate, n_event, 2, P)
+            CoP positions (x, y) of every experiment, plate, event and
+            perturbation
+    """
+    cop = np.asarray(cop_mean_perturbation)
+    (n_event, n_coordinate, n_pert, n_experiment) = cop.shape
+    cop = cop.reshape(n_event, n_coordinate // 2, 2, n_pert, n_experiment)
+    return cop.transpose(4, 1, 0, 2, 3)
+
+
+def first_steps(perturbations):
+    """
+    Model state at the first step after every perturbation.
+
+    =INPUT=
+        perturbations - list of DataStorage
+            Data of the perturbation simulations
+    =OUTPUT=
+        step_pos, com_pos, cop_pos - ndarray of shape (2, P)
+            (ML, AP), as the experimental data
+    """
+    (step_pos, com_pos, cop_pos) = [
+        np.array([[getattr(storage, name)[idx][0] for storage in perturbations] for idx in (1, 0)], dtype=float)
+        for name in ('step_pos', 'com_pos', 'cop_pos')]
+    return step_pos, com_pos, cop_pos
+
+
+def compare_steps(model_step_pos, model_com_pos, exp_step_offsets):
+    """
+    First step after every perturbation of the model against that of every
+    experiment, from the same CoM position.
+
+    =INPUT=
+        model_step_pos, model_com_pos - ndarray of shape (2, P)
+            See first_steps
+        exp_step_offsets - ndarray of shape (E, 2, P) or (2, P)
+            See experiment_step_offsets
+    =OUTPUT=
+        table - dict
+            experiment, perturbation, direction, model, experiment_value and
+            error (model - experiment) of every step coordinate
+        summary - dict
+            experiment, r2_ml, r2_ap and rms per experiment, as in
+            StepAnalysis.metrics
+    """
+    model_step_pos = np.asarray(model_step_pos, dtype=float)
+    exp_step_pos = np.asarray(model_com_pos, dtype=float) + _per_experiment(exp_step_offsets)
+    model = np.broadcast_to(model_step_pos, exp_step_pos.shape)
+    error = model - exp_step_pos
+
+    r_squared = _r_squared(exp_step_pos, model)
+    summary = {
+        'experiment': np.arange(len(exp_step_pos)),
+        'r2_ml': r_squared[:, 0], 'r2_ap': r_squared[:, 1],
+        'rms': np.sqrt(np.mean(np.sum(error**2, axis=1), axis=1))}
+    return _tidy(('experiment', 'direction', 'perturbation'), (None, DIRECTIONS, None),
+                 model=model, experiment_value=exp_step_pos, error=error), summary
+
+
+def compare_cop(exp_cop, model_cop=None):
+    """
+    Experimental CoP of every experiment, plate, event and perturbation,
+    against the model CoP if given.
+
+    =INPUT=
+        exp_cop - ndarray of shape (E, n_plate, n_event, 2, P)
+            See experiment_cop
+        model_cop - ndarray of shape (2, P) [None]
+            Model CoP positions (x, y) in the frame of the experimental data
+    =OUTPUT=
+        table - dict
+            experiment, plate, event, coordinate, perturbation and
+            experiment_value, with model and error if model_cop is given
+        summary - dict
+            experiment, plate, event, r2_x, r2_y and rms per combination,
+            None without model_cop
+    """
+    exp_cop = np.asarray(exp_cop, dtype=float)
+    keys = ('experiment', 'plate', 'event', 'coordinate', 'perturbation')
+    labels = (None, None, EVENTS[:exp_cop.shape[2]], ('x', 'y'), None)
+    if model_cop is None:
+        return _tidy(keys, labels, experiment_value=exp_cop), None
+
+    model = np.broadcast_to(np.asarray(model_cop, dtype=float), exp_cop.shape)
+    error = model - exp_cop
+    r_squared = _r_squared(exp_cop, model)
+    (experiment, plate, event) = np.indices(exp_cop.shape[:3]).reshape(3, -1)
+    summary = {
+        'experiment': experiment, 'plate': plate, 'event': np.array(labels[2])[event],
+        'r2_x': r_squared[..., 0].reshape(-1), 'r2_y': r_squared[..., 1].reshape(-1),
+        'rms': np.sqrt(np.mean(np.sum(error**2, axis=-2), axis=-1)).reshape(-1)}
+    return _tidy(keys, labels, model=model, experiment_value=exp_cop, error=error), summary
+
+
+def write_table(table, path):
+    """
+    Write a tidy table (dict of column arrays) to a CSV file
+    """
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(list(table))
+        writer.writerows(zip(*[np.asarray(column).tolist() for column in table.values()]))
+    return
+
+
+def _per_experiment(exp_step_offsets):
+    exp_step_offsets = np.asarray(exp_step_offsets, dtype=float)
+    if exp_step_offsets.ndim == 2:
+        return exp_step_offsets[None]
+    return exp_step_offsets
+
+
+def _r_squared(a, b):
+    """
+    Squared correlation coefficient of a and b along the last axis
+    """
+    a = a - a.mean(axis=-1, keepdims=True)
+    b = b - b.mean(axis=-1, keepdims=True)
+    return np.sum(a * b, axis=-1)**2 / (np.sum(a**2, axis=-1) * np.sum(b**2, axis=-1))
+
+
+def _tidy(keys, labels, **values):
+    """
+    Long table of arrays that share their shape, with one key column per
+    axis (the labels of its index if given) and one column per array
+    """
+    shape = next(iter(values.values())).shape
+    indices = np.indices(shape).reshape(len(shape), -1)
+    table = {}
+    for (key, label, index) in zip(keys, labels, indices):
+        table[key] = index if label is None else np.array(label)[index]
+    for (name, value) in values.items():
+        table[name] = np.asarray(value).reshape(-1)
+    return table
@@ -0,0 +1,167 @@
+"""
+Resolution convergence study: the reference scenario of main.py (steady state
+gait and the responses to the perturbation set) at coarser time steps and
+CoP grids, compared to the finest resolution. Run as python convergence.py
+"""
+
+import itertools
+import time
+import numpy as np
+import scenario
+from settings import SimulationSettings
+from sensitivity import METRICS
+
+
+# Deviations from the finest run: step_pos [m] and swing_times [s] are the
+# largest over all steps, the metrics are those of StepAnalysis.metrics
+ERRORS = ('step_pos', 'swing_times') + METRICS
+
+
+class ConvergenceStudy(object):
+    """
+    Every combination of t_step and number of AP CoP offsets (cop_steps),
+    with its runtime and its deviation from the finest combination.
+    """
+
+    def __init__(self, settings, t_steps=(0.001, 0.002, 0.005, 0.01, 0.02), cop_steps=(6, 4, 3),
+                 exp_step_offsets=None, n_workers=1):
+        """
+        =INPUT=
+            settings - SimulationSettings
+                Reference scenario, its t_step and cop_steps are replaced
+            t_steps - sequence of float
+                Time steps, t_horizon must be a multiple of each
+            cop_steps - sequence of int
+                Numbers of AP CoP offsets
+            exp_step_offsets - ndarray of shape (2, P) [None]
+                See SensitivityAnalysis. If None, r2_ml, r2_ap and rms are NaN.
+            n_workers - int [1]
+                Number of worker processes. Runtimes are process times of
+                the simulations, but workers that share cores still slow
+                each other down.
+        """
+        for t_step in t_steps:
+            if abs(settings.t_horizon / t_step - round(settings.t_horizon / t_step)) > 1e-9:
+                raise ValueError('t_horizon is not a multiple of t_step %g' % t_step)
+
+        self.settings = settings
+        self.resolutions = sorted(itertools.product(t_steps, cop_steps), key=lambda res: (res[0], -res[1]))
+        self.exp_step_offsets = exp_step_offsets
+        self.n_workers = n_workers
+
+        self.runtimes = None
+        self.errors = None
+        return
+
+
+    def compute(self):
+        """
+        =OUTPUT=
+            errors - ndarray of shape (n_resolution, n_error)
+                Absolute deviations from the finest resolution, in the order
+                of resolutions and ERRORS
+        =NOTES=
+            Also sets runtimes [s], of shape (n_resolution,). The finest
+            resolution is the first, the smallest t_step with the most CoP
+            offsets.
+        """
+        tasks = [(self.settings.replace(t_step=t_step, cop_steps=cop_steps), self.exp_step_offsets)
+                 for (t_step, cop_steps) in self.resolutions]
+        results = scenario.map_tasks(_run_scenario, tasks, self.n_workers)
+
+        self.runtimes = np.array([runtime for (runtime, _) in results])
+        reference = results[0][1]
+        self.errors = np.array([[_deviation(result[error], reference[error]) for error in ERRORS]
+                                for (_, result) in results])
+        return self.errors
+
+
+    def recommend(self, tolerance):
+        """
+        Cheapest resolution whose deviations are within tolerance.
+
+        =INPUT=
+            tolerance - dict
+                Maximum deviation of any of ERRORS, e.g.
+                {'step_pos': 0.005, 'swing_times': 0.01}
+        =OUTPUT=
+            resolution - tuple
+                (t_step, cop_steps), the finest if no other is within
+                tolerance
+        """
+        unknown = set(tolerance) - set(ERRORS)
+        if unknown:
+            raise ValueError('unknown errors %s' % sorted(unknown))
+
+        is_within = np.ones(len(self.resolutions), dtype=bool)
+        for (error, limit) in tolerance.items():
+            # NaN errors (metrics that are not computed) are not constraints
+            deviation = self.errors[:, ERRORS.index(error)]
+            is_within &= ~(deviation > limit)
+        is_within[0] = True
+
+        candidates = np.flatnonzero(is_within)
+        return self.resolutions[candidates[np.argmin(self.runtimes[candidates])]]
+
+
+    def report(self, tolerance=None):
+        """
+        Table of the runtimes and deviations as a str, the recommended
+        resolution for tolerance marked with *
+        """
+        recommended = self.recommend(tolerance) if tolerance else None
+        lines = ['  %8s %5s %9s' % ('t_step', 'cop', 'time [s]') + ''.join('%12s' % error for error in ERRORS)]
+        for (resolution, runtime, errors) in zip(self.resolutions, self.runtimes, self.errors):
+            mark = '*' if resolution == recommended else ' '
+            lines.append('%s %8g %5d %9.2f' % ((mark,) + resolution + (runtime,)) +
+                         ''.join('%12.3g' % error for error in errors))
+        return '\n'.join(lines)
+
+
+def run_scenario(settings, exp_step_offsets=None):
+    """
+    Steady state gait and the first steps after each of the perturbations
+    in settings, as in main.py.
+
+    =INPUT=
+        settings - SimulationSettings
+        exp_step_offsets - ndarray of shape (2, P) [None]
+            See SensitivityAnalysis
+    =OUTPUT=
+        result - dict
+            step_pos: the steady state step vectors (AP, ML) and the first
+            step after each perturbation relative to the CoM, swing_times:
+            the steady state swing times and the time of those first steps
+            after the perturbation, and the metrics of StepAnalysis.metrics
+    """
+    (baseline, sims) = scenario.walk(settings)
+    metrics = scenario.first_step_metrics(baseline, sims, exp_step_offsets)
+    pert_steps = [[sim.sim_data.step_pos[idx][0] - sim.sim_data.com_pos[idx][0] for idx in (0, 1)] for sim in sims]
+    pert_times = [sim.sim_data.time[0] for sim in sims]
+
+    # Step vectors instead of positions, which drift apart along the walk
+    steady_steps = np.diff(np.array(baseline.sim_data.step_pos, dtype=float), axis=1).T
+    result = {
+        'step_pos': np.concatenate([steady_steps.reshape(-1), np.reshape(pert_steps, -1)]),
+        'swing_times': np.concatenate([baseline.sim_data.time, pert_times])}
+    result.update(metrics)
+    return result
+
+
+def _run_scenario(task):
+    (settings, exp_step_offsets) = task
+    start = time.process_time()
+    result = run_scenario(settings, exp_step_offsets)
+    return time.process_time() - start, result
+
+
+def _deviation(value, reference):
+    return np.max(np.abs(np.subtract(value, reference)))
+
+
+if __name__ == '__main__':
+    study = ConvergenceStudy(SimulationSettings())
+    study.compute()
+    tolerance = {'step_pos': 0.005, 'swing_times': 0.01}
+    print(study.report(tolerance))
+    print('\nCheapest (t_step, cop_steps) within %s: %s' % (tolerance, study.recommend(tolerance)))
@@ -1,5 +1,4 @@
 from matplotlib import pyplot as plt
-from settings import SimulationSettings
 import numpy as np
 import math as m
 
@@ -8,7 +7,14 @@ class DataPlot(object):
     Class to plot the simulation data stored in DataStorage
     """
 
-    def __init__(self, storeddata):
+    # Colors of the perturbations and markers of the events
+    colors = (  (0, 0, 0.99608), (0, 0.50196, 0.99608), (0, 0.99608, 0.99608),
+                (0.50196, 0.99608, 0.50196), (0.99608, 0.99608, 0), (0.99608, 0.50196, 0), 
+                (0.99608, 0, 0), (0.50196, 0, 0) )
+
+    markers = ( 'o' , 'v' , ' x' , '+' , 'x', 'd' )
+
+    def __init__(self, storeddata, settings=None):
         """
         Data plotter
 
@@ -18,6 +24,8 @@ class DataPlot(object):
                             - CoP positions
                             - Step positions
                             - Time data
+            settings - SimulationSettings [None]
+                Settings of the simulation, needed for the cost plots
         
         =NOTES=
             Because we initialize this class twice (for the baseline model and for the perturbations)
@@ -25,16 +33,11 @@ class DataPlot(object):
             for the second initialisation
         """
         self.storage = storeddata
+        self.settings = settings
                     
         self.com_pos = storeddata.com_pos
         self.cop_pos = storeddata.cop_pos
         self.step_pos = storeddata.step_pos
-
-        self.colors = (  (0, 0, 0.99608), (0, 0.50196, 0.99608), (0, 0.99608, 0.99608),
-                    (0.50196, 0.99608, 0.50196), (0.99608, 0.99608, 0), (0.99608, 0.50196, 0), 
-                    (0.99608, 0, 0), (0.50196, 0, 0) )
-
-        self.markers = ( 'o' , 'v' , ' x' , '+' , 'x', 'd' )
         return
 
 
@@ -227,11 +230,11 @@ class DataPlot(object):
 
         # Take the already excisting data
         step_nrs = self.storage.cost_landscape_fullgait['step_number']
-        ankle_cost_ap = SimulationSettings.gain_ankle_cost_ap*np.asarray(self.storage.cost_landscape_fullgait['ankle_cost_ap'])
-        ankle_cost_ml = SimulationSettings.gain_ankle_cost_ml*np.asarray(self.storage.cost_landscape_fullgait['ankle_cost_ml'])
-        swing_cost_ap = SimulationSettings.gain_swing_cost_ap*np.asarray(self.storage.cost_landscape_fullgait['swing_cost_ap'])
-        swing_cost_ml = SimulationSettings.gain_swing_cost_ml*np.asarray(self.storage.cost_landscape_fullgait['swing_cost_ml'])
-        sts_cost = SimulationSettings.gain_sts_cost*np.asarray(self.storage.cost_landscape_fullgait['sts_cost'])
+        ankle_cost_ap = self.settings.gain_ankle_cost_ap*np.asarray(self.storage.cost_landscape_fullgait['ankle_cost_ap'])
+        ankle_cost_ml = self.settings.gain_ankle_cost_ml*np.asarray(self.storage.cost_landscape_fullgait['ankle_cost_ml'])
+        swing_cost_ap = self.settings.gain_swing_cost_ap*np.asarray(self.storage.cost_landscape_fullgait['swing_cost_ap'])
+        swing_cost_ml = self.settings.gain_swing_cost_ml*np.asarray(self.storage.cost_landscape_fullgait['swing_cost_ml'])
+        sts_cost = self.settings.gain_sts_cost*np.asarray(self.storage.cost_landscape_fullgait['sts_cost'])
 
         # Add all costs 
         full_cost = (ankle_cost_ap + ankle_cost_ml + swing_cost_ap + swing_cost_ml + sts_cost)
@@ -302,8 +305,7 @@ class DataPlot(object):
         swing_cost_ml = self.storage.cost_landscape_specificstep['swing_cost_ml'][0]
         sts_cost = self.storage.cost_landscape_specificstep['sts_cost'][0][0]
 
-        horizon = np.linspace(
-            SimulationSettings.t_step, SimulationSettings.t_horizon, int(SimulationSettings.t_horizon / SimulationSettings.t_step))
+        horizon = self.settings.horizon
 
         for i in range(len(ankle_cost_ap)): #TODO: Now used ankle_cost as counter for how many different units there are
             nr_of_subplots = len(ankle_cost_ap)
@@ -314,11 +316,11 @@ class DataPlot(object):
 
             #TODO: add way to not use swing cost ap but a general swing cost gain
             full_cost = (
-                SimulationSettings.gain_ankle_cost_ap * np.asarray(ankle_cost_ap[i])+
-                SimulationSettings.gain_ankle_cost_ml * np.asarray(ankle_cost_ml[0])+
-                SimulationSettings.gain_swing_cost_ap * np.asarray(swing_cost_ap[i])+
-                SimulationSettings.gain_swing_cost_ml * np.asarray(swing_cost_ml[0])+
-                SimulationSettings.gain_sts_cost * np.asarray(sts_cost[i]))
+                self.settings.gain_ankle_cost_ap * np.asarray(ankle_cost_ap[i])+
+                self.settings.gain_ankle_cost_ml * np.asarray(ankle_cost_ml[0])+
+                self.settings.gain_swing_cost_ap * np.asarray(swing_cost_ap[i])+
+                self.settings.gain_swing_cost_ml * np.asarray(swing_cost_ml[0])+
+                self.settings.gain_sts_cost * np.asarray(sts_cost[i]))
 
             idx_min_cost = np.argmin(full_cost)
             t_min = horizon[idx_min_cost]
@@ -353,6 +355,19 @@ class DataPlot(object):
 
 
     def show_plot(self, figure, x_lim, y_lim, y_label, x_label, title, backgroundcolor=(0.827, 0.827, 0.827), legend=False):
+        """
+        Format the figure (see format_plot) and show it.
+        """
+        self.format_plot(figure, x_lim, y_lim, y_label, x_label, title, backgroundcolor, legend)
+
+        #Show figure
+        figure.show()
+
+        return
+
+
+    @staticmethod
+    def format_plot(figure, x_lim, y_lim, y_label, x_label, title, backgroundcolor=(0.827, 0.827, 0.827), legend=False):
         """
         =INPUT=
         figure:
@@ -396,7 +411,4 @@ class DataPlot(object):
             #Add gridlines
             ax.grid()
 
-            #Show figure
-            figure.show()
-            
         return
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""
+Off-screen rendering of the DataPlot figures for many perturbations at once.
+Every series is drawn as a single collection (scatter or LineCollection) for
+all perturbations together, on Agg canvases that do not need a display, so
+figures can be rendered and written to files in worker processes.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib import cm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from data_plot import DataPlot
+
+
+class BatchDataPlot(object):
+    """
+    Collection-based counterpart of DataPlot for a baseline simulation and
+    any number of perturbations.
+    """
+
+    def __init__(self, baseline, perturbations, exp_step_offsets=None, exp_cop=None):
+        """
+        =INPUT=
+            baseline - DataStorage
+                Data of the steady state simulation
+            perturbations - list of DataStorage
+                Data of the perturbation simulations, which all take the
+                same number of steps
+            exp_step_offsets - ndarray of shape (2, P) [None]
+                Experimental step positions relative to the CoM (ML, AP) for
+                each of P perturbations, see ExperimentReadout.exp_step_pos
+            exp_cop - ndarray of shape (2, P, E) [None]
+                Experimental CoP positions for each perturbation and event,
+                see ExperimentReadout.cop_read
+        =NOTES=
+            Only plain arrays are stored, so that the object can be sent to
+            worker processes cheaply. As in DataPlot, index 0 is AP and
+            index 1 is ML, and figures have ML along the horizontal axis.
+        """
+        self.com_pos = np.asarray(baseline.com_pos, dtype=float)
+        self.cop_pos = np.asarray(baseline.cop_pos, dtype=float)
+        self.step_pos = np.asarray(baseline.step_pos, dtype=float)
+
+        # Arrays of shape (2, P, K) for P perturbations of K steps
+        self.pert_com_pos = np.stack([storage.com_pos for storage in perturbations], axis=1).astype(float)
+        self.pert_cop_pos = np.stack([storage.cop_pos for storage in perturbations], axis=1).astype(float)
+        self.pert_step_pos = np.stack([storage.step_pos for storage in perturbations], axis=1).astype(float)
+        self.n_pert = len(perturbations)
+
+        self.exp_step_offsets = exp_step_offsets
+        self.exp_cop = exp_cop
+
+        if self.n_pert <= len(DataPlot.colors):
+            self.colors = np.array(DataPlot.colors[:self.n_pert])
+        else:
+            self.colors = cm.jet(np.linspace(0, 1, self.n_pert))[:, :3]
+        return
+
+
+    @property
+    def last_step(self):
+        """
+        Last step (ML, AP) of the baseline, see main.py
+        """
+        return self.step_pos[::-1, -1]
+
+
+    @property
+    def last_com(self):
+        """
+        Last CoM position (ML, AP) of the baseline, see main.py
+        """
+        return self.com_pos[::-1, -1]
+
+
+    def plot(self):
+        """
+        Walking model figure with all perturbations, see DataPlot.plot and
+        DataPlot.exp_plot.
+        """
+        (figure, ax) = _new_figure()
+        cop_pos = self.cop_pos[:, 1:]
+        pert_colors = np.repeat(self.colors, self.pert_com_pos.shape[2], axis=0)
+
+        # Baseline
+        ax.plot(self.com_pos[1], self.com_pos[0], 'ok', markersize=10, label='CoM positions')
+        ax.plot(self.com_pos[1], self.com_pos[0], '--k')
+        ax.plot(self.step_pos[1][1::2], self.step_pos[0][1::2], '^',
+            markersize=8, markerfacecolor=(1, 1, 1, 0), markeredgecolor='b', label='foot position left')
+        ax.plot(self.step_pos[1][0::2], self.step_pos[0][0::2], '^',
+            markersize=8, markerfacecolor=(1, 1, 1, 0), markeredgecolor='r', label='foot position right')
+        ax.plot(self.cop_pos[1][0], self.cop_pos[0][0], '+',
+            markersize=8, markeredgecolor='k', label='Initial CoP position')
+        ax.plot(cop_pos[1][1::2], cop_pos[0][1::2], '+', markersize=8, markeredgecolor='b', label='CoP position left')
+        ax.plot(cop_pos[1][0::2], cop_pos[0][0::2], '+', markersize=8, markeredgecolor='r', label='CoP position right')
+
+        # Perturbations, walking paths from the last baseline CoM to the first perturbed CoM
+        segments = np.zeros((self.n_pert, 2, 2))
+        segments[:, 0] = self.last_com
+        segments[:, 1, 0] = self.pert_com_pos[1, :, 0]
+        segments[:, 1, 1] = self.pert_com_pos[0, :, 0]
+        ax.add_collection(LineCollection(segments, colors='k', linestyles='dashed'))
+        ax.scatter(self.pert_com_pos[1].ravel(), self.pert_com_pos[0].ravel(), s=10**2, c='k')
+        _scatter(ax, self.pert_step_pos[1].ravel(), self.pert_step_pos[0].ravel(), '^', pert_colors, 8)
+        _scatter(ax, self.pert_cop_pos[1].ravel(), self.pert_cop_pos[0].ravel(), '+', pert_colors, 8)
+
+        # Experimental data, relative to the first perturbed CoM
+        if self.exp_step_offsets is not None:
+            first_com = self.pert_com_pos[::-1, :, 0]
+            exp_steps = first_com + self.exp_step_offsets
+            _scatter(ax, exp_steps[0], exp_steps[1], 'o', self.colors, 8)
+            ax.scatter(first_com[0], first_com[1], s=10**2, marker='x', c=self.colors)
+
+        return figure
+
+
+    def step_plot(self):
+        """
+        First step after the perturbation relative to the CoM, see
+        DataPlot.step_plot.
+        """
+        (figure, ax) = _new_figure()
+        ax.plot(0, 0, 'ok', markersize=10)
+
+        # Model steps and the last baseline step, relative to the first perturbed CoM
+        steps = self.pert_step_pos[:, :, 0] - self.pert_com_pos[:, :, 0]
+        last_steps = self.last_step[:, None] - self.pert_com_pos[::-1, :, 0]
+        _scatter(ax, steps[1], steps[0], 'v', self.colors, 10, linewidth=1)
+        _scatter(ax, last_steps[0], last_steps[1], 'v', self.colors, 10, linewidth=1)
+
+        if self.exp_step_offsets is not None:
+            _scatter(ax, self.exp_step_offsets[0], self.exp_step_offsets[1], 'o', self.colors, 8)
+
+        return figure
+
+
+    def pert_plot(self):
+        """
+        Perturbation phase relative to the last baseline CoM, see
+        DataPlot.pert_plot.
+        """
+        (figure, ax) = _new_figure()
+        last_com = self.last_com
+        pert_colors = np.repeat(self.colors, self.pert_com_pos.shape[2], axis=0)
+
+        ax.plot(0, 0, 'ok', markersize=10)
+        latest_step = self.last_step - last_com
+        ax.plot(latest_step[0], latest_step[1], '^', markeredgecolor='b', markersize=10, markerfacecolor=(1, 1, 1, 0))
+
+        cop_x = (self.pert_cop_pos[1] - last_com[0]).ravel()
+        cop_y = (self.pert_cop_pos[0] - last_com[1]).ravel()
+        _scatter(ax, cop_x, cop_y, '+', pert_colors, 10)
+
+        com_x = (self.pert_com_pos[1] - last_com[0]).ravel()
+        com_y = (self.pert_com_pos[0] - last_com[1]).ravel()
+        ax.scatter(com_x, com_y, s=10**2, c='k')
+        ax.scatter(com_x, com_y, s=10**2, marker='x', c=pert_colors)
+
+        step_x = (self.pert_step_pos[1] - last_com[0]).ravel()
+        step_y = (self.pert_step_pos[0] - last_com[1]).ravel()
+        _scatter(ax, step_x, step_y, '^', pert_colors, 10)
+
+        if self.exp_step_offsets is not None:
+            exp_steps = self.pert_com_pos[::-1, :, 0] + self.exp_step_offsets - last_com[:, None]
+            _scatter(ax, exp_steps[0], exp_steps[1], 'o', self.colors, 10)
+
+        return figure
+
+
+    def exp_cop_plot(self):
+        """
+        Experimental CoP positions of all perturbations and events, see
+        DataPlot.exp_cop_plot. One collection per event.
+        """
+        (figure, ax) = _new_figure()
+        events = ('Prt start', 'Prt end', 'Heel-strike r', 'Toe-off r', 'Heel-strike l', 'Toe-off l')
+
+        for event_idx in range(self.exp_cop.shape[2]):
+            _scatter(ax, self.exp_cop[0, :, event_idx], self.exp_cop[1, :, event_idx],
+                DataPlot.markers[event_idx].strip(), self.colors, 10, linewidth=1,
+                label='%s prt' % events[event_idx])
+
+        return figure
+
+
+def save_figures(plot, jobs, directory, n_workers=None, dpi=100):
+    """
+    Render figures of a BatchDataPlot off-screen and write them to files,
+    in parallel.
+
+    =INPUT=
+        plot - BatchDataPlot
+        jobs - list of tuple
+            (method, filename, layout) with method the name of the figure
+            method of BatchDataPlot (e.g. 'pert_plot') and layout a dict of
+            keyword arguments for DataPlot.format_plot
+        directory - str
+            Directory the figures are written to, created if needed
+        n_workers - int [None]
+            Number of worker processes. If None, the cpu count is used.
+            If 1, figures are rendered in the current process.
+        dpi - int [100]
+    =OUTPUT=
+        paths - list of str
+            Paths of the written files, in the order of jobs
+    """
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(method, os.path.join(directory, filename), layout, dpi)
+             for (method, filename, layout) in jobs]
+
+    if n_workers == 1:
+        _init_worker(plot)
+        return list(map(_render, tasks))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(plot,)) as executor:
+        return list(executor.map(_render, tasks))
+
+
+def _new_figure():
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(1, 1, 1)
+    return figure, ax
+
+
+def _scatter(ax, x, y, marker, colors, markersize, linewidth=3, label=None):
+    """
+    Open markers with a color per point, like ax.plot with markerfacecolor
+    (1, 1, 1, 0) and markeredgecolor.
+    """
+    if marker in ('+', 'x'):
+        return ax.scatter(x, y, s=markersize**2, marker=marker, c=colors, linewidths=linewidth, label=label)
+    return ax.scatter(x, y, s=markersize**2, marker=marker, facecolors='none', edgecolors=colors,
+                      linewidths=linewidth, label=label)
+
+
+# Worker process state, set once per worker by _init_worker
+_worker = {}
+
+
+def _init_worker(plot):
+    _worker['plot'] = plot
+    return
+
+
+def _render(task):
+    (method, path, layout, dpi) = task
+    figure = getattr(_worker['plot'], method)()
+    DataPlot.format_plot(figure, **layout)
+    figure.savefig(path, dpi=dpi)
+    return path
@@ -16,6 +16,12 @@ class DataStorage(object):
         self.cost_landscape_specificstep = {'ankle_cost_ap': [], 'ankle_cost_ml': [], 'swing_cost_ap': [], 'swing_cost_ml': [], 'sts_cost': []}
 
         self.cost_landscape_fullgait = {'step_number': [], 'chosen_cop': [], 'ankle_cost_ap': [], 'ankle_cost_ml': [], 'swing_cost_ap': [], 'swing_cost_ml': [], 'sts_cost': []}
+
+        # State at the start of every swing segment, from which the trajectory is reconstructed, see Trajectory
+        self.segments = {'duration': [], 'com_pos': [], 'com_vel': [], 'foot_pos': [], 'cop_shift': [], 'leg_angle': [], 'final_leg_angle': [], 't_swing': [], 'is_right_swing': []}
+
+        # Pareto front of the cost components of every step, if stored, see pareto.scan_front
+        self.pareto_fronts = []
         return
 
     
@@ -38,6 +44,34 @@ class DataStorage(object):
         self.step_pos[1].append(step_pos_ml)
         return
 
+    def take_segment_sample(self, duration, com_pos, com_vel, foot_pos, cop_shift, leg_angle, final_leg_angle, t_swing, is_right_swing):
+        """
+        =INPUT=
+            duration - float
+                Time spent in the segment, t_swing unless the swing is
+                interrupted by a perturbation
+            com_pos, com_vel, foot_pos, cop_shift, leg_angle, final_leg_angle - tuple of float
+                (AP, ML) at the start of the segment, leg_angle and
+                final_leg_angle of the swing leg
+            t_swing - float
+                Swing time the swing leg profile was planned for
+            is_right_swing - bool
+        """
+        self.segments['duration'].append(duration)
+        self.segments['com_pos'].append(com_pos)
+        self.segments['com_vel'].append(com_vel)
+        self.segments['foot_pos'].append(foot_pos)
+        self.segments['cop_shift'].append(cop_shift)
+        self.segments['leg_angle'].append(leg_angle)
+        self.segments['final_leg_angle'].append(final_leg_angle)
+        self.segments['t_swing'].append(t_swing)
+        self.segments['is_right_swing'].append(is_right_swing)
+        return
+
+    def take_pareto_sample(self, front):
+        self.pareto_fronts.append(front)
+        return
+
     def take_stepspecific_cost_sample(self, ankle_cost_ap, ankle_cost_ml, swing_cost_ap, swing_cost_ml, sts_cost):
         self.cost_landscape_specificstep['ankle_cost_ap'].append(ankle_cost_ap)
         self.cost_landscape_specificstep['ankle_cost_ml'].append(ankle_cost_ml)
@@ -0,0 +1,350 @@
+"""
+Monte Carlo perturbation ensembles. A single steady state gait is simulated
+once, after which thousands of randomly drawn velocity perturbations are
+applied to copies of it in worker processes. Step placement, swing time and
+cost of the response steps are aggregated with streaming reducers, so no
+per-trial data has to be kept in memory.
+"""
+
+import math as m
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from simulator_v2 import Simulator
+
+
+class RunningStatistics(object):
+    """
+    Streaming mean, variance, minimum and maximum of a scalar quantity
+    (Welford's algorithm). Partial results of different workers can be
+    combined with merge.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        return
+
+
+    def push(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        return
+
+
+    def merge(self, other):
+        """
+        Combine with the statistics of another (disjoint) set of samples
+        (Chan et al, 1979).
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return
+
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+
+    @property
+    def std(self):
+        return m.sqrt(self.variance)
+
+
+class StreamingHistogram(object):
+    """
+    Fixed-bin histogram that counts samples as they arrive. Samples outside
+    of the bin range are counted as underflow or overflow.
+    """
+
+    def __init__(self, low, high, n_bins=50):
+        self.edges = np.linspace(low, high, n_bins + 1)
+        self.counts = np.zeros(n_bins, dtype=int)
+        self.underflow = 0
+        self.overflow = 0
+        return
+
+
+    def push(self, value):
+        if value < self.edges[0]:
+            self.underflow += 1
+        elif value > self.edges[-1]:
+            self.overflow += 1
+        else:
+            idx = min(np.searchsorted(self.edges, value, side='right') - 1, len(self.counts) - 1)
+            self.counts[idx] += 1
+        return
+
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return
+
+
+class PerturbationDistribution(object):
+    """
+    Distribution from which random velocity perturbations are drawn.
+
+    =INPUT=
+        magnitude - tuple
+            ('uniform', low, high) or ('normal', mean, std) of the magnitude
+            of the velocity change [m/s]
+        direction - tuple
+            Same format, angle of the velocity change in the horizontal plane
+            [rad]. 0 is a forward (AP) push, pi/2 a push to the left (ML).
+        pert_step - tuple of int
+            (first, last) step after steady state at which the perturbation
+            is applied, both inclusive
+    =NOTES=
+        The default draws combined AP and ML perturbations up to the largest
+        magnitude of SimulationSettings.perturbations in any direction, at
+        the first step after steady state.
+    """
+
+    def __init__(self, magnitude=('uniform', 0, 9.81 * 0.15 * 0.16),
+                 direction=('uniform', 0, 2 * np.pi), pert_step=(0, 0)):
+        self.magnitude = magnitude
+        self.direction = direction
+        self.pert_step = pert_step
+        return
+
+
+    def draw(self, rng):
+        """
+        =INPUT=
+            rng - numpy.random.Generator
+        =OUTPUT=
+            pert_ap, pert_ml - float
+                Velocity changes in AP and ML direction
+            pert_step - int
+                Step after steady state at which the perturbation is applied
+        """
+        magnitude = _sample(rng, self.magnitude)
+        direction = _sample(rng, self.direction)
+        pert_step = int(rng.integers(self.pert_step[0], self.pert_step[1] + 1))
+
+        return magnitude * m.cos(direction), magnitude * m.sin(direction), pert_step
+
+
+def _sample(rng, spec):
+    kind = spec[0]
+    if kind == 'uniform':
+        return rng.uniform(spec[1], spec[2])
+    elif kind == 'normal':
+        return rng.normal(spec[1], spec[2])
+    elif kind == 'constant':
+        return spec[1]
+    raise ValueError('Unknown distribution: {}'.format(kind))
+
+
+class EnsembleRunner(object):
+    """
+    Run a Monte Carlo ensemble of perturbations from one steady state gait.
+    """
+
+    # Quantities that are aggregated for each response step, with the range
+    # of their histograms
+    quantities = {
+        'step_pos_ap': (-0.5, 1.5),
+        'step_pos_ml': (-0.5, 0.5),
+        'swing_time': (0, 1),
+        'chosen_cop': (-0.1, 0.2),
+        'total_cost': (0, 200)}
+
+    def __init__(self, settings, distribution=None, seed=0, n_workers=None, chunk_size=64):
+        """
+        =INPUT=
+            settings - SimulationSettings
+            distribution - PerturbationDistribution [None]
+                If None, the default distribution is used
+            seed - int [0]
+                Root seed. Trial i always uses the i-th child seed, regardless
+                of the number of workers, the chunk size or how the trials
+                are split over calls of run.
+            n_workers - int [None]
+                Number of worker processes. If None, the cpu count is used.
+                If 1, trials are run in the current process.
+            chunk_size - int [64]
+                Number of trials handed to a worker at once
+        """
+        self.settings = settings
+        self.distribution = distribution if distribution is not None else PerturbationDistribution()
+        self.seed = seed
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+
+        # Every run spawns the next child seeds, so that no trial is repeated
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+        self.baseline = None
+        (self.statistics, self.histograms) = _reducers(settings)
+        self.n_trials = 0
+        return
+
+
+    def run_baseline(self):
+        """
+        Simulate the steady state gait that all trials start from.
+        """
+        self.baseline = Simulator(self.settings, cop_modulation=self.settings.cop_modulation_steady_state)
+        self.baseline.run(n_step=self.settings.n_step_to_steady_state, verbose=False)
+        return self.baseline
+
+
+    def run(self, n_trials):
+        """
+        Draw and simulate n_trials perturbations. Results are merged into
+        self.statistics and self.histograms, one reducer per quantity and
+        per response step.
+        """
+        if self.baseline is None:
+            self.run_baseline()
+
+        seeds = self.seed_sequence.spawn(n_trials)
+        chunks = [seeds[i:i + self.chunk_size] for i in range(0, n_trials, self.chunk_size)]
+
+        if self.n_workers == 1:
+            _init_worker(self.settings, self.baseline, self.distribution)
+            partials = map(_run_chunk, chunks)
+            self._merge_all(partials)
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker,
+                                     initargs=(self.settings, self.baseline, self.distribution)) as executor:
+                # map keeps the chunk order, so the merged result is independent of scheduling
+                self._merge_all(executor.map(_run_chunk, chunks))
+
+        self.n_trials += n_trials
+        return self.statistics
+
+
+    def _merge_all(self, partials):
+        for (statistics, histograms) in partials:
+            for name in statistics:
+                for i in range(len(statistics[name])):
+                    self.statistics[name][i].merge(statistics[name][i])
+                    self.histograms[name][i].merge(histograms[name][i])
+        return
+
+
+    def summary(self):
+        """
+        =OUTPUT=
+            summary - dict
+                For every quantity a list (one entry per response step) of
+                (mean, std, min, max), NaN before any trial
+        """
+        return {name: [(s.mean, s.std, s.minimum, s.maximum) if s.count > 0 else (np.nan,) * 4
+                       for s in self.statistics[name]]
+                for name in self.statistics}
+
+
+def run_trial(settings, baseline, pert_ap, pert_ml, pert_step):
+    """
+    Apply a single perturbation to a copy of the baseline simulation.
+
+    =INPUT=
+        settings - SimulationSettings
+        baseline - Simulator
+            Simulator in steady state gait
+        pert_ap, pert_ml - float
+            Velocity changes
+        pert_step - int
+            Number of unperturbed steps taken before the perturbation, by
+            the steady state controller as the baseline
+    =OUTPUT=
+        sim - Simulator
+            Only contains the response steps in its sim_data
+    """
+    if pert_step > 0:
+        steady = Simulator(settings, cop_modulation=settings.cop_modulation_steady_state)
+        baseline.copy_state_to(steady)
+        steady.run(n_step=pert_step, verbose=False)
+        baseline = steady
+
+    # The perturbation controller takes over at the perturbation
+    sim = Simulator(settings, cop_modulation=settings.cop_modulation_perturbation)
+    baseline.copy_state_to(sim)
+    sim.lip_ap.com_vel += pert_ap
+    sim.lip_ml.com_vel += pert_ml
+    sim.run(n_step=settings.n_step_post_perturbation, verbose=False)
+
+    return sim
+
+
+def step_quantities(settings, sim_data):
+    """
+    Per response step quantities of a trial. Step positions are relative to
+    the CoM at the moment of stepping, as in DataPlot.step_plot.
+    """
+    costs = sim_data.cost_landscape_fullgait
+    total_cost = (settings.gain_ankle_cost_ap * np.asarray(costs['ankle_cost_ap'])
+        + settings.gain_ankle_cost_ml * np.asarray(costs['ankle_cost_ml'])
+        + settings.gain_swing_cost_ap * np.asarray(costs['swing_cost_ap'])
+        + settings.gain_swing_cost_ml * np.asarray(costs['swing_cost_ml'])
+        + settings.gain_sts_cost * np.asarray(costs['sts_cost']))
+
+    return {
+        'step_pos_ap': np.subtract(sim_data.step_pos[0], sim_data.com_pos[0]),
+        'step_pos_ml': np.subtract(sim_data.step_pos[1], sim_data.com_pos[1]),
+        'swing_time': np.asarray(sim_data.time),
+        'chosen_cop': np.asarray(costs['chosen_cop']),
+        'total_cost': total_cost}
+
+
+# Worker process state, set once per worker by _init_worker
+_worker = {}
+
+
+def _init_worker(settings, baseline, distribution):
+    _worker['settings'] = settings
+    _worker['baseline'] = baseline
+    _worker['distribution'] = distribution
+    return
+
+
+def _reducers(settings):
+    """
+    Empty statistics and histograms, one per quantity and response step
+    """
+    n_response = settings.n_step_post_perturbation
+    statistics = {name: [RunningStatistics() for _ in range(n_response)] for name in EnsembleRunner.quantities}
+    histograms = {name: [StreamingHistogram(*limits) for _ in range(n_response)]
+                  for (name, limits) in EnsembleRunner.quantities.items()}
+    return statistics, histograms
+
+
+def _run_chunk(seeds):
+    settings = _worker['settings']
+    n_response = settings.n_step_post_perturbation
+    (statistics, histograms) = _reducers(settings)
+
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        (pert_ap, pert_ml, pert_step) = _worker['distribution'].draw(rng)
+        sim = run_trial(settings, _worker['baseline'], pert_ap, pert_ml, pert_step)
+
+        values = step_quantities(settings, sim.sim_data)
+        for name in values:
+            for i in range(n_response):
+                statistics[name][i].push(float(values[name][i]))
+                histograms[name][i].push(float(values[name][i]))
+
+    return statistics, histograms
@@ -0,0 +1,215 @@
+"""
+Equivalence of optimized scan paths with the reference full scan. The steps of
+the reference scenario (steady state gait and perturbation responses) are
+recorded once, with the total cost landscape of every scan, and frozen to a
+file. An alternative simulator or search mode is then checked against it:
+each recorded scan is replayed from the same state, and the scenario is
+walked again to compare trajectories.
+Run as python equivalence.py [freeze]
+"""
+
+import dataclasses
+import json
+import sys
+import numpy as np
+import scenario
+from settings import SimulationSettings
+from simulator_v2 import Simulator
+
+
+REFERENCE_FILE = 'equivalence_reference.npz'
+
+# Recorded per step, the state the scan starts from
+STATE_KEYS = ('simulation', 'com_pos', 'com_vel', 'foot_pos', 'leg_angle', 'is_right_swing', 'cop_modulation',
+              't_offset')
+
+# Search modes checked by default, as changes to the settings
+MODES = {
+    'full scan': {},
+    'pruned': {'prune_infeasible_steps': True, 'branch_and_bound': False},
+    'branch and bound': {'prune_infeasible_steps': True, 'branch_and_bound': True},
+    'branch and bound, 4 threads': {'prune_infeasible_steps': True, 'branch_and_bound': True, 'n_scan_workers': 4},
+    'scan cache': {'prune_infeasible_steps': True, 'branch_and_bound': True, 'scan_cache_size': 64}}
+
+
+class Reference(object):
+    """
+    Recorded steps and cost landscapes of the full scan, without pruning
+    and branch and bound, of the scenario of settings.
+    """
+
+    def __init__(self, settings, states, total_cost, decisions, step_pos, t_swing):
+        """
+        =INPUT=
+            settings - SimulationSettings
+            states - dict
+                Per recorded scan (N): simulation (-1 for the steady state,
+                else the perturbation index), com_pos, com_vel, foot_pos and
+                leg_angle of shape (N, 2) as (AP, ML), is_right_swing,
+                cop_modulation and t_offset
+            total_cost - ndarray of shape (N, n_cop, n_time)
+                NaN beyond the CoP offsets of a scan
+            decisions - ndarray of int of shape (N, 2)
+                (cop_idx, time_idx)
+            step_pos - ndarray of shape (N, 2)
+            t_swing - ndarray of shape (N,)
+        """
+        # The reference is the full scan, also in check without changes
+        self.settings = settings.replace(prune_infeasible_steps=False, branch_and_bound=False)
+        self.states = states
+        self.total_cost = total_cost
+        self.decisions = decisions
+        self.step_pos = step_pos
+        self.t_swing = t_swing
+        return
+
+
+    @classmethod
+    def record(cls, settings):
+        reference = settings.replace(prune_infeasible_steps=False, branch_and_bound=False)
+        steps = walk_scenario(reference)
+        states = {key: np.array([step[key] for step in steps]) for key in STATE_KEYS}
+        scans = [replay(reference, step) for step in steps]
+
+        n_cop = max(len(scan['total_cost']) for scan in scans)
+        total_cost = np.full((len(scans), n_cop, len(reference.horizon)), np.nan)
+        for (idx, scan) in enumerate(scans):
+            total_cost[idx, :len(scan['total_cost'])] = scan['total_cost']
+        decisions = np.array([(step['cop_idx'], step['time_idx']) for step in steps])
+        return cls(reference, states, total_cost, decisions,
+                   np.array([step['step_pos'] for step in steps]), np.array([step['t_swing'] for step in steps]))
+
+
+    def save(self, path=REFERENCE_FILE):
+        fields = dataclasses.asdict(self.settings)
+        np.savez_compressed(path, settings=json.dumps(fields), total_cost=self.total_cost, decisions=self.decisions,
+                            step_pos=self.step_pos, t_swing=self.t_swing,
+                            **{'state_' + key: value for (key, value) in self.states.items()})
+        return
+
+
+    @classmethod
+    def load(cls, path=REFERENCE_FILE):
+        with np.load(path) as data:
+            settings = SimulationSettings(**json.loads(str(data['settings'])))
+            states = {key: data['state_' + key] for key in STATE_KEYS}
+            return cls(settings, states, data['total_cost'], data['decisions'], data['step_pos'], data['t_swing'])
+
+
+    def check(self, changes=None, factory=Simulator, tolerance=1e-9):
+        """
+        Compare an alternative with the reference.
+
+        =INPUT=
+            changes - dict [None]
+                Changes to the settings, e.g. a search mode
+            factory - callable [Simulator]
+                factory(settings, cop_modulation) returns the simulator to
+                check, e.g. a Simulator subclass with another kernel
+            tolerance - float [1e-9]
+                Largest trajectory divergence [m, s] that passes
+        =OUTPUT=
+            result - dict
+                max_cost_deviation: largest absolute difference of the total
+                costs that are finite in both, over all replayed scans,
+                decision_changes: (scan, reference decision, decision) of the
+                replayed scans that choose another step, divergence: largest
+                difference of the step positions and swing times of the
+                walked scenario, first_divergence: (simulation, step) of the
+                first step taken differently or None, and passed
+        """
+        settings = self.settings.replace(**(changes or {}))
+        max_cost_deviation = 0.0
+        decision_changes = []
+
+        # Replay every recorded scan from the same state
+        for idx in range(len(self.decisions)):
+            step = {key: self.states[key][idx] for key in STATE_KEYS}
+            scan = replay(settings, step, factory)
+            total_cost = np.array(scan['total_cost'])
+            reference_cost = self.total_cost[idx, :len(total_cost)]
+            is_finite = np.isfinite(total_cost) & np.isfinite(reference_cost)
+            if is_finite.any():
+                max_cost_deviation = max(max_cost_deviation,
+                                         float(np.abs(total_cost - reference_cost)[is_finite].max()))
+            decision = (int(scan['best_cop_idx']), int(scan['best_time_idx']))
+            reference_decision = tuple(int(value) for value in self.decisions[idx])
+            if decision != reference_decision:
+                decision_changes.append((idx, reference_decision, decision))
+
+        # Walk the scenario, compare while the same steps are taken
+        steps = walk_scenario(settings, factory)
+        simulation = np.array([step['simulation'] for step in steps])
+        is_different = (len(steps) != len(self.decisions)) or not np.array_equal(simulation, self.states['simulation'])
+        divergence = np.inf if is_different else float(max(
+            np.abs(np.array([step['step_pos'] for step in steps]) - self.step_pos).max(),
+            np.abs(np.array([step['t_swing'] for step in steps]) - self.t_swing).max()))
+        first_divergence = None
+        for (idx, step) in enumerate(steps[:len(self.decisions)]):
+            if (step['cop_idx'], step['time_idx']) != tuple(self.decisions[idx]):
+                first_divergence = (int(step['simulation']), int(np.sum(simulation[:idx] == step['simulation'])))
+                break
+
+        return {
+            'max_cost_deviation': max_cost_deviation,
+            'decision_changes': decision_changes,
+            'divergence': divergence,
+            'first_divergence': first_divergence,
+            'passed': not decision_changes and first_divergence is None and divergence <= tolerance}
+
+
+def walk_scenario(settings, factory=Simulator):
+    """
+    Steady state gait and the responses to the perturbations in settings,
+    as in main.py.
+
+    =OUTPUT=
+        steps - list of dict
+            The step_callback records of Simulator.take_step, with the
+            STATE_KEYS, in order of simulation
+    """
+    steps = []
+
+    def recorder(simulation, sim):
+        cop_modulation = settings.cop_modulation_steady_state if simulation < 0 else settings.cop_modulation_perturbation
+
+        def record(step):
+            step.update(simulation=simulation, is_right_swing=sim.is_right_swing, cop_modulation=cop_modulation)
+            steps.append(step)
+            return
+        return record
+
+    scenario.walk(settings, factory, recorder)
+    return steps
+
+
+def replay(settings, step, factory=Simulator):
+    """
+    Horizon scan from the state a recorded step started from, see
+    Simulator.scan_horizon. It goes through Simulator.cached_scan, so with
+    scan_cache_size > 0 a scan may be a hit on the shared scan cache, and
+    the replayed scans check the cache as well.
+    """
+    sim = factory(settings, cop_modulation=bool(step['cop_modulation']))
+    for (lip, idx) in ((sim.lip_ap, 0), (sim.lip_ml, 1)):
+        lip.override_state(step['com_pos'][idx], step['com_vel'][idx], step['foot_pos'][idx],
+                           step['foot_pos'][idx], cop_shift=0)
+    sim.is_right_swing = bool(step['is_right_swing'])
+    n_feasible = sim.n_feasible(step['t_offset']) if step['t_offset'] > 0 else None
+    return sim.cached_scan(step['leg_angle'][0], step['leg_angle'][1], n_feasible=n_feasible)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['freeze']:
+        Reference.record(SimulationSettings()).save()
+        sys.exit()
+
+    reference = Reference.load()
+    is_passed = True
+    for (name, changes) in MODES.items():
+        result = reference.check(changes)
+        is_passed &= result['passed']
+        print('%-28s %s  max cost deviation %.3g, %d decision changes, divergence %.3g, first at %s' % (
+            name, 'pass' if result['passed'] else 'FAIL', result['max_cost_deviation'],
+            len(result['decision_changes']), result['divergence'], result['first_divergence']))
+    sys.exit(0 if is_passed else 1)
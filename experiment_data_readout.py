@@ -1,4 +1,20 @@
+import os
+import numpy as np
 import scipy.io as sio
+from multiprocessing import shared_memory
+
+# Note: Pathing must be changed to where you have stored the experimental data locally
+DATA_DIRECTORY = '/home/jitseve/Documents/bacheloropdracht/Exp_Data_2'
+
+# Datasets by name: (file, variable in the file)
+DATASETS = {
+    'com_mean_perturbation': ('com_mean_perturbation.mat', 'comDatape_m2'),
+    'cop_mean_perturbation': ('cop_mean_perturbation.mat', 'copDatape_m2')}
+
+# Datasets of this process, loaded or attached, and the shared memory blocks they live in
+_datasets = {}
+_attached_blocks = []
+
 
 class ExperimentReadout(object):
     """
@@ -26,12 +42,8 @@ class ExperimentReadout(object):
             perts_com_pos: position of the COM of the current perturbation
             experiment: decides from which experiment the value's will be read
         """
-        # Use Scipy to load the data
-        # Note: Pathing must be changed to where you have stored the experimental data locally
-        com_mean_perturbation = sio.loadmat('/home/jitseve/Documents/bacheloropdracht/Exp_Data_2/com_mean_perturbation.mat')
-
-        # Get the numpy array from the created dictionary
-        com_mean_perturbation = com_mean_perturbation['comDatape_m2']
+        # Loaded once per process, or attached from shared memory
+        com_mean_perturbation = experiment_data()['com_mean_perturbation']
       
         # Read model CoM location
         self.com_pos[0].append(perts_com_pos[0])           # X-coordinates 
@@ -63,11 +75,7 @@ class ExperimentReadout(object):
         pert_counter: decides which perturbation value needs to be read
         experiment: decide from which experiment values need to be read 
         """
-        # Use Scipy to load the data
-        cop_mean_perturbation = sio.loadmat('/home/jitseve/Documents/bacheloropdracht/Exp_Data_2/cop_mean_perturbation.mat')
-
-        # Get the numpy array
-        cop_mean_perturbation = cop_mean_perturbation['copDatape_m2']
+        cop_mean_perturbation = experiment_data()['cop_mean_perturbation']
 
         # Save the x and y data in self
         cop_xlocation = cop_mean_perturbation[event, plate*2, pert_counter, experiment]
@@ -75,4 +83,91 @@ class ExperimentReadout(object):
         self.cop_pos[0].append(cop_xlocation)
         self.cop_pos[1].append(cop_ylocation)
 
-        return
\ No newline at end of file
+        return
+
+
+def load_experiment_data(directory=DATA_DIRECTORY):
+    """
+    Read the experimental datasets (Vlutters et al, 2017) from their files.
+    =OUTPUT=
+        datasets - dict
+            ndarray by name, see DATASETS
+    """
+    return {name: np.asarray(sio.loadmat(os.path.join(directory, file))[variable])
+            for (name, (file, variable)) in DATASETS.items()}
+
+
+def experiment_data():
+    """
+    The experimental datasets of this process, read from DATA_DIRECTORY on
+    first use unless attached from shared memory, see SharedExperimentData
+    """
+    if not _datasets:
+        _datasets.update(load_experiment_data())
+    return _datasets
+
+
+class SharedExperimentData(object):
+    """
+    Experimental datasets in shared memory blocks, loaded once by the parent
+    process and attached by worker processes without copying or parsing.
+
+    Use as
+        with SharedExperimentData() as shared:
+            executor = ProcessPoolExecutor(initializer=attach, initargs=(shared.descriptor,))
+    after which ExperimentReadout in the workers reads the shared arrays.
+    """
+
+    def __init__(self, datasets=None):
+        """
+        =INPUT=
+            datasets - dict [None]
+                ndarray by name, if None see experiment_data
+        """
+        if datasets is None:
+            datasets = experiment_data()
+
+        self.blocks = []
+        self.descriptor = {}
+        for (name, array) in datasets.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.descriptor[name] = (block.name, array.shape, array.dtype.str)
+        return
+
+
+    def close(self):
+        """
+        Free the shared memory, after the workers are done
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        return
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return
+
+
+def attach(descriptor):
+    """
+    Use the shared datasets of descriptor (SharedExperimentData.descriptor)
+    in this process, e.g. as initializer of a worker pool. The arrays are
+    read-only views on the shared memory.
+    """
+    for (name, (block_name, shape, dtype)) in descriptor.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _attached_blocks.append(block)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        _datasets[name] = array
+    return
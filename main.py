@@ -14,10 +14,14 @@ from settings import SimulationSettings
 from simulator_v2 import Simulator
 from data_plot import DataPlot
 from step_analysis import StepAnalysis
-from experiment_data_readout import ExperimentReadout as ExpReadout
+from experiment_data_readout import ExperimentReadout as ExpReadout, experiment_data
+from comparison import first_steps, experiment_step_offsets, compare_steps
 
 start_time = t.time()
 
+settings = SimulationSettings()
+print(settings.gains_description())
+
 # Container to store all simulation instances
 simulations = []
 
@@ -26,9 +30,9 @@ exp_steps = [[],[]]
 model_steps = [[],[]]
 
 # Baseline simulation to steady state gait
-simulation = Simulator(SimulationSettings, cop_modulation=SimulationSettings.cop_modulation_steady_state)
-simulation.run(n_step=SimulationSettings.n_step_to_steady_state)
-data_plot = DataPlot(simulation.sim_data)
+simulation = Simulator(settings, cop_modulation=settings.cop_modulation_steady_state)
+simulation.run(n_step=settings.n_step_to_steady_state)
+data_plot = DataPlot(simulation.sim_data, settings)
 (lastvalues, figure_plot, pert_com_pos) = data_plot.plot()
 simulations.append(simulation)
 
@@ -45,27 +49,27 @@ stepfigure = None
 pertfigure = None
 
 # Save last step of steady-state gait
-last_step = [simulation.sim_data.step_pos[1][SimulationSettings.n_step_to_steady_state-1],
-            simulation.sim_data.step_pos[0][SimulationSettings.n_step_to_steady_state-1]]
+last_step = [simulation.sim_data.step_pos[1][settings.n_step_to_steady_state-1],
+            simulation.sim_data.step_pos[0][settings.n_step_to_steady_state-1]]
 
-last_com = [simulation.sim_data.com_pos[1][SimulationSettings.n_step_to_steady_state-1],
-            simulation.sim_data.com_pos[0][SimulationSettings.n_step_to_steady_state-1]]
+last_com = [simulation.sim_data.com_pos[1][settings.n_step_to_steady_state-1],
+            simulation.sim_data.com_pos[0][settings.n_step_to_steady_state-1]]
 
 # Duplicate the base simulation, then give a different perturbation to each
-for pert_idx in range(len(SimulationSettings.perturbations)):
-    pert = SimulationSettings.perturbations[pert_idx]
-    sim = Simulator(SimulationSettings, cop_modulation=SimulationSettings.cop_modulation_perturbation)
+for pert_idx in range(len(settings.perturbations)):
+    pert = settings.perturbations[pert_idx]
+    sim = Simulator(settings, cop_modulation=settings.cop_modulation_perturbation)
     simulation.copy_state_to(sim)
-    data_plot = DataPlot(sim.sim_data)
+    data_plot = DataPlot(sim.sim_data, settings)
     
-    # Adjust the velocity with the perturbation dependent on chosen perturbation direction in settings
-    if SimulationSettings.pertAP is True:
-        sim.lip_ap.com_vel += pert
+    # Adjust the velocity with the perturbation dependent on chosen perturbation direction in settings,
+    # then simulate another few steps
+    if settings.pertAP is True:
+        (pert_ap, pert_ml) = (pert, 0)
     else:
-        sim.lip_ml.com_vel += pert
-    
-    # Simulate another few steps
-    sim.run(n_step=SimulationSettings.n_step_post_perturbation, pert_counter=pert_idx)
+        (pert_ap, pert_ml) = (0, pert)
+    sim.perturb(settings.t_perturbation, pert_ap=pert_ap, pert_ml=pert_ml,
+                n_step=settings.n_step_post_perturbation, pert_counter=pert_idx)
     (lastvalues, figure_plot, pert_com_pos) = data_plot.plot(figure=figure_plot, lastvalue=lastvalues, pert_counter=pert_idx)
     
     # Store the simulation
@@ -73,7 +77,7 @@ for pert_idx in range(len(SimulationSettings.perturbations)):
 
     # Take experimental data
     exp_data = ExpReadout()
-    (exp_step_pos_y, exp_step_pos_x) = exp_data.com_step_read(pert_counter=pert_idx, perts_com_pos=pert_com_pos, experiment=SimulationSettings.experiment_number)
+    (exp_step_pos_y, exp_step_pos_x) = exp_data.com_step_read(pert_counter=pert_idx, perts_com_pos=pert_com_pos, experiment=settings.experiment_number)
     exp_steps[1].append(exp_step_pos_y)
     exp_steps[0].append(exp_step_pos_x)
 
@@ -96,7 +100,7 @@ for pert_idx in range(len(SimulationSettings.perturbations)):
     for event_idx in range(0,4):    #For loop to walk through the different events
         # Take experimental CoP data
         exp_copdata = ExpReadout()
-        exp_copdata.cop_read(event=event_idx, plate=SimulationSettings.plate_number, pert_counter=pert_idx, experiment=SimulationSettings.experiment_number)
+        exp_copdata.cop_read(event=event_idx, plate=settings.plate_number, pert_counter=pert_idx, experiment=settings.experiment_number)
 
         # Plot experimental CoP data
         exp_copdata_plot = DataPlot(exp_copdata)
@@ -115,10 +119,10 @@ Following plot lines can be used to plot extra data such as cost analysis figure
 # exp_copdata_plot.show_plot(figure= copfigure, x_lim=[-0.05, 0.3], y_lim=[-0.5, 0.5], y_label='y', x_label='x',
 #                             title='Experimental CoP data')
 
-# data_plot.show_plot(figure = step_specific_cost_figure, x_lim=[0,SimulationSettings.t_horizon], y_lim=[0,100], y_label='costs',
+# data_plot.show_plot(figure = step_specific_cost_figure, x_lim=[0,settings.t_horizon], y_lim=[0,100], y_label='costs',
 #                         x_label='swing time', title='cost posibilities of step {}'.format(stepnr), legend=True)
 
-# data_plot.show_plot(figure = cost_figure, x_lim=[0,SimulationSettings.n_step_to_steady_state], y_lim=[0,10], y_label='costs',
+# data_plot.show_plot(figure = cost_figure, x_lim=[0,settings.n_step_to_steady_state], y_lim=[0,10], y_label='costs',
 #                         x_label= 'step number', title= 'Cost analysis for full steady state gait', legend=True)
 
 # data_plot.show_plot(figure= stepfigure, x_lim=[-0.3, 0.3], y_lim=[-0.6, 0.6],
@@ -131,5 +135,11 @@ print('-------------- RUN ENDED, ANALYSIS BEGINS --------------')
 analysis = StepAnalysis(model_steps, exp_steps, simulation.sim_data.step_pos, simulation.sim_data.time, simulation.sim_data.com_vel)
 analysis.compute_analysis_variables()
 
+# Compare the first steps after the perturbations with those of all experiments at once
+(model_step_pos, model_com_pos, _) = first_steps([sim.sim_data for sim in simulations[1:]])
+(_, summary) = compare_steps(model_step_pos, model_com_pos,
+                             experiment_step_offsets(experiment_data()['com_mean_perturbation']))
+for (experiment, r2_ml, r2_ap, rms) in zip(summary['experiment'], summary['r2_ml'], summary['r2_ap'], summary['rms']):
+    print('experiment %d: r-squared ML %.3f, r-squared AP %.3f, RMS %.4f' % (experiment, r2_ml, r2_ap, rms))
 
-print("--- %s seconds ---" % (t.time() - start_time))
\ No newline at end of file
+print("--- %s seconds ---" % (t.time() - start_time))
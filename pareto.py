@@ -0,0 +1,119 @@
+"""
+Pareto fronts of the cost components of horizon scans. The controller takes
+the argmin of a weighted sum of the components; for any positive gains that
+argmin is one of the candidate steps (CoP offset x swing time) that are not
+dominated in the components. Storing only those candidates per step (see
+SimulationSettings.store_pareto_front) is enough to find the step that any
+other gains would have chosen from the same state.
+"""
+
+import numpy as np
+
+
+# Cost components, each weighted by the gain of the same name (e.g. gain_sts_cost)
+COMPONENTS = ('swing_cost_ap', 'swing_cost_ml', 'sts_cost', 'ankle_cost_ap', 'ankle_cost_ml')
+
+
+def pareto_front(costs):
+    """
+    =INPUT=
+        costs - ndarray of shape (K, D)
+            D cost components of K candidates
+    =OUTPUT=
+        indices - ndarray of int
+            Increasing indices of the candidates that are not dominated by
+            another: no other candidate is at most as high in every
+            component. Of equal candidates, only the first is kept.
+    """
+    costs = np.asarray(costs, dtype=float)
+    indices = np.arange(len(costs))
+
+    # Every pass removes the candidates the current one dominates or equals
+    current = 0
+    while current < len(costs):
+        is_kept = np.any(costs < costs[current], axis=1)
+        is_kept[current] = True
+        indices = indices[is_kept]
+        costs = costs[is_kept]
+        current = np.sum(is_kept[:current]) + 1
+    return indices
+
+
+def scan_front(scan):
+    """
+    Pareto front of the candidate steps of a horizon scan, see
+    Simulator.scan_horizon.
+
+    =OUTPUT=
+        front - dict
+            cop_idx and time_idx of shape (F,) and costs of shape (F, D) in
+            the order of COMPONENTS, ordered as the candidates of the scan
+            (CoP offset, then time). Candidates that can not be chosen
+            (infinite total cost, e.g. pruned or beyond the horizon) and
+            infeasible steps (see step_to_step.transition_cost) are left out.
+    """
+    n_cop = len(scan['total_cost'])
+    n_time = len(scan['total_cost'][0])
+    costs = np.empty((n_cop, n_time, len(COMPONENTS)))
+    for i in range(n_cop):
+        costs[i, :, 0] = scan['swing_cost_ap'][i]
+        costs[i, :, 1] = scan['swing_cost_ml'][0]
+        costs[i, :, 2] = scan['sts_cost'][0][i]
+        costs[i, :, 3] = scan['ankle_cost_ap'][i]
+        costs[i, :, 4] = scan['ankle_cost_ml'][0]
+    costs = costs.reshape(-1, len(COMPONENTS))
+
+    is_candidate = np.isfinite(np.ravel(scan['total_cost'])) & (costs[:, 2] < 2**64 - 1)
+    candidates = np.flatnonzero(is_candidate)
+    candidates = candidates[pareto_front(costs[candidates])]
+    return {'cop_idx': candidates // n_time, 'time_idx': candidates % n_time, 'costs': costs[candidates]}
+
+
+def choose(front, gains):
+    """
+    Step chosen from a Pareto front with other gains.
+
+    =INPUT=
+        front - dict
+            See scan_front
+        gains - SimulationSettings or dict
+            The gains (gain_swing_cost_ap, ...), positive
+    =OUTPUT=
+        cop_idx, time_idx - int
+            None if the front is empty
+    =NOTES=
+        The weighted sum is that of Simulator.total_cost, and ties go to
+        the first candidate, as in Simulator.scan_horizon. The choice is that
+        of a scan from the state of the step; steps after it would differ.
+    """
+    if len(front['cop_idx']) == 0:
+        return None, None
+    if not isinstance(gains, dict):
+        gains = {'gain_' + name: getattr(gains, 'gain_' + name) for name in COMPONENTS}
+
+    costs = front['costs']
+    total_cost = gains['gain_' + COMPONENTS[0]] * costs[:, 0]
+    for (idx, name) in enumerate(COMPONENTS[1:], start=1):
+        total_cost = total_cost + gains['gain_' + name] * costs[:, idx]
+    best = np.argmin(total_cost)
+    return int(front['cop_idx'][best]), int(front['time_idx'][best])
+
+
+def front_table(fronts):
+    """
+    Tidy table of the Pareto fronts of a simulation, see
+    DataStorage.pareto_fronts and comparison.write_table
+
+    =OUTPUT=
+        table - dict
+            step, cop_idx, time_idx and the COMPONENTS, one row per
+            candidate
+    """
+    table = {
+        'step': np.concatenate([np.full(len(front['cop_idx']), idx) for (idx, front) in enumerate(fronts)]),
+        'cop_idx': np.concatenate([front['cop_idx'] for front in fronts]),
+        'time_idx': np.concatenate([front['time_idx'] for front in fronts])}
+    costs = np.concatenate([front['costs'] for front in fronts])
+    for (idx, name) in enumerate(COMPONENTS):
+        table[name] = costs[:, idx]
+    return table
@@ -0,0 +1,299 @@
+"""
+Pipelined runs of many settings: simulation on worker processes, experiment
+loading and comparison on a thread, and figure rendering on the calling
+thread, connected by bounded queues so that the stages overlap. Outputs are
+produced in the order of the jobs, as if they were run one after another.
+Run as python pipeline.py spec.json [--results DIR] [--workers N]
+"""
+
+import argparse
+import collections
+import os
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import scenario
+from step_analysis import StepAnalysis
+from data_plot import DataPlot
+from data_plot_batch import BatchDataPlot
+from comparison import first_steps, experiment_step_offsets, compare_steps
+from experiment_data_readout import experiment_data
+
+
+# Figures rendered per job: BatchDataPlot method and DataPlot.format_plot layout, see main.py
+FIGURES = (
+    ('plot', {'x_lim': [-0.15, 0.15], 'y_lim': [9.15, 10.22], 'y_label': 'y', 'x_label': 'x',
+              'title': 'Linear inverted pendulum walking model'}),
+    ('step_plot', {'x_lim': [-0.3, 0.3], 'y_lim': [-0.6, 0.6], 'y_label': 'AP', 'x_label': 'ML',
+                   'title': 'step positions after perturbations'}),
+    ('pert_plot', {'x_lim': [-0.14, 0.14], 'y_lim': [-0.05, 1.03], 'y_label': 'AP', 'x_label': 'ML',
+                   'title': 'perturbation phase'}))
+
+# End of a queue
+_DONE = object()
+
+# Interval [s] at which blocked stages check whether the pipeline stopped
+_POLL = 0.1
+
+
+class Pipeline(object):
+    """
+    Simulation, analysis and figures of a list of jobs, each stage working
+    on the next job while the following stage handles the previous one.
+    """
+
+    def __init__(self, jobs, directory, experiment=True, figures=FIGURES, n_workers=None, queue_size=2, dpi=100):
+        """
+        =INPUT=
+            jobs - list of tuple
+                (name, settings), name is used in the figure file names
+            directory - str
+                Figures are written to directory/<name>_<method>.png
+            experiment - bool or ndarray [True]
+                If True, the experiment data is loaded (see experiment_data)
+                and compared to the model. An ndarray replaces the loaded
+                data: the experimental step offsets of shape (E, 2, P), see
+                comparison.experiment_step_offsets. If False, there is no
+                comparison.
+            figures - sequence of tuple [FIGURES]
+                (method, layout) of the figures of every job
+            n_workers - int [None]
+                Number of simulation worker processes. If None, the cpu
+                count is used. If 1, jobs are simulated on a thread.
+            queue_size - int [2]
+                Maximum number of jobs waiting between two stages
+            dpi - int [100]
+        """
+        self.jobs = jobs
+        self.directory = directory
+        self.experiment = experiment
+        self.figures = figures
+        self.n_workers = n_workers
+        self.queue_size = queue_size
+        self.dpi = dpi
+
+        # Busy time [s] of every stage in the last run, for the simulation
+        # summed over the workers
+        self.stage_times = {}
+        return
+
+
+    def run(self, progress=print):
+        """
+        =INPUT=
+            progress - callable [print]
+                Called with a line of text for every finished job, None for
+                silence
+        =OUTPUT=
+            results - list of dict
+                Per job, in order: name, metrics (StepAnalysis.metrics,
+                against the experiment of the settings), summary (of
+                comparison.compare_steps against all experiments, None
+                without experiment) and figures (paths)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.stage_times = {'simulation': 0.0, 'analysis': 0.0, 'figures': 0.0}
+        simulated = queue.Queue(self.queue_size)
+        analysed = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        threads = [threading.Thread(target=_stage, args=(self.simulate_all, None, simulated, stop), daemon=True),
+                   threading.Thread(target=_stage, args=(self.analyse_all, simulated, analysed, stop), daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        # On an error the other stages stop, and pending simulations are cancelled
+        results = []
+        start = time.perf_counter()
+        try:
+            while True:
+                item = analysed.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                t_start = time.perf_counter()
+                results.append(self.render(*item))
+                self.stage_times['figures'] += time.perf_counter() - t_start
+                if progress is not None:
+                    progress('[%d/%d] %s (%.1f s)' % (len(results), len(self.jobs), results[-1]['name'],
+                                                      time.perf_counter() - start))
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        return results
+
+
+    def simulate_all(self):
+        """
+        Simulated jobs, in order, at most n_workers + queue_size ahead.
+        Closing the generator cancels the jobs that have not started.
+        """
+        if self.n_workers == 1:
+            for (name, settings) in self.jobs:
+                yield self.collect(name, settings, simulate, settings)
+            return
+
+        executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        try:
+            n_ahead = (self.n_workers or os.cpu_count()) + self.queue_size
+            pending = collections.deque()
+            for (name, settings) in self.jobs:
+                pending.append((name, settings, executor.submit(simulate, settings).result))
+                if len(pending) > n_ahead:
+                    yield self.collect(*pending.popleft())
+            while pending:
+                yield self.collect(*pending.popleft())
+        finally:
+            executor.shutdown(cancel_futures=True)
+        return
+
+
+    def collect(self, name, settings, function, *args):
+        """
+        (name, settings, baseline, perturbations) of a job, function returns
+        its simulation data and duration, see simulate
+        """
+        (baseline, perturbations, duration) = function(*args)
+        self.stage_times['simulation'] += duration
+        return name, settings, baseline, perturbations
+
+
+    def analyse_all(self, simulated):
+        for (name, settings, baseline, perturbations) in simulated:
+            t_start = time.perf_counter()
+            analysis = self.analyse(settings, baseline, perturbations)
+            self.stage_times['analysis'] += time.perf_counter() - t_start
+            yield (name, baseline, perturbations) + analysis
+        return
+
+
+    def analyse(self, settings, baseline, perturbations):
+        """
+        =OUTPUT=
+            metrics - dict
+                See StepAnalysis.metrics, r2_ml, r2_ap and rms are NaN
+                without experiment
+            summary - dict
+                See comparison.compare_steps, None without experiment
+            exp_step_offsets - ndarray of shape (2, P)
+                Of the experiment of settings (experiment_number), None
+                without experiment
+        """
+        (model_step_pos, model_com_pos, _) = first_steps(perturbations)
+        if self.experiment is False:
+            (summary, exp_step_offsets) = (None, None)
+            exp_step_pos = model_step_pos
+        else:
+            if self.experiment is True:
+                all_offsets = experiment_step_offsets(experiment_data()['com_mean_perturbation'])
+            else:
+                all_offsets = np.asarray(self.experiment)
+            all_offsets = all_offsets[:, :, :len(perturbations)]
+            (_, summary) = compare_steps(model_step_pos, model_com_pos, all_offsets)
+            exp_step_offsets = all_offsets[settings.experiment_number]
+            exp_step_pos = model_com_pos + exp_step_offsets
+
+        # StepAnalysis takes the model steps as (AP, ML) and the experimental ones as (ML, AP)
+        metrics = StepAnalysis(model_step_pos[::-1], exp_step_pos, baseline.step_pos,
+                               baseline.time, baseline.com_vel).metrics()
+        if exp_step_offsets is None:
+            metrics.update(r2_ml=np.nan, r2_ap=np.nan, rms=np.nan)
+        return metrics, summary, exp_step_offsets
+
+
+    def render(self, name, baseline, perturbations, metrics, summary, exp_step_offsets):
+        plot = BatchDataPlot(baseline, perturbations, exp_step_offsets=exp_step_offsets)
+        paths = []
+        for (method, layout) in self.figures:
+            figure = getattr(plot, method)()
+            DataPlot.format_plot(figure, **layout)
+            paths.append(os.path.join(self.directory, '%s_%s.png' % (name, method)))
+            figure.savefig(paths[-1], dpi=self.dpi)
+        return {'name': name, 'metrics': metrics, 'summary': summary, 'figures': paths}
+
+
+def simulate(settings):
+    """
+    Steady state gait and the responses to the perturbations in settings,
+    as in main.py.
+
+    =OUTPUT=
+        baseline - DataStorage
+        perturbations - list of DataStorage
+        duration - float
+            Time [s] spent simulating, in the worker
+    """
+    t_start = time.perf_counter()
+    (baseline, sims) = scenario.walk(settings)
+    return baseline.sim_data, [sim.sim_data for sim in sims], time.perf_counter() - t_start
+
+
+def _stage(produce, source, sink, stop):
+    """
+    Put the items of produce (from the items of source, a queue) on sink,
+    then _DONE. An exception is passed on instead, ending the pipeline.
+    Once stop is set, produce is closed and nothing more is put.
+    """
+    items = None
+    try:
+        items = produce() if source is None else produce(_drain(source, stop))
+        for item in items:
+            if not _put(sink, item, stop):
+                return
+    except BaseException as error:
+        _put(sink, error, stop)
+        return
+    finally:
+        if items is not None:
+            items.close()
+    _put(sink, _DONE, stop)
+    return
+
+
+def _put(sink, item, stop):
+    """
+    Put item on sink, False if stop is set first
+    """
+    while not stop.is_set():
+        try:
+            sink.put(item, timeout=_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(source, stop):
+    while True:
+        try:
+            item = source.get(timeout=_POLL)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+if __name__ == '__main__':
+    from sweep import load_spec, expand_jobs
+
+    parser = argparse.ArgumentParser(description='Simulate, analyse and plot the jobs of a sweep spec')
+    parser.add_argument('spec', help='JSON or TOML job spec, see sweep.py')
+    parser.add_argument('--results', default='results', help='results directory [results]')
+    parser.add_argument('--workers', type=int, default=None, help='simulation worker processes [cpu count]')
+    parser.add_argument('--no-experiment', action='store_true', help='do not compare to the experiment data')
+    arguments = parser.parse_args()
+
+    spec = load_spec(arguments.spec)
+    jobs = [('%d' % idx, settings) for (idx, (_, settings)) in enumerate(expand_jobs(spec))]
+    pipeline = Pipeline(jobs, os.path.join(arguments.results, spec['name'], 'figures'),
+                        experiment=not arguments.no_experiment, n_workers=arguments.workers)
+    pipeline.run()
+    print(', '.join('%s %.1f s' % item for item in pipeline.stage_times.items()))
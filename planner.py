@@ -0,0 +1,226 @@
+"""
+Multi-step lookahead for the walking controller. Instead of the step with the
+lowest cost, the walker takes the first step of the sequence of n_lookahead
+steps with the lowest summed cost, re-planned after every step.
+"""
+
+import collections
+import numpy as np
+from simulator_v2 import Simulator
+from swing_leg import swing_end_index
+
+
+class LookaheadPlanner(object):
+    """
+    Dynamic programming over the steps ahead. The value of a walker state is
+    the lowest summed cost of the next steps from it. States are taken
+    relative to the stance foot, so that the value does not depend on where
+    the walker is, and are discretized to share values (and horizon scans)
+    between the sequences of steps that reach the same state.
+    """
+
+    def __init__(self, simulation, n_lookahead=2, n_candidates=4, time_resolution=0.05,
+                 cost_margin=0.25, state_resolution=1e-4, memo_size=2**14):
+        """
+        =INPUT=
+            simulation - Simulator
+                Walker that is controlled, with its CoP offsets
+            n_lookahead - int [2]
+                Number of steps the summed cost is minimized over. With 1 the
+                steps are those of Simulator.run.
+            n_candidates - int [4]
+                Maximum number of steps expanded per state
+            time_resolution - float [0.05]
+                Per CoP offset, only the lowest cost step within each window of
+                this many seconds of swing time is a candidate. Windows
+                without horizon samples are skipped.
+            cost_margin - float [0.25]
+                Only steps whose cost is at most this fraction above the lowest
+                cost of the state are candidates
+            state_resolution - float [1e-4]
+                States that round to the same multiple of this (m, m/s, rad)
+                are the same
+            memo_size - int [2**14]
+                Maximum number of memoized states, the least recently used
+                ones are dropped first
+        =NOTES=
+            Pruning: a candidate whose own cost already exceeds the best
+            summed cost of the state is not expanded, as costs are positive.
+            Together with the memo of expanded states, a re-planned step only
+            scans the states that were not reached by the previous plan.
+            There is no cost beyond the last step, so longer lookahead tends
+            to favour short, cheap steps.
+        """
+        self.simulation = simulation
+        self.n_lookahead = n_lookahead
+        self.n_candidates = n_candidates
+
+        # First horizon index of each window of swing times
+        n_bin = max(1, int(round(time_resolution / simulation.t_step)))
+        window = swing_end_index(simulation.t_step, simulation.horizon) // n_bin
+        self.window_starts = np.flatnonzero(np.diff(window, prepend=-1))
+        self.cost_margin = cost_margin
+        self.state_resolution = state_resolution
+        self.memo_size = memo_size
+
+        # Scratch walker to scan from states, relative to its stance foot at 0
+        self.scratch = Simulator(simulation.settings)
+        self.scratch.cop_offsets_ap = simulation.cop_offsets_ap
+        self.scratch.cop_offsets_ml = simulation.cop_offsets_ml
+
+        # Candidate steps of every expanded state, and values
+        self.expansions = collections.OrderedDict()
+        self.values = collections.OrderedDict()
+        self.n_scan = 0
+        self.n_hit = 0
+        return
+
+
+    def run(self, n_step, pert_counter=None, verbose=True):
+        """
+        Walk the simulation for n_step steps, see Simulator.run
+        """
+        simulation = self.simulation
+        (initial_leg_angle_ap, initial_leg_angle_ml) = simulation.initial_leg_angles()
+        cost_margin = self.cost_margin if self.n_lookahead > 1 else 0
+
+        for idx_step in range(0, n_step):
+            scan = simulation.scan_horizon(initial_leg_angle_ap, initial_leg_angle_ml, cost_margin=cost_margin)
+            candidates = self.candidates(scan, simulation.is_right_swing)
+            (_, scan['best_cop_idx'], scan['best_time_idx']) = self.best_step(candidates, self.n_lookahead)
+            (initial_leg_angle_ap, initial_leg_angle_ml) = simulation.take_step(
+                scan, idx_step, pert_counter=pert_counter, verbose=verbose)
+
+        return
+
+
+    def best_step(self, candidates, n_lookahead):
+        """
+        =INPUT=
+            candidates - list of tuple
+                See candidates
+            n_lookahead - int
+        =OUTPUT=
+            value - float
+                Lowest summed cost of n_lookahead steps
+            cop_idx, time_idx - int
+                First step of that sequence
+        """
+        best = (np.inf, candidates[0][1], candidates[0][2])
+        for (cost, cop_idx, time_idx, next_state) in candidates:
+            # Costs are positive: neither this nor the more costly candidates can improve
+            if cost >= best[0]:
+                break
+            value = cost
+            if n_lookahead > 1:
+                value += self.value(next_state, n_lookahead - 1)
+            if value < best[0]:
+                best = (value, cop_idx, time_idx)
+
+        return best
+
+
+    def value(self, state, n_lookahead):
+        """
+        Lowest summed cost of n_lookahead steps from state, see next_state
+        """
+        key = self.state_key(state) + (n_lookahead,)
+        if key in self.values:
+            self.values.move_to_end(key)
+            return self.values[key]
+
+        value = self.best_step(self.expand(state), n_lookahead)[0]
+        _memoize(self.values, key, value, self.memo_size)
+        return value
+
+
+    def expand(self, state):
+        """
+        Candidate steps from a state, from the memo or from a new horizon scan.
+
+        =INPUT=
+            state - tuple
+                See next_state
+        =OUTPUT=
+            candidates - list of tuple
+                See candidates
+        """
+        key = self.state_key(state)
+        if key in self.expansions:
+            self.n_hit += 1
+            self.expansions.move_to_end(key)
+            return self.expansions[key]
+
+        (com_pos_ap, com_vel_ap, com_pos_ml, com_vel_ml, leg_angle_ap, leg_angle_ml, is_right_swing) = state
+        scratch = self.scratch
+        scratch.lip_ap.override_state(com_pos_ap, com_vel_ap, 0, 0, cop_shift=0)
+        scratch.lip_ml.override_state(com_pos_ml, com_vel_ml, 0, 0, cop_shift=0)
+        scratch.is_right_swing = is_right_swing
+        scan = scratch.scan_horizon(leg_angle_ap, leg_angle_ml, cost_margin=self.cost_margin)
+        self.n_scan += 1
+
+        candidates = self.candidates(scan, is_right_swing)
+        _memoize(self.expansions, key, candidates, self.memo_size)
+        return candidates
+
+
+    def candidates(self, scan, is_right_swing):
+        """
+        Candidate steps of a horizon scan, in order of increasing cost. The
+        first is the step Simulator.run would take.
+
+        =INPUT=
+            scan - dict
+                See Simulator.scan_horizon
+            is_right_swing - bool
+                Side of the swing leg during the scanned step
+        =OUTPUT=
+            candidates - list of tuple
+                (cost, cop_idx, time_idx, next_state)
+        """
+        total_costs = np.array(scan['total_cost'])
+        n_cop = total_costs.shape[0]
+        n_window = len(self.window_starts)
+
+        # Lowest cost per CoP offset and window of swing times
+        time_idx = np.array([[start + np.argmin(window_costs) for (start, window_costs) in
+                              zip(self.window_starts, np.split(cop_costs, self.window_starts[1:]))]
+                             for cop_costs in total_costs]).reshape(-1)
+        cop_idx = np.repeat(np.arange(n_cop), n_window)
+        costs = total_costs[cop_idx, time_idx]
+
+        lowest_cost = total_costs[scan['best_cop_idx'], scan['best_time_idx']]
+        is_candidate = costs <= lowest_cost * (1 + self.cost_margin)
+        order = np.lexsort((time_idx, cop_idx, costs))
+        order = order[is_candidate[order]][:self.n_candidates]
+
+        return [(costs[i], cop_idx[i], time_idx[i], self.next_state(scan, cop_idx[i], time_idx[i], is_right_swing))
+                for i in order]
+
+
+    def next_state(self, scan, cop_idx, time_idx, is_right_swing):
+        """
+        =OUTPUT=
+            state - tuple
+                (com_pos_ap, com_vel_ap, com_pos_ml, com_vel_ml, leg_angle_ap,
+                leg_angle_ml, is_right_swing) after the step, with CoM positions
+                relative to the new stance foot, see Simulator.take_step
+        """
+        lip_ap = scan['lip_ap'][cop_idx]
+        lip_ml = scan['lip_ml'][0]
+        return (
+            lip_ap.com_pos[time_idx] - scan['step_pos_ap'][cop_idx][time_idx], lip_ap.com_vel[time_idx],
+            lip_ml.com_pos[time_idx] - scan['step_pos_ml'][0][time_idx], lip_ml.com_vel[time_idx],
+            lip_ap.to_leg_angle()[time_idx], lip_ml.to_leg_angle()[time_idx],
+            not is_right_swing)
+
+
+    def state_key(self, state):
+        return tuple(int(round(x / self.state_resolution)) for x in state[:6]) + (state[6],)
+
+
+def _memoize(memo, key, value, memo_size):
+    memo[key] = value
+    if len(memo) > memo_size:
+        memo.popitem(last=False)
+    return
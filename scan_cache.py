@@ -0,0 +1,92 @@
+"""
+Memo of horizon scans. The result of a scan only depends on the state of
+the walker relative to its stance foot, not on its position, and in steady
+gait that state repeats from step to step. Scans are therefore looked up by
+that relative state, quantized to a tolerance.
+"""
+
+import collections
+import numpy as np
+
+
+class ScanCache(object):
+    """
+    Least recently used cache of the decisions (best_cop_idx, best_time_idx)
+    and cost landscapes of horizon scans, see Simulator.cached_scan.
+    """
+
+    def __init__(self, max_size, tolerance=1e-9):
+        """
+        =INPUT=
+            max_size - int
+                Maximum number of entries, the least recently used entry is
+                dropped beyond
+            tolerance - float [1e-9]
+                Quantization step of the relative state [m, m/s, rad]. States
+                that round to the same multiples share an entry. If 0, only
+                identical states do.
+        """
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        return
+
+
+    def key(self, relative_state, is_right_swing, n_feasible=None):
+        """
+        =INPUT=
+            relative_state - sequence of float
+                CoM position (relative to the stance foot) and velocity and
+                swing leg angle, AP and ML
+            is_right_swing - bool
+            n_feasible - int [None]
+                See Simulator.scan_horizon
+        =OUTPUT=
+            key - tuple
+        """
+        relative_state = np.asarray(relative_state, dtype=float)
+        if self.tolerance > 0:
+            relative_state = np.round(relative_state / self.tolerance).astype(np.int64)
+        return tuple(relative_state.tolist()) + (bool(is_right_swing), n_feasible)
+
+
+    def get(self, key):
+        """
+        The entry of key, None on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return
+
+
+    def stats(self):
+        """
+        =OUTPUT=
+            stats - dict
+                hits, misses, size (number of entries) and hit_rate
+        """
+        n_lookup = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                'hit_rate': self.hits / n_lookup if n_lookup > 0 else np.nan}
+
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        return
@@ -0,0 +1,117 @@
+"""
+The scenario of main.py: a steady state gait, the responses to each of the
+perturbations in the settings from copies of it, and the fit metrics of the
+first steps after the perturbations. Shared by the studies that run it many
+times, with map_tasks to spread those runs over worker processes.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from simulator_v2 import Simulator
+from step_analysis import StepAnalysis
+
+
+def steady_state(settings, factory=Simulator, recorder=None):
+    """
+    =INPUT=
+        settings - SimulationSettings
+        factory - callable [Simulator]
+            Makes the simulators, called as factory(settings, cop_modulation=...)
+        recorder - callable [None]
+            Called with the simulation index (-1 for the steady state, the
+            perturbation index otherwise) and the simulator before it walks,
+            returns its step_callback (see Simulator.take_step) or None
+    =OUTPUT=
+        baseline - Simulator
+            After n_step_to_steady_state steps, without step_callback
+    """
+    baseline = factory(settings, cop_modulation=settings.cop_modulation_steady_state)
+    if recorder is not None:
+        baseline.step_callback = recorder(-1, baseline)
+    baseline.run(n_step=settings.n_step_to_steady_state, verbose=False)
+    baseline.step_callback = None
+    return baseline
+
+
+def perturbation_responses(settings, baseline, factory=Simulator, recorder=None):
+    """
+    Responses to the perturbations in settings, in AP or ML direction
+    (pertAP), each from a copy of the state of baseline.
+
+    =INPUT=
+        baseline - Simulator
+            See steady_state
+        settings, factory, recorder
+            See steady_state
+    =OUTPUT=
+        sims - list of Simulator
+            One per perturbation
+    """
+    sims = []
+    for (pert_idx, pert) in enumerate(settings.perturbations):
+        sim = factory(settings, cop_modulation=settings.cop_modulation_perturbation)
+        baseline.copy_state_to(sim)
+        if recorder is not None:
+            sim.step_callback = recorder(pert_idx, sim)
+        (pert_ap, pert_ml) = (pert, 0) if settings.pertAP else (0, pert)
+        sim.perturb(settings.t_perturbation, pert_ap=pert_ap, pert_ml=pert_ml,
+                    n_step=settings.n_step_post_perturbation, pert_counter=pert_idx, verbose=False)
+        sims.append(sim)
+    return sims
+
+
+def walk(settings, factory=Simulator, recorder=None):
+    """
+    =OUTPUT=
+        baseline - Simulator
+            See steady_state
+        sims - list of Simulator
+            See perturbation_responses
+    """
+    baseline = steady_state(settings, factory, recorder)
+    return baseline, perturbation_responses(settings, baseline, factory, recorder)
+
+
+def first_step_metrics(baseline, sims, exp_step_offsets=None):
+    """
+    StepAnalysis.metrics of the first steps after the perturbations against
+    the experimental ones from the same CoM position.
+
+    =INPUT=
+        baseline - Simulator
+        sims - list of Simulator
+            See perturbation_responses, at least one
+        exp_step_offsets - ndarray of shape (2, P) [None]
+            Experimental step positions relative to the CoM (ML, AP) for
+            each of the P perturbations, see ExperimentReadout.exp_step_pos
+    =OUTPUT=
+        metrics - dict
+            See StepAnalysis.metrics, r2_ml, r2_ap and rms are NaN without
+            experimental data
+    """
+    if not sims:
+        raise ValueError('metrics need at least one perturbation')
+    model_steps = [[sim.sim_data.step_pos[idx][0] for sim in sims] for idx in (0, 1)]
+
+    # Without experimental data the fit metrics are computed against the model itself, then discarded
+    if exp_step_offsets is None:
+        exp_steps = model_steps[::-1]
+    else:
+        exp_steps = [[sim.sim_data.com_pos[1 - idx][0] + exp_step_offsets[idx][pert_idx]
+                      for (pert_idx, sim) in enumerate(sims)] for idx in (0, 1)]
+    metrics = StepAnalysis(model_steps, exp_steps, baseline.sim_data.step_pos,
+                           baseline.sim_data.time, baseline.sim_data.com_vel).metrics()
+    if exp_step_offsets is None:
+        metrics.update(r2_ml=np.nan, r2_ap=np.nan, rms=np.nan)
+    return metrics
+
+
+def map_tasks(function, tasks, n_workers=None):
+    """
+    list(map(function, tasks)) on n_workers worker processes, in the
+    current process if n_workers is 1. If None, the cpu count is used.
+    """
+    if n_workers == 1:
+        return list(map(function, tasks))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(function, tasks))
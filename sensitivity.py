@@ -0,0 +1,212 @@
+"""
+Sensitivity of the fit metrics of StepAnalysis to the model parameters, by
+central finite differences. All parameter variants are simulated at once on
+worker processes. The horizon scan makes discrete choices (CoP offset and
+swing time index), across which the metrics jump: a difference that spans
+such a change is reported as a decision change instead of a derivative.
+"""
+
+import dataclasses
+import numpy as np
+from settings import SimulationSettings
+import scenario
+
+
+# Parameters of SimulationSettings analysed by default
+PARAMETERS = ('gain_swing_cost_ap', 'gain_swing_cost_ml', 'gain_sts_cost', 'gain_ankle_cost_ap',
+              'gain_ankle_cost_ml', 'xcom_offset_ap', 'xcom_offset_ml', 'leg_length', 'mass_fraction_swing_leg')
+
+METRICS = ('r2_ml', 'r2_ap', 'rms', 'speed', 'step_length', 'step_width', 'swing_time')
+
+
+class SensitivityAnalysis(object):
+    """
+    d metric / d parameter around the given settings.
+
+    =NOTES=
+        The cost gains only act through the decisions, so their derivatives
+        are 0 wherever no decision changes.
+    """
+
+    def __init__(self, settings, exp_step_offsets=None, parameters=PARAMETERS, relative_step=1e-6,
+                 absolute_step=1e-9, n_workers=None):
+        """
+        =INPUT=
+            settings - SimulationSettings
+                Settings to linearize around. The perturbations and their
+                direction (pertAP) are those compared to the experiment.
+            exp_step_offsets - ndarray of shape (2, P) [None]
+                Experimental step positions relative to the CoM (ML, AP) for
+                each of the P perturbations, see ExperimentReadout.exp_step_pos.
+                If None, r2_ml, r2_ap and rms are not computed.
+            parameters - sequence of str [PARAMETERS]
+                Fields of SimulationSettings to vary
+            relative_step, absolute_step - float [1e-6, 1e-9]
+                Finite difference step of a parameter p is
+                max(relative_step * |p|, absolute_step). Small steps are
+                less likely to span a decision change of the 1 ms swing
+                time grid.
+            n_workers - int [None]
+                Number of worker processes. If None, the cpu count is used.
+                If 1, all runs are in the current process.
+        """
+        self.settings = settings
+        self.exp_step_offsets = exp_step_offsets
+        self.parameters = tuple(parameters)
+        self.relative_step = relative_step
+        self.absolute_step = absolute_step
+        self.n_workers = n_workers
+
+        # Steady state simulations by steady_state_key, kept between computes
+        self.steady_states = {}
+
+        self.metrics = None
+        self.sensitivity = None
+        self.decision_changes = None
+        return
+
+
+    def compute(self):
+        """
+        =OUTPUT=
+            sensitivity - ndarray of shape (n_parameter, n_metric)
+                Central differences, in the order of parameters and METRICS.
+                NaN where a decision change was found, or where the metric is
+                not computed.
+        =NOTES=
+            Also sets metrics, the metrics at settings, and decision_changes,
+            a dict of parameter to a list of (side, simulation, step,
+            nominal decision, varied decision) for the first step of every
+            simulation whose decision differs. simulation is 'steady state'
+            or the perturbation index, a decision is (cop_idx, time_idx).
+        """
+        steps = [max(self.relative_step * abs(getattr(self.settings, name)), self.absolute_step)
+                 for name in self.parameters]
+        variants = [self.settings]
+        for (name, step) in zip(self.parameters, steps):
+            value = getattr(self.settings, name)
+            variants += [self.settings.replace(**{name: value - step}),
+                         self.settings.replace(**{name: value + step})]
+
+        # Simulate the steady states that are not cached, then the perturbations
+        keys = [steady_state_key(variant) for variant in variants]
+        missing = list({key: variant for (key, variant) in zip(keys, variants)
+                        if key not in self.steady_states}.items())
+        steady_states = scenario.map_tasks(_steady_state, [variant for (_, variant) in missing], self.n_workers)
+        for ((key, _), steady_state) in zip(missing, steady_states):
+            self.steady_states[key] = steady_state
+
+        tasks = [(variant, self.steady_states[key], self.exp_step_offsets) for (variant, key) in zip(variants, keys)]
+        results = scenario.map_tasks(_evaluate, tasks, self.n_workers)
+
+        (self.metrics, nominal_decisions) = results[0]
+        self.sensitivity = np.full((len(self.parameters), len(METRICS)), np.nan)
+        self.decision_changes = {}
+
+        for (idx, (name, step)) in enumerate(zip(self.parameters, steps)):
+            ((metrics_min, decisions_min), (metrics_plus, decisions_plus)) = results[1 + 2 * idx: 3 + 2 * idx]
+            changes = ([('-',) + change for change in _decision_changes(nominal_decisions, decisions_min)] +
+                       [('+',) + change for change in _decision_changes(nominal_decisions, decisions_plus)])
+            if changes:
+                self.decision_changes[name] = changes
+                continue
+            self.sensitivity[idx] = [(metrics_plus[metric] - metrics_min[metric]) / (2 * step)
+                                     for metric in METRICS]
+
+        return self.sensitivity
+
+
+    def report(self):
+        """
+        Table of the sensitivities as a str, with the decision changes
+        """
+        lines = ['%-24s' % 'parameter' + ''.join('%13s' % metric for metric in METRICS)]
+        lines.append('%-24s' % 'value' + ''.join('%13.5g' % self.metrics[metric] for metric in METRICS))
+        for (name, row) in zip(self.parameters, self.sensitivity):
+            if name in self.decision_changes:
+                (side, simulation, step, nominal, varied) = self.decision_changes[name][0]
+                lines.append('%-24s decision change at %s step, %s step %d: (cop_idx, time_idx) %s -> %s' % (
+                    name, side, simulation, step, nominal, varied))
+            else:
+                lines.append('%-24s' % name + ''.join('%13.5g' % value for value in row))
+        return '\n'.join(lines)
+
+
+def steady_state_key(settings):
+    """
+    Settings with the fields that do not affect the steady state simulation
+    set to their defaults, so that variants can share a steady state.
+    """
+    ignored = ['perturbations', 'pertAP', 'plate_number', 't_perturbation', 'n_step_post_perturbation',
+               'cop_modulation_perturbation']
+    if not settings.cop_modulation_steady_state:
+        # Without CoP modulation the only CoP offset is 0, which has no ankle cost
+        ignored += ['gain_ankle_cost_ap', 'gain_ankle_cost_ml', 'cop_ap_minimal', 'cop_steps', 'foot_length']
+    defaults = {field.name: field.default for field in dataclasses.fields(SimulationSettings) if field.name in ignored}
+    return settings.replace(**defaults)
+
+
+def evaluate(settings, exp_step_offsets=None, steady_state=None):
+    """
+    Metrics and decisions of the steady state gait and of the responses to
+    the perturbations in settings, as in main.py.
+
+    =INPUT=
+        settings - SimulationSettings
+        exp_step_offsets - ndarray of shape (2, P) [None]
+            See SensitivityAnalysis
+        steady_state - tuple [None]
+            (Simulator, decisions) of the steady state gait. If None, it is
+            simulated.
+    =OUTPUT=
+        metrics - dict
+            See StepAnalysis.metrics, r2_ml, r2_ap and rms are NaN without
+            experimental data
+        decisions - list of list of tuple
+            (cop_idx, time_idx) of every step of the steady state simulation,
+            then of every perturbation
+    """
+    if steady_state is None:
+        steady_state = _steady_state(settings)
+    (baseline, baseline_decisions) = steady_state
+    (decisions, recorder) = _recorder()
+    sims = scenario.perturbation_responses(settings, baseline, recorder=recorder)
+    metrics = scenario.first_step_metrics(baseline, sims, exp_step_offsets)
+
+    return metrics, [baseline_decisions] + decisions
+
+
+def _steady_state(settings):
+    (decisions, recorder) = _recorder()
+    baseline = scenario.steady_state(settings, recorder=recorder)
+    return baseline, decisions[0]
+
+
+def _recorder():
+    """
+    List and recorder (see scenario.steady_state) that appends a list of the
+    decisions of every step to it per simulation
+    """
+    decisions = []
+
+    def recorder(simulation, sim):
+        records = []
+        decisions.append(records)
+        return lambda record: records.append((int(record['cop_idx']), int(record['time_idx'])))
+    return decisions, recorder
+
+
+def _evaluate(task):
+    (settings, steady_state, exp_step_offsets) = task
+    return evaluate(settings, exp_step_offsets, steady_state)
+
+
+def _decision_changes(nominal, varied):
+    changes = []
+    for (sim_idx, (steps_nominal, steps_varied)) in enumerate(zip(nominal, varied)):
+        for (step, (decision_nominal, decision_varied)) in enumerate(zip(steps_nominal, steps_varied)):
+            if decision_nominal != decision_varied:
+                simulation = 'steady state' if sim_idx == 0 else 'perturbation %d' % (sim_idx - 1)
+                changes.append((simulation, step, decision_nominal, decision_varied))
+                break
+    return changes
@@ -1,80 +1,204 @@
-
+import dataclasses
+import hashlib
 import numpy as np
 
 
+@dataclasses.dataclass(frozen=True)
 class SimulationSettings(object):
     """
+    Immutable simulation settings. Variants are made with replace, e.g.
+    SimulationSettings().replace(gain_sts_cost=0.2), and settings can be
+    used as dictionary keys.
+
     =NOTES=
         ap: antero-posterior
         ml: medio-lateral
-        t_horizon must be a multiple of t_step.
+        t_horizon must be a multiple of t_step, and so must the horizon
+        segments: the candidate swing times lie on the t_step grid, which
+        is also the integration step of the swing costs.
         Perturbations are velocity changes.
+        Values that follow from others (mass_swing_leg, horizon,
+        cop_offsets_ap, cop_offsets_ml, experiment_number) are properties, so that they
+        stay consistent in variants.
     """
 
     # Physical values
-    gravity = 9.81
-    t_step = 0.001
-    t_horizon = 1
-    leg_length = 1
-    swing_leg_length = 0.447
-    body_length = 1.80
-    foot_length = 0.21
-
-    mass_total = 80
-    mass_swing_leg = 0.161 * mass_total
+    gravity: float = 9.81
+    t_step: float = 0.001
+    t_horizon: float = 1
+    leg_length: float = 1
+    swing_leg_length: float = 0.447
+    body_length: float = 1.80
+    foot_length: float = 0.21
+
+    # Resolution of the candidate swing times, as (t_end, resolution)
+    # segments that cover the horizon, e.g. dense around typical swing
+    # times: ((0.3, 0.01), (0.7, 0.001), (1, 0.01)). Empty for a uniform
+    # horizon with t_step resolution.
+    horizon_segments: tuple = ()
+
+    mass_total: float = 80
+    mass_fraction_swing_leg: float = 0.161
 
     # Set possible CoP shifts
-    cop_ap_minimal = -0.05
-    cop_steps = 6
-    cop_offsets_ap = np.linspace(
-            cop_ap_minimal, cop_ap_minimal + foot_length, cop_steps)
-    cop_offsets_ml = np.array([0]) # CoP shift in ML direction is not included
+    cop_ap_minimal: float = -0.05
+    cop_steps: int = 6
 
     # XCoM offsets
-    xcom_offset_ap = -0.1364
-    xcom_offset_ml = 0.0132
+    xcom_offset_ap: float = -0.1364
+    xcom_offset_ml: float = 0.0132
 
     # Initial conditions for the LIPs
-    initial_com_pos_ap = 0
-    initial_com_vel_ap = 0.625
-    initial_cop_pos_ap = 0
-    initial_foot_pos_ap = 0
-    initial_leg_angle_ap = 0
-
-    initial_com_pos_ml = 0
-    initial_com_vel_ml = 0.028
-    initial_cop_pos_ml = 0
-    initial_foot_pos_ml = 0
-    initial_leg_angle_ml = 0
+    initial_com_pos_ap: float = 0
+    initial_com_vel_ap: float = 0.625
+    initial_cop_pos_ap: float = 0
+    initial_foot_pos_ap: float = 0
+    initial_leg_angle_ap: float = 0
+
+    initial_com_pos_ml: float = 0
+    initial_com_vel_ml: float = 0.028
+    initial_cop_pos_ml: float = 0
+    initial_foot_pos_ml: float = 0
+    initial_leg_angle_ml: float = 0
 
     # Chosen cost gains
-    gain_swing_cost_ap = 1
-    gain_swing_cost_ml = 1
-    gain_sts_cost = 0.1
-    gain_ankle_cost_ap = 0.33
-    gain_ankle_cost_ml = 1
-
-    print('The chosen gains are:', '\nSwing ap:', gain_swing_cost_ap, '\nSwing ml:', gain_swing_cost_ml,
-        '\nSTS:', gain_sts_cost, '\nAnkle ap:', gain_ankle_cost_ap, '\nAnkle ml', gain_ankle_cost_ml)
+    gain_swing_cost_ap: float = 1
+    gain_swing_cost_ml: float = 1
+    gain_sts_cost: float = 0.1
+    gain_ankle_cost_ap: float = 0.33
+    gain_ankle_cost_ml: float = 1
 
     # Amount of steps performed by the model
-    n_step_to_steady_state = 20     # steps before perturbation
-    n_step_post_perturbation = 1    # steps after perturbation
+    n_step_to_steady_state: int = 20     # steps before perturbation
+    n_step_post_perturbation: int = 1    # steps after perturbation
 
     # Set CoP modulation for two model phases
-    cop_modulation_steady_state = False
-    cop_modulation_perturbation = True
+    cop_modulation_steady_state: bool = False
+    cop_modulation_perturbation: bool = True
 
     # Choose perturbation direction (ML/AP)
-    pertAP = True
+    pertAP: bool = True
 
-    if pertAP is False:
-        experiment_number = 0
-    elif pertAP is True:
-        experiment_number = 2
+    plate_number: int = 0
 
-    plate_number = 0
+    # Perturbation onset after the start of the first perturbed swing [s],
+    # 0 applies the perturbation between steps
+    t_perturbation: float = 0
 
     # Set perturbation magnitudes
-    perturbations = [9.81 * 0.15 * fraction 
-        for fraction in [-0.04, -0.08, -0.12, -0.16, 0.04, 0.08, 0.12, 0.16]]
+    perturbations: tuple = tuple(9.81 * 0.15 * fraction
+        for fraction in (-0.04, -0.08, -0.12, -0.16, 0.04, 0.08, 0.12, 0.16))
+
+    # Only compute the swing costs of feasible steps (see step_to_step.feasible_steps).
+    # The chosen steps are the same, but the stored cost landscapes (DataStorage,
+    # DataPlot.step_specific_cost_plot) are then infinite at infeasible steps, so
+    # it is off by default.
+    prune_infeasible_steps: bool = False
+
+    # Skip the AP swing costs of steps whose lower bound on the total cost
+    # (all other costs) exceeds the lowest total cost found so far. The chosen
+    # steps are the same, but the stored cost landscapes and the total costs of
+    # the scan are then infinite at the skipped steps, so it is off by default.
+    branch_and_bound: bool = False
+
+    # Horizon scans of run and perturb are looked up by the walker state relative
+    # to its stance foot, rounded to scan_cache_tolerance, in a cache of
+    # scan_cache_size entries shared by the simulators of these settings (see
+    # Simulator.cached_scan). 0 disables the cache. A hit reuses the decision and
+    # cost landscapes of a state within the tolerance.
+    scan_cache_size: int = 0
+    scan_cache_tolerance: float = 1e-9
+
+    # Precision of the BatchSimulator horizon scans, 'float64' or 'float32'. A
+    # float32 scan moves half the memory, its candidates within a fraction
+    # scan_recheck_margin of the lowest total cost are costed again in float64
+    # to choose the step (see BatchSimulator.choose), and steps are taken in float64.
+    scan_dtype: str = 'float64'
+    scan_recheck_margin: float = 1e-4
+
+    # Store the Pareto front of the cost components of every step (see
+    # pareto.scan_front and DataStorage.pareto_fronts), from which the step of
+    # other gains can be found, instead of the step specific cost landscapes.
+    # The front needs all swing costs, so branch and bound is then skipped.
+    store_pareto_front: bool = False
+
+    # Threads that share the horizon scan of a single simulator (CoP offsets
+    # and chunks of the horizon), 1 scans in the calling thread. Does not
+    # change the results, so it is not part of equality and hashing.
+    n_scan_workers: int = dataclasses.field(default=1, compare=False)
+
+    def __post_init__(self):
+        # Sequences are stored as tuples, to keep the settings hashable
+        object.__setattr__(self, 'perturbations', tuple(float(pert) for pert in self.perturbations))
+        object.__setattr__(self, 'horizon_segments',
+            tuple((float(t_end), float(resolution)) for (t_end, resolution) in self.horizon_segments))
+        return
+
+
+    @property
+    def mass_swing_leg(self):
+        return self.mass_fraction_swing_leg * self.mass_total
+
+
+    @property
+    def horizon(self):
+        """
+        Candidate swing times, a subset of the uniform t_step grid up to
+        t_horizon if there are horizon_segments
+        """
+        horizon = np.linspace(self.t_step, self.t_horizon, int(self.t_horizon / self.t_step))
+        if not self.horizon_segments:
+            return horizon
+
+        # Indices on the uniform grid, each segment from the end of the previous one
+        (indices, start) = ([], 0)
+        for (t_end, resolution) in self.horizon_segments:
+            stop = int(round(t_end / self.t_step))
+            stride = max(1, int(round(resolution / self.t_step)))
+            indices.append(np.arange(stop, start, -stride)[::-1])
+            start = stop
+        if start != len(horizon):
+            raise ValueError('horizon_segments must end at t_horizon')
+        return horizon[np.concatenate(indices) - 1]
+
+
+    @property
+    def cop_offsets_ap(self):
+        return np.linspace(self.cop_ap_minimal, self.cop_ap_minimal + self.foot_length, self.cop_steps)
+
+
+    @property
+    def cop_offsets_ml(self):
+        return np.array([0]) # CoP shift in ML direction is not included
+
+
+    @property
+    def experiment_number(self):
+        if self.pertAP is False:
+            return 0
+        return 2
+
+
+    def replace(self, **changes):
+        """
+        Copy of the settings with the given fields changed
+        """
+        return dataclasses.replace(self, **changes)
+
+
+    def digest(self):
+        """
+        Hash of the settings that is the same in every process and session,
+        e.g. to key stored results
+        =OUTPUT=
+            digest - str
+                Hexadecimal SHA-256 of the compared fields
+        """
+        fields = [(field.name, getattr(self, field.name)) for field in dataclasses.fields(self) if field.compare]
+        return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+
+    def gains_description(self):
+        return ('The chosen gains are:' + '\nSwing ap: ' + str(self.gain_swing_cost_ap) +
+            '\nSwing ml: ' + str(self.gain_swing_cost_ml) + '\nSTS: ' + str(self.gain_sts_cost) +
+            '\nAnkle ap: ' + str(self.gain_ankle_cost_ap) + '\nAnkle ml ' + str(self.gain_ankle_cost_ml))
@@ -1,10 +1,14 @@
+import collections
 import copy
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from lip2d import LIP2D
 from swing_leg import SwingLeg
 import step_to_step as STS
 import ankle as ANKLE
+import pareto
 from data_storage import DataStorage
+from scan_cache import ScanCache
 
 class Simulator(object):
     """
@@ -22,8 +26,7 @@ class Simulator(object):
 
         # set time horizon
         self.t_step = settings.t_step
-        self.horizon = np.linspace(
-            self.t_step, settings.t_horizon, int(settings.t_horizon / self.t_step))
+        self.horizon = settings.horizon
 
         # set possible CoP offsets
         if cop_modulation is True:
@@ -63,19 +66,137 @@ class Simulator(object):
         # create data storage object
         self.sim_data = DataStorage()
 
+        # optional function that receives a record of every step taken, see take_step
+        self.step_callback = None
+
+        # shared memo of horizon scans, see cached_scan
+        self.scan_cache = None
+        if settings.scan_cache_size > 0:
+            self.scan_cache = scan_cache(settings, cop_modulation)
+
         return
 
 
-    def run(self, n_step, pert_counter=None):
+    def run(self, n_step, pert_counter=None, verbose=True):
         """
         Walk for predefined number of steps.
         No perturbations, constant (equivalent) CoP during LIP swing.
 
+        =INPUT=
+            n_step - int
+                Number of steps to take
+            pert_counter - int [None]
+                Index of the perturbation being simulated, None for steady state
+            verbose - bool [True]
+                Print the chosen CoP offset for every step
+
         =NOTES=
         This code can be enabled for ML CoP modulation. All 0's for arrays then have to be set to a CoP ml counter
         """
 
-        # Initial swing leg angle
+        (initial_leg_angle_ap, initial_leg_angle_ml) = self.initial_leg_angles()
+
+        for idx_step in range(0, n_step):
+            scan = self.cached_scan(initial_leg_angle_ap, initial_leg_angle_ml)
+            (initial_leg_angle_ap, initial_leg_angle_ml) = self.take_step(
+                scan, idx_step, pert_counter=pert_counter, verbose=verbose)
+
+        return
+
+
+    def perturb(self, t_pert, pert_ap=0, pert_ml=0, n_step=1, pert_counter=None, verbose=True):
+        """
+        Walk until and including the swing during which a CoM velocity
+        perturbation is applied, then take n_step - 1 more steps.
+
+        =INPUT=
+            t_pert - float
+                Time of the perturbation after the start of the current swing.
+                If it exceeds the planned swing time, the planned step is taken
+                and the perturbation is applied in a later swing.
+            pert_ap, pert_ml - float [0]
+                Velocity changes
+            n_step - int [1]
+                Number of steps to take from the perturbed swing on
+            pert_counter - int [None]
+                See run
+            verbose - bool [True]
+                See run
+        =NOTES=
+            The step is first planned as in run. The LIP state at t_pert is
+            evaluated analytically under the planned CoP, and the swing leg
+            angle from the planned swing leg profile. The perturbation is then
+            added to the CoM velocity and the remainder of the swing is planned
+            again from that state: a new CoP offset is chosen, and the swing
+            leg starts a new swing to the new final angle. Only the remaining
+            swing time is costed, and the step can not exceed t_horizon.
+            A perturbation at t_pert = 0 is the same as changing the CoM velocity
+            before run(n_step).
+        """
+        (initial_leg_angle_ap, initial_leg_angle_ml) = self.initial_leg_angles()
+        idx_step = 0
+
+        while t_pert > 0:
+            scan = self.cached_scan(initial_leg_angle_ap, initial_leg_angle_ml)
+            t_swing = self.horizon[scan['best_time_idx']]
+            if t_pert < t_swing:
+                break
+            (initial_leg_angle_ap, initial_leg_angle_ml) = self.take_step(
+                scan, idx_step, pert_counter=pert_counter, verbose=verbose)
+            t_pert -= t_swing
+            idx_step += 1
+
+        if t_pert > 0:
+            # Leg angles at the perturbation instant from the planned swing profiles
+            best_cop_idx = scan['best_cop_idx']
+            best_time_idx = scan['best_time_idx']
+            initial_leg_angle_ap = self.swing_leg_ap.angle_at(t_pert, t_swing, initial_leg_angle_ap,
+                scan['final_leg_angle_ap'][best_cop_idx][best_time_idx])
+            initial_leg_angle_ml = self.swing_leg_ml.angle_at(t_pert, t_swing, initial_leg_angle_ml,
+                scan['final_leg_angle_ml'][0][best_time_idx])
+
+            # The swing up to the perturbation instant, for the trajectory
+            self.sim_data.take_segment_sample(t_pert,
+                (self.lip_ap.com_pos, self.lip_ml.com_pos), (self.lip_ap.com_vel, self.lip_ml.com_vel),
+                (self.lip_ap.cop_origin, self.lip_ml.cop_origin),
+                (self.cop_offsets_ap[best_cop_idx], self.cop_offsets_ml[0]),
+                scan['initial_leg_angle'],
+                (scan['final_leg_angle_ap'][best_cop_idx][best_time_idx], scan['final_leg_angle_ml'][0][best_time_idx]),
+                t_swing, self.is_right_swing)
+
+            # LIP state at the perturbation instant
+            self.lip_ap.simulate(t_pert, self.cop_offsets_ap[best_cop_idx])
+            self.lip_ml.simulate(t_pert, self.cop_offsets_ml[0])
+
+        self.lip_ap.com_vel += pert_ap
+        self.lip_ml.com_vel += pert_ml
+
+        # Plan the remaining swing, within the time horizon
+        scan = self.cached_scan(initial_leg_angle_ap, initial_leg_angle_ml, n_feasible=self.n_feasible(t_pert))
+        (initial_leg_angle_ap, initial_leg_angle_ml) = self.take_step(
+            scan, idx_step, pert_counter=pert_counter, verbose=verbose, t_offset=t_pert)
+
+        for idx_step in range(idx_step + 1, idx_step + n_step):
+            scan = self.cached_scan(initial_leg_angle_ap, initial_leg_angle_ml)
+            (initial_leg_angle_ap, initial_leg_angle_ml) = self.take_step(
+                scan, idx_step, pert_counter=pert_counter, verbose=verbose)
+
+        return
+
+
+    def n_feasible(self, t_offset):
+        """
+        Number of swing times of the horizon that end within t_horizon, when
+        t_offset of the swing has passed
+        """
+        return int(np.searchsorted(self.horizon, self.horizon[-1] - t_offset + 1e-9 * self.t_step, side='right'))
+
+
+    def initial_leg_angles(self):
+        """
+        Initial swing leg angles for the next step. These are the ones the
+        swing legs were last costed from, or the initial conditions.
+        """
         initial_leg_angle_ap = self.swing_leg_ap.initial_angle
         initial_leg_angle_ml = self.swing_leg_ml.initial_angle
         if initial_leg_angle_ap is None:
@@ -83,162 +204,414 @@ class Simulator(object):
         if initial_leg_angle_ml is None:
             initial_leg_angle_ml = self.settings.initial_leg_angle_ml
 
-        for idx_step in range(0, n_step):
-            # create various copies of the lips for the possible CoP's
-            possible_lips = {'lip_ap': [], 'lip_ml': []}
-
-            for i in range(len(self.cop_offsets_ap)):
-                possible_lips['lip_ap'].append(copy.deepcopy(self.lip_ap))
-                possible_lips['lip_ap'][i].simulate(self.horizon, self.cop_offsets_ap[i])
-
-            for i in range(len(self.cop_offsets_ml)):
-                possible_lips['lip_ml'].append(copy.deepcopy(self.lip_ml))
-                possible_lips['lip_ml'][i].simulate(self.horizon, self.cop_offsets_ml[i])
-            
-            # compute potential new foot positions and their final swing leg angles based on XCoM
-            offset_multiplier_ml = {True: 1, False: -1}[self.is_right_swing]
-            possible_step_ap = []
-            possible_step_ml = []
-            possible_final_leg_angle_ap = []
-            possible_final_leg_angle_ml = []
-
-            for i in range(len(possible_lips['lip_ap'])):
-                possible_step_ap.append(possible_lips['lip_ap'][i].step_location_xcom(
-                    offset=self.settings.xcom_offset_ap))
-                possible_final_leg_angle_ap.append(possible_lips['lip_ap'][i].to_leg_angle(possible_step_ap[i]))
-
-            for i in range(len(possible_lips['lip_ml'])):
-                possible_step_ml.append(possible_lips['lip_ml'][i].step_location_xcom(
-                    offset=self.settings.xcom_offset_ml * offset_multiplier_ml))
-                possible_final_leg_angle_ml.append(possible_lips['lip_ml'][i].to_leg_angle(possible_step_ml[i]))
-            
-            # compute swing leg costs
-            swing_costs_ap = []
-            swing_costs_ml = []
-
-            for i in range(len(possible_lips['lip_ap'])):
-                swing_costs_ap.append(self.swing_leg_ap.compute_swing_cost(
-                    self.t_step, self.horizon,
-                    initial_leg_angle_ap, possible_final_leg_angle_ap[i]))
-            
-            for i in range(len(possible_lips['lip_ml'])):
-                swing_costs_ml.append(self.swing_leg_ml.compute_swing_cost(
-                    self.t_step, self.horizon,
-                    initial_leg_angle_ml, possible_final_leg_angle_ml[i]))
-
-            # compute step-to-step transition costs
-            sts_costs = []
-
-            for i in range(len(self.cop_offsets_ml)):
-                sts_costs.append([])
-                for j in range(len(self.cop_offsets_ap)):
-                    sts_costs[i].append(abs(STS.transition_cost(self.settings.mass_total,
-                        possible_lips['lip_ap'][j], possible_lips['lip_ml'][i],
-                        possible_step_ap[j], possible_step_ml[i])))
-
-            # compute ankle costs
-            # TODO: split into two if you want to gain the anklecosts seperately
-            ankle_costs_ap = []
-            ankle_costs_ml = []
-
-            for i in range(len(self.cop_offsets_ap)):
-                ankle_costs_ap.append(ANKLE.compute_ankle_costs(
-                        mass= self.settings.mass_total, gravity=self.settings.gravity,
-                        cop_offset=self.cop_offsets_ap[i],
-                        time= self.horizon))
-            for i in range(len(self.cop_offsets_ml)):
-                ankle_costs_ml.append(ANKLE.compute_ankle_costs(
-                        mass= self.settings.mass_total, gravity=self.settings.gravity,
-                        cop_offset=self.cop_offsets_ml[i],
-                        time= self.horizon))
-            
-            # sum all costs
-            total_costs = []
-            for i in range(len(swing_costs_ap)):
-                total_costs.append(
-                    self.settings.gain_swing_cost_ap * swing_costs_ap[i] +
-                    self.settings.gain_swing_cost_ml * swing_costs_ml[0] +
-                    self.settings.gain_sts_cost * sts_costs[0][i] +
-                    self.settings.gain_ankle_cost_ap * ankle_costs_ap[i]+
-                    self.settings.gain_ankle_cost_ml * ankle_costs_ml[0]) 
-
-            # == END HORIZON SCAN ==
-        
-            # Find the lowest costs
-            lowest_cost = {'indices': [], 'cost': []}
+        return initial_leg_angle_ap, initial_leg_angle_ml
+
+
+    def scan_horizon(self, initial_leg_angle_ap, initial_leg_angle_ml, n_feasible=None, cost_margin=0):
+        """
+        Compute the costs of all possible CoP offsets and step times, and
+        find the lowest.
+
+        =INPUT=
+            initial_leg_angle_ap, initial_leg_angle_ml - float
+                Swing leg angles at the start of the swing
+            n_feasible - int [None]
+                Only the first n_feasible samples of the horizon can be chosen.
+                If None, the full horizon.
+            cost_margin - float [0]
+                With branch and bound, total costs are computed exactly up to
+                a fraction cost_margin above the lowest, and may be infinite
+                beyond
+        =OUTPUT=
+            scan - dict
+                The possible lips, step locations, final leg angles and the
+                (total) costs, as lists with one entry per CoP offset, and
+                best_cop_idx and best_time_idx
+        """
+        # state at the start of the scan
+        initial_state = (self.lip_ap.com_pos, self.lip_ap.com_vel, self.lip_ml.com_pos, self.lip_ml.com_vel)
+
+        # create various copies of the lips for the possible CoP's
+        possible_lips = {'lip_ap': [], 'lip_ml': []}
+
+        possible_lips['lip_ap'] = self.map(self.simulate_lip,
+            [self.lip_ap] * len(self.cop_offsets_ap), self.cop_offsets_ap)
+        possible_lips['lip_ml'] = self.map(self.simulate_lip,
+            [self.lip_ml] * len(self.cop_offsets_ml), self.cop_offsets_ml)
+
+        # compute potential new foot positions and their final swing leg angles based on XCoM
+        offset_multiplier_ml = {True: 1, False: -1}[self.is_right_swing]
+        possible_step_ap = []
+        possible_step_ml = []
+        possible_final_leg_angle_ap = []
+        possible_final_leg_angle_ml = []
+
+        for i in range(len(possible_lips['lip_ap'])):
+            possible_step_ap.append(possible_lips['lip_ap'][i].step_location_xcom(
+                offset=self.settings.xcom_offset_ap))
+            possible_final_leg_angle_ap.append(possible_lips['lip_ap'][i].to_leg_angle(possible_step_ap[i]))
+
+        for i in range(len(possible_lips['lip_ml'])):
+            possible_step_ml.append(possible_lips['lip_ml'][i].step_location_xcom(
+                offset=self.settings.xcom_offset_ml * offset_multiplier_ml))
+            possible_final_leg_angle_ml.append(possible_lips['lip_ml'][i].to_leg_angle(possible_step_ml[i]))
+
+        # find the feasible steps, only their swing costs need to be computed
+        windows_ap = [None] * len(possible_lips['lip_ap'])
+        windows_ml = [None] * len(possible_lips['lip_ml'])
+        if self.settings.prune_infeasible_steps:
+            is_feasible = [STS.feasible_steps(possible_lips['lip_ap'][j], possible_lips['lip_ml'][0],
+                possible_step_ap[j], possible_step_ml[0])[:n_feasible] for j in range(len(self.cop_offsets_ap))]
+            if np.any(is_feasible):
+                windows_ap = [feasible_window(feasible) for feasible in is_feasible]
+                windows_ml[0] = feasible_window(np.any(is_feasible, axis=0))
+
+        # compute swing leg costs of the ML CoP offsets, the AP ones follow below
+        swing_costs_ml = []
+
+        for i in range(len(possible_lips['lip_ml'])):
+            swing_costs_ml.append(self.swing_cost(self.swing_leg_ml,
+                initial_leg_angle_ml, possible_final_leg_angle_ml[i], windows_ml[i]))
+
+        # compute step-to-step transition costs
+        sts_costs = []
+
+        for i in range(len(self.cop_offsets_ml)):
+            sts_costs.append(self.map(lambda lip_ap, step_pos_ap: abs(STS.transition_cost(
+                self.settings.mass_total, lip_ap, possible_lips['lip_ml'][i], step_pos_ap, possible_step_ml[i])),
+                possible_lips['lip_ap'], possible_step_ap))
+
+        # compute ankle costs
+        # TODO: split into two if you want to gain the anklecosts seperately
+        ankle_costs_ap = []
+        ankle_costs_ml = []
+
+        for i in range(len(self.cop_offsets_ap)):
+            ankle_costs_ap.append(ANKLE.compute_ankle_costs(
+                    mass= self.settings.mass_total, gravity=self.settings.gravity,
+                    cop_offset=self.cop_offsets_ap[i],
+                    time= self.horizon))
+        for i in range(len(self.cop_offsets_ml)):
+            ankle_costs_ml.append(ANKLE.compute_ankle_costs(
+                    mass= self.settings.mass_total, gravity=self.settings.gravity,
+                    cop_offset=self.cop_offsets_ml[i],
+                    time= self.horizon))
+
+        # lower bounds of the total costs: all costs except the AP swing cost
+        is_bounded = (self.settings.branch_and_bound and self.settings.gain_swing_cost_ap >= 0 and
+                      not self.settings.store_pareto_front)
+        lower_bounds = []
+        for i in range(len(self.cop_offsets_ap)):
+            lower_bounds.append(self.total_cost(
+                0, swing_costs_ml[0], sts_costs[0][i], ankle_costs_ap[i], ankle_costs_ml[0]))
+            lower_bounds[i][np.isinf(swing_costs_ml[0])] = np.inf
+            if n_feasible is not None:
+                lower_bounds[i][n_feasible:] = np.inf
+
+        # compute AP swing costs and sum all costs. With branch and bound the
+        # CoP offsets with the lowest bounds go first, and swing costs are only
+        # computed where the bound does not exceed the lowest total cost so far
+        # (plus the margin).
+        swing_costs_ap = [None] * len(self.cop_offsets_ap)
+        total_costs = [None] * len(self.cop_offsets_ap)
+        if is_bounded:
+            order = np.argsort([lower_bound.min() for lower_bound in lower_bounds], kind='stable')
+        else:
+            order = range(len(self.cop_offsets_ap))
+        best_cost = np.inf
+
+        for i in order:
+            window = windows_ap[i]
+            if is_bounded:
+                window = intersect_windows(window, feasible_window(lower_bounds[i] <= best_cost * (1 + cost_margin)))
+            swing_costs_ap[i] = self.swing_cost(self.swing_leg_ap,
+                initial_leg_angle_ap, possible_final_leg_angle_ap[i], window)
+
+            total_costs[i] = self.total_cost(
+                swing_costs_ap[i], swing_costs_ml[0], sts_costs[0][i], ankle_costs_ap[i], ankle_costs_ml[0])
+            best_cost = min(best_cost, total_costs[i][:n_feasible].min())
+
+        # == END HORIZON SCAN ==
+
+        # Pruned steps can not be chosen
+        for i in range(len(total_costs)):
+            total_costs[i][np.isinf(swing_costs_ap[i]) | np.isinf(swing_costs_ml[0])] = np.inf
+
+        # Steps beyond the time horizon can not be chosen
+        if n_feasible is not None:
             for i in range(len(total_costs)):
-                lowest_cost['cost'].append(total_costs[i][np.argmin(total_costs[i])])
-                lowest_cost['indices'].append(np.argmin(total_costs[i]))
-            
-            # Best indices that are accompanied with the lowest costs
-            best_cop_idx = np.argmin(lowest_cost['cost'])
-            best_time_idx = lowest_cost['indices'][best_cop_idx]
-
-            # Use best indices to overwrite lip with best lip model
-            self.lip_ap = possible_lips['lip_ap'][best_cop_idx]
-            self.lip_ml = possible_lips['lip_ml'][0]
-
-            self.step_pos_ap = possible_step_ap[best_cop_idx]
-            self.step_pos_ml = possible_step_ml[0]
-
-            # Take data sample for plotting
-            self.sim_data.take_sample(
-                self.horizon[best_time_idx],
-                self.lip_ap, 
-                self.lip_ml,
-                self.step_pos_ap[best_time_idx],
-                self.step_pos_ml[best_time_idx],
-                index= best_time_idx)
-            
-            # Take cost sample for full gait cost analysis (TODO: enable ml CoP modulation)
-            if pert_counter is None:
-                self.sim_data.take_fullgait_cost_sample(
-                    stepnumber=idx_step,
-                    chosen_cop=self.cop_offsets_ap[best_cop_idx],
-                    ankle_cost_ap=ankle_costs_ap[best_cop_idx][best_time_idx],
-                    ankle_cost_ml=ankle_costs_ml[0][best_time_idx],
-                    swing_cost_ap=swing_costs_ap[best_cop_idx][best_time_idx],
-                    swing_cost_ml=swing_costs_ml[0][best_time_idx],
-                    sts_cost=sts_costs[0][best_cop_idx][best_time_idx]
-                )
-            
-            # Take cost sample for step specific cost analysis
-            if pert_counter is None:
-                self.sim_data.take_stepspecific_cost_sample(
-                    ankle_costs_ap, ankle_costs_ml, swing_costs_ap, swing_costs_ml, sts_costs)
-
-            # Obtain the initial swing leg angle for next step
-            initial_leg_angle_ap = self.lip_ap.to_leg_angle()[best_time_idx]
-            initial_leg_angle_ml = self.lip_ml.to_leg_angle()[best_time_idx]
-
-            # Update models to new global state
-            self.lip_ap.override_state(
-                self.lip_ap.com_pos[best_time_idx],
-                self.lip_ap.com_vel[best_time_idx],
-                self.step_pos_ap[best_time_idx],
-                self.step_pos_ap[best_time_idx], cop_shift=0)
-            self.lip_ml.override_state(
-                self.lip_ml.com_pos[best_time_idx],
-                self.lip_ml.com_vel[best_time_idx],
-                self.step_pos_ml[best_time_idx],
-                self.step_pos_ml[best_time_idx], cop_shift=0)    
-
-            # Change the leg
-            self.is_right_swing = not self.is_right_swing
-
-            # Print chosen CoP
-            # TODO: is not yet updated for possible ml CoP modulation
-            if pert_counter is None:
-                print('step', idx_step, 'uses', self.cop_offsets_ap[best_cop_idx], 'as CoP offset')
-            else:
-                print('perturbation', pert_counter, 'uses', self.cop_offsets_ap[best_cop_idx], 'as CoP offset')
-
-            # if (self.cop_offsets_ap[best_cop_idx] != 0.005263157894736831 and self.cop_offsets_ap[best_cop_idx] != 0):
-                # print('ankle is used')
-
-        return   
-              
-   
+                total_costs[i][n_feasible:] = np.inf
+
+        # Find the lowest costs
+        lowest_cost = {'indices': [], 'cost': []}
+        for i in range(len(total_costs)):
+            lowest_cost['cost'].append(total_costs[i][np.argmin(total_costs[i])])
+            lowest_cost['indices'].append(np.argmin(total_costs[i]))
+
+        # Best indices that are accompanied with the lowest costs
+        best_cop_idx = np.argmin(lowest_cost['cost'])
+        best_time_idx = lowest_cost['indices'][best_cop_idx]
+
+        return {
+            'lip_ap': possible_lips['lip_ap'], 'lip_ml': possible_lips['lip_ml'],
+            'step_pos_ap': possible_step_ap, 'step_pos_ml': possible_step_ml,
+            'final_leg_angle_ap': possible_final_leg_angle_ap,
+            'final_leg_angle_ml': possible_final_leg_angle_ml,
+            'swing_cost_ap': swing_costs_ap, 'swing_cost_ml': swing_costs_ml,
+            'sts_cost': sts_costs, 'ankle_cost_ap': ankle_costs_ap, 'ankle_cost_ml': ankle_costs_ml,
+            'total_cost': total_costs,
+            'initial_state': initial_state,
+            'initial_leg_angle': (initial_leg_angle_ap, initial_leg_angle_ml),
+            'best_cop_idx': best_cop_idx, 'best_time_idx': best_time_idx}
+
+
+    def cached_scan(self, initial_leg_angle_ap, initial_leg_angle_ml, n_feasible=None):
+        """
+        Horizon scan, or on a hit of the scan cache, the decision and cost
+        landscapes of an earlier scan from the same state relative to the
+        stance foot. See scan_horizon.
+        =NOTES=
+            On a hit, only the LIPs and step locations of the chosen CoP
+            offsets are simulated, from the current state, so the step is
+            taken from the actual (global) state. The other entries of the
+            per CoP offset lists of the scan are None.
+        """
+        if self.scan_cache is None:
+            return self.scan_horizon(initial_leg_angle_ap, initial_leg_angle_ml, n_feasible=n_feasible)
+
+        key = self.scan_cache.key((
+            self.lip_ap.com_pos - self.lip_ap.cop_origin, self.lip_ap.com_vel, initial_leg_angle_ap,
+            self.lip_ml.com_pos - self.lip_ml.cop_origin, self.lip_ml.com_vel, initial_leg_angle_ml),
+            self.is_right_swing, n_feasible)
+        entry = self.scan_cache.get(key)
+        if entry is None:
+            scan = self.scan_horizon(initial_leg_angle_ap, initial_leg_angle_ml, n_feasible=n_feasible)
+            self.scan_cache.put(key, {name: scan[name] for name in (
+                'swing_cost_ap', 'swing_cost_ml', 'sts_cost', 'ankle_cost_ap', 'ankle_cost_ml', 'total_cost',
+                'best_cop_idx', 'best_time_idx')})
+            return scan
+
+        # The swing legs hold the angle they were costed from, as after a scan (see initial_leg_angles)
+        self.swing_leg_ap.initial_angle = initial_leg_angle_ap
+        self.swing_leg_ml.initial_angle = initial_leg_angle_ml
+
+        scan = dict(entry)
+        scan['initial_state'] = (self.lip_ap.com_pos, self.lip_ap.com_vel, self.lip_ml.com_pos, self.lip_ml.com_vel)
+        scan['initial_leg_angle'] = (initial_leg_angle_ap, initial_leg_angle_ml)
+
+        # Chosen lips, step locations and final leg angles
+        offset_multiplier_ml = {True: 1, False: -1}[self.is_right_swing]
+        for (direction, lip, cop_idx, xcom_offset) in (
+                ('ap', self.lip_ap, entry['best_cop_idx'], self.settings.xcom_offset_ap),
+                ('ml', self.lip_ml, 0, self.settings.xcom_offset_ml * offset_multiplier_ml)):
+            n_cop = len(getattr(self, 'cop_offsets_' + direction))
+            for name in ('lip_', 'step_pos_', 'final_leg_angle_'):
+                scan[name + direction] = [None] * n_cop
+            possible_lip = self.simulate_lip(lip, getattr(self, 'cop_offsets_' + direction)[cop_idx])
+            scan['lip_' + direction][cop_idx] = possible_lip
+            scan['step_pos_' + direction][cop_idx] = possible_lip.step_location_xcom(offset=xcom_offset)
+            scan['final_leg_angle_' + direction][cop_idx] = possible_lip.to_leg_angle(
+                scan['step_pos_' + direction][cop_idx])
+        return scan
+
+
+    def total_cost(self, swing_cost_ap, swing_cost_ml, sts_cost, ankle_cost_ap, ankle_cost_ml):
+        """
+        Weighted sum of the costs, see SimulationSettings for the gains.
+        =NOTES=
+            With swing_cost_ap 0 the result is a lower bound of the total cost,
+            also in floating point, as long as gain_swing_cost_ap >= 0.
+        """
+        return (self.settings.gain_swing_cost_ap * swing_cost_ap +
+            self.settings.gain_swing_cost_ml * swing_cost_ml +
+            self.settings.gain_sts_cost * sts_cost +
+            self.settings.gain_ankle_cost_ap * ankle_cost_ap +
+            self.settings.gain_ankle_cost_ml * ankle_cost_ml)
+
+
+    def simulate_lip(self, lip, cop_shift):
+        """
+        Copy of lip simulated over the horizon with a CoP shift
+        """
+        lip = copy.deepcopy(lip)
+        lip.simulate(self.horizon, cop_shift)
+        return lip
+
+
+    def map(self, function, *iterables):
+        """
+        Like map, on the thread pool of settings.n_scan_workers threads if
+        there is more than 1. The results are in order of the inputs.
+        """
+        if self.settings.n_scan_workers > 1:
+            return list(thread_pool(self.settings.n_scan_workers).map(function, *iterables))
+        return list(map(function, *iterables))
+
+
+    def swing_cost(self, swing_leg, initial_leg_angle, final_leg_angle, window=None):
+        """
+        Swing costs over the horizon, see SwingLeg.compute_swing_cost.
+
+        =INPUT=
+            swing_leg - SwingLeg
+            initial_leg_angle - float
+            final_leg_angle - ndarray of shape (N,)
+                Final leg angle for each time in the horizon
+            window - tuple of int [None]
+                (start, stop) indices of the horizon to compute the costs for,
+                the others are infinite. If None, the full horizon.
+        =OUTPUT=
+            swing_cost - ndarray of shape (N,)
+        """
+        n_workers = self.settings.n_scan_workers
+        if window is None and n_workers <= 1:
+            return swing_leg.compute_swing_cost(self.t_step, self.horizon, initial_leg_angle, final_leg_angle)
+
+        # Chunks of the horizon on the thread pool, more chunks than threads
+        # as the later swing times take longer
+        if n_workers > 1:
+            (executor, n_block) = (thread_pool(n_workers), 4 * n_workers)
+        else:
+            (executor, n_block) = (None, 1)
+        swing_cost = swing_leg.compute_swing_cost_batch(self.t_step, self.horizon,
+            initial_leg_angle, final_leg_angle.reshape(1, -1), window=window,
+            executor=executor, n_block=n_block)[0]
+        swing_leg.initial_angle = initial_leg_angle
+        return swing_cost
+
+
+    def take_step(self, scan, idx_step, pert_counter=None, verbose=True, t_offset=0):
+        """
+        Step to the lowest cost CoP offset and step time of a horizon scan.
+
+        =INPUT=
+            scan - dict
+                See scan_horizon
+            idx_step - int
+                Step number, used in the cost samples and printing
+            pert_counter, verbose
+                See run
+            t_offset - float [0]
+                Time already spent in this swing before the scan
+        =NOTES=
+            If step_callback is set, it is called with a dict describing the
+            step: the CoM state, stance foot and CoP shift at the start of the
+            scan, the swing time and t_offset, the new step location and the
+            initial and final swing leg angles, each as (AP, ML), and the
+            chosen cop_idx and time_idx.
+        =OUTPUT=
+            initial_leg_angle_ap, initial_leg_angle_ml - float
+                Initial swing leg angles for the next step
+        """
+        possible_lips = {'lip_ap': scan['lip_ap'], 'lip_ml': scan['lip_ml']}
+        possible_step_ap = scan['step_pos_ap']
+        possible_step_ml = scan['step_pos_ml']
+        swing_costs_ap = scan['swing_cost_ap']
+        swing_costs_ml = scan['swing_cost_ml']
+        sts_costs = scan['sts_cost']
+        ankle_costs_ap = scan['ankle_cost_ap']
+        ankle_costs_ml = scan['ankle_cost_ml']
+        best_cop_idx = scan['best_cop_idx']
+        best_time_idx = scan['best_time_idx']
+
+        # Use best indices to overwrite lip with best lip model
+        self.lip_ap = possible_lips['lip_ap'][best_cop_idx]
+        self.lip_ml = possible_lips['lip_ml'][0]
+
+        self.step_pos_ap = possible_step_ap[best_cop_idx]
+        self.step_pos_ml = possible_step_ml[0]
+
+        # Take data sample for plotting
+        self.sim_data.take_sample(
+            t_offset + self.horizon[best_time_idx],
+            self.lip_ap,
+            self.lip_ml,
+            self.step_pos_ap[best_time_idx],
+            self.step_pos_ml[best_time_idx],
+            index= best_time_idx)
+
+        # Take cost sample for full gait cost analysis (TODO: enable ml CoP modulation)
+        if pert_counter is None:
+            self.sim_data.take_fullgait_cost_sample(
+                stepnumber=idx_step,
+                chosen_cop=self.cop_offsets_ap[best_cop_idx],
+                ankle_cost_ap=ankle_costs_ap[best_cop_idx][best_time_idx],
+                ankle_cost_ml=ankle_costs_ml[0][best_time_idx],
+                swing_cost_ap=swing_costs_ap[best_cop_idx][best_time_idx],
+                swing_cost_ml=swing_costs_ml[0][best_time_idx],
+                sts_cost=sts_costs[0][best_cop_idx][best_time_idx]
+            )
+
+        # Take cost sample for step specific cost analysis, or only the Pareto
+        # front of the costs, from which the step of other gains is found
+        if self.settings.store_pareto_front:
+            self.sim_data.take_pareto_sample(pareto.scan_front(scan))
+        elif pert_counter is None:
+            self.sim_data.take_stepspecific_cost_sample(
+                ankle_costs_ap, ankle_costs_ml, swing_costs_ap, swing_costs_ml, sts_costs)
+
+        # Take segment sample, from which the trajectory of the step is reconstructed
+        self.sim_data.take_segment_sample(
+            self.horizon[best_time_idx],
+            scan['initial_state'][0::2],
+            scan['initial_state'][1::2],
+            (self.lip_ap.cop_origin, self.lip_ml.cop_origin),
+            (self.lip_ap.cop_shift, self.lip_ml.cop_shift),
+            scan['initial_leg_angle'],
+            (scan['final_leg_angle_ap'][best_cop_idx][best_time_idx], scan['final_leg_angle_ml'][0][best_time_idx]),
+            self.horizon[best_time_idx],
+            self.is_right_swing)
+
+        # Pass the step on, with all that is needed to reconstruct it analytically
+        if self.step_callback is not None:
+            self.step_callback({
+                't_offset': t_offset,
+                't_swing': self.horizon[best_time_idx],
+                'com_pos': scan['initial_state'][0::2],
+                'com_vel': scan['initial_state'][1::2],
+                'foot_pos': (self.lip_ap.cop_origin, self.lip_ml.cop_origin),
+                'cop_shift': (self.lip_ap.cop_shift, self.lip_ml.cop_shift),
+                'step_pos': (self.step_pos_ap[best_time_idx], self.step_pos_ml[best_time_idx]),
+                'leg_angle': scan['initial_leg_angle'],
+                'cop_idx': best_cop_idx,
+                'time_idx': best_time_idx,
+                'final_leg_angle': (scan['final_leg_angle_ap'][best_cop_idx][best_time_idx],
+                                    scan['final_leg_angle_ml'][0][best_time_idx])})
+
+        # Obtain the initial swing leg angle for next step
+        initial_leg_angle_ap = self.lip_ap.to_leg_angle()[best_time_idx]
+        initial_leg_angle_ml = self.lip_ml.to_leg_angle()[best_time_idx]
+
+        # Update models to new global state
+        self.lip_ap.override_state(
+            self.lip_ap.com_pos[best_time_idx],
+            self.lip_ap.com_vel[best_time_idx],
+            self.step_pos_ap[best_time_idx],
+            self.step_pos_ap[best_time_idx], cop_shift=0)
+        self.lip_ml.override_state(
+            self.lip_ml.com_pos[best_time_idx],
+            self.lip_ml.com_vel[best_time_idx],
+            self.step_pos_ml[best_time_idx],
+            self.step_pos_ml[best_time_idx], cop_shift=0)    
+
+        # Change the leg
+        self.is_right_swing = not self.is_right_swing
+
+        # Print chosen CoP
+        # TODO: is not yet updated for possible ml CoP modulation
+        if not verbose:
+            pass
+        elif pert_counter is None:
+            print('step', idx_step, 'uses', self.cop_offsets_ap[best_cop_idx], 'as CoP offset')
+        else:
+            print('perturbation', pert_counter, 'uses', self.cop_offsets_ap[best_cop_idx], 'as CoP offset')
+
+        # if (self.cop_offsets_ap[best_cop_idx] != 0.005263157894736831 and self.cop_offsets_ap[best_cop_idx] != 0):
+            # print('ankle is used')
+
+        return initial_leg_angle_ap, initial_leg_angle_ml
+
+
     def copy_state_to(self, simulation):
 
         simulation.lip_ap = copy.deepcopy(self.lip_ap)
@@ -248,3 +621,67 @@ class Simulator(object):
         simulation.swing_leg_ml = copy.deepcopy(self.swing_leg_ml)
 
         return
+
+
+# Thread pools of the horizon scan by number of threads, shared between
+# simulators so that these can still be copied and pickled
+_thread_pools = {}
+
+
+def thread_pool(n_workers):
+    if n_workers not in _thread_pools:
+        _thread_pools[n_workers] = ThreadPoolExecutor(max_workers=n_workers)
+    return _thread_pools[n_workers]
+
+
+# Scan caches by settings and CoP modulation, shared between simulators. Only
+# the most recently used are kept, so that a sweep over many settings does not
+# hold on to the caches of all of them; simulators keep the cache they got.
+_scan_caches = collections.OrderedDict()
+_MAX_SCAN_CACHES = 4
+
+
+def scan_cache(settings, cop_modulation):
+    key = (settings, bool(cop_modulation))
+    if key not in _scan_caches:
+        _scan_caches[key] = ScanCache(settings.scan_cache_size, settings.scan_cache_tolerance)
+        while len(_scan_caches) > _MAX_SCAN_CACHES:
+            _scan_caches.popitem(last=False)
+    _scan_caches.move_to_end(key)
+    return _scan_caches[key]
+
+
+def clear_scan_caches():
+    """
+    Drop all shared scan caches
+    """
+    _scan_caches.clear()
+    return
+
+
+def feasible_window(is_feasible):
+    """
+    Smallest (start, stop) index range that contains all feasible steps.
+    =INPUT=
+        is_feasible - ndarray of bool of shape (N,)
+    =OUTPUT=
+        window - tuple of int
+            (0, 0) if no step is feasible
+    """
+    indices = np.flatnonzero(is_feasible)
+    if indices.size == 0:
+        return (0, 0)
+    return (indices[0], indices[-1] + 1)
+
+
+def intersect_windows(window_a, window_b):
+    """
+    Index range that is in both windows, see feasible_window. A window of
+    None is the full range.
+    """
+    if window_a is None:
+        return window_b
+    if window_b is None:
+        return window_a
+    start = max(window_a[0], window_b[0])
+    return (start, max(start, min(window_a[1], window_b[1])))
@@ -13,14 +13,36 @@ class StepAnalysis(object):
         return
 
     def compute_analysis_variables(self):
+        metrics = self.metrics()
+
+        print('\nr-squared ML is: ', metrics['r2_ml'])
+        print('r-squared AP is: ', metrics['r2_ap'])
+        print('\nRMS of distances is: ', metrics['rms'])
+        print('\nThe average steplength during steady state gate is: ', metrics['step_length'])
+        print('The average step width during steady state gate is: ', metrics['step_width'])
+        print('The average swing time is: ', metrics['swing_time'])
+        print('The average forward velocity is: ', metrics['speed'], '\n')
+
+        return metrics['rms']
+
+
+    def metrics(self):
+        """
+        =OUTPUT=
+            metrics - dict
+                r2_ml, r2_ap and rms of the model against the experimental
+                steps, and the steady state step_length, step_width,
+                swing_time and (forward) speed
+        """
+        metrics = {}
+
         # Compute correlation matrix and r^2 values
         corr_matrix_y = np.corrcoef(self.experiment_steps[0], self.model_steps[0])
         corr_matrix_x = np.corrcoef(self.experiment_steps[1], self.model_steps[1])
         r2_matrix_x = np.square(corr_matrix_x)
         r2_matrix_y = np.square(corr_matrix_y)
-
-        print('\nr-squared ML is: ',r2_matrix_x[0][1])
-        print('r-squared AP is: ',r2_matrix_y[0][1])
+        metrics['r2_ml'] = r2_matrix_x[0][1]
+        metrics['r2_ap'] = r2_matrix_y[0][1]
 
         # Compute distance array
         dist_x = abs(np.subtract(self.experiment_steps[0],self.model_steps[0]))
@@ -33,27 +55,20 @@ class StepAnalysis(object):
         for idx in range(len(dist)):
             summation += dist[idx] ** 2
         
-        RMS = m.sqrt((1/len(dist))*summation)
-
-        print('\nRMS of distances is: ', RMS)
+        metrics['rms'] = m.sqrt((1/len(dist))*summation)
 
         # Compute average step length
         steplengths = [x - self.ss_step_positions[0][i - 1] for i, x in enumerate(self.ss_step_positions[0]) if i > 0]
-        mean_steplength = np.mean(steplengths)
-        print('\nThe average steplength during steady state gate is: ', mean_steplength)
+        metrics['step_length'] = np.mean(steplengths)
 
         # Compute average step width
         stepwidths = np.abs([x - self.ss_step_positions[1][i - 1] for i, x in enumerate(self.ss_step_positions[1]) if i > 0])
-        mean_stepwidth = np.mean(stepwidths)
-        print('The average step width during steady state gate is: ', mean_stepwidth)
+        metrics['step_width'] = np.mean(stepwidths)
 
         # Compute average swing time
-        mean_steptime = np.mean(self.ss_swingtimes)
-        print('The average swing time is: ', mean_steptime)
+        metrics['swing_time'] = np.mean(self.ss_swingtimes)
 
         # Compute average forward velocity
-        mean_velocity = np.mean(self.ss_com_vel[0])
-        print('The average forward velocity is: ', mean_velocity, '\n')
-
-        return RMS
+        metrics['speed'] = np.mean(self.ss_com_vel[0])
 
+        return metrics
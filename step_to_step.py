@@ -9,8 +9,9 @@ def transition_cost(mass, lip_ap, lip_ml, step_pos_ap, step_pos_ml):
         mass - float
         lip_ap, lip_ml - instance of class LIP2D
         foot_pos_ap, foot_pos_ml - float or ndarray of shape (N,)
+            May also be of shape (M, N) for M walkers at once, see BatchSimulator
     =OUTPUT=
-        sts_cost - float or ndarray of shape (N,) or (N, 1)
+        sts_cost - float or ndarray of the same shape as lip_ap.com_vel
     =NOTES=
         The vertical component is chosen such that, when it is combined with
         the horizontal components, the resultant velocity vector is perpendicular
@@ -22,18 +23,18 @@ def transition_cost(mass, lip_ap, lip_ml, step_pos_ap, step_pos_ml):
     """
 
     if isinstance(lip_ap.com_vel, np.ndarray):
-        com_vel = np.ones((lip_ap.com_vel.size, 3), dtype='float')
+        com_vel = np.ones((lip_ap.com_vel.size, 3), dtype=lip_ap.com_vel.dtype)
     else:
         com_vel = np.ones((1, 3), dtype='float')
     leg_vector = com_vel.copy()
 
     # Obtain total velocity vector (note: ones is used above!)
-    com_vel[:, 0] = lip_ap.com_vel
-    com_vel[:, 1] = lip_ml.com_vel
+    com_vel[:, 0] = np.ravel(lip_ap.com_vel)
+    com_vel[:, 1] = np.ravel(lip_ml.com_vel)
 
     # Obtain trailing leg vector
-    leg_vector[:, 0], _ = lip_ap.to_local()
-    leg_vector[:, 1], _ = lip_ml.to_local()
+    leg_vector[:, 0] = np.ravel(lip_ap.to_local()[0])
+    leg_vector[:, 1] = np.ravel(lip_ml.to_local()[0])
     leg_vector[:, 2] = lip_ap.leg_length
 
     # Obtain vertical velocity before transition (should be negative)
@@ -41,8 +42,8 @@ def transition_cost(mass, lip_ap, lip_ml, step_pos_ap, step_pos_ml):
     pre_vertical_com_vel = (product[:, 0] + product[:, 1]) / -product[:, 2]
 
     # obtain leading leg vector
-    leg_vector[:, 0], _ = lip_ap.to_local(origin=step_pos_ap)
-    leg_vector[:, 1], _ = lip_ml.to_local(origin=step_pos_ml)
+    leg_vector[:, 0] = np.ravel(lip_ap.to_local(origin=step_pos_ap)[0])
+    leg_vector[:, 1] = np.ravel(lip_ml.to_local(origin=step_pos_ml)[0])
     
     # Obtain vertical velocity after transition (should be positive)
     product = leg_vector * com_vel
@@ -54,14 +55,32 @@ def transition_cost(mass, lip_ap, lip_ml, step_pos_ap, step_pos_ml):
     # Set sts cost to infinite for invalid steps
     # mask = np.sign(pre_vertical_com_vel) * np.sign(post_vertical_com_vel) >= 0
     # sts_cost[mask] = np.inf
-    mask = np.logical_or(
-        lip_ap.to_local()[0] * lip_ap.to_local(origin=step_pos_ap)[0] > 0,
-        lip_ml.to_local()[0] * lip_ml.to_local(origin=step_pos_ml)[0] > 0)
-    sts_cost[mask] = 2**64 - 1
+    mask = np.logical_not(feasible_steps(lip_ap, lip_ml, step_pos_ap, step_pos_ml))
+    sts_cost[np.ravel(mask)] = 2**64 - 1
 
     # Make scalar if input was also scalar
     if not isinstance(lip_ap.com_vel, np.ndarray):
         sts_cost = sts_cost[0]
+    else:
+        sts_cost.shape = lip_ap.com_vel.shape
 
     return sts_cost
 
+
+def feasible_steps(lip_ap, lip_ml, step_pos_ap, step_pos_ml):
+    """
+    Find the steps that are valid, i.e. for which the foot placement location
+    is not on the same side of the COM as the stance foot, in both directions.
+
+    =INPUT=
+        See transition_cost
+    =OUTPUT=
+        is_feasible - bool or ndarray of the same shape as lip_ap.com_vel
+    =NOTES=
+        Only needs the COM and (XCOM based) step location trajectories, so it
+        is cheap compared to the costs, which need not be computed for
+        infeasible steps.
+    """
+    return np.logical_not(np.logical_or(
+        lip_ap.to_local()[0] * lip_ap.to_local(origin=step_pos_ap)[0] > 0,
+        lip_ml.to_local()[0] * lip_ml.to_local(origin=step_pos_ml)[0] > 0))
@@ -0,0 +1,327 @@
+"""
+Batch runs of the model from a declarative job spec. The spec gives the
+baseline settings, parameter grids, perturbation sets and the outputs to
+keep; every combination of grid point and perturbation set is a job, run on
+a pool of worker processes. Results are cached by content, so that an
+interrupted or extended sweep only runs the jobs it is missing.
+Run as python sweep.py spec.json [--results DIR] [--workers N] [--cache DIR]
+
+Example spec (JSON, or the same structure in TOML):
+    {
+        "name": "sts_gain",
+        "baseline": {"n_step_to_steady_state": 20},
+        "grid": {"gain_sts_cost": [0.05, 0.1, 0.2], "xcom_offset_ap": [-0.12, -0.1364]},
+        "perturbation_sets": {
+            "ap": {"pertAP": true, "perturbations": [-0.24, 0.24]},
+            "ml": {"pertAP": false, "perturbations": [-0.24, 0.24]}},
+        "outputs": ["metrics", "steps"]
+    }
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import scenario
+from settings import SimulationSettings
+from sensitivity import METRICS
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+
+# metrics: StepAnalysis.metrics, steps: the step data of every simulation,
+# costs: the cost components of the chosen steps of the steady state gait
+OUTPUTS = ('metrics', 'steps', 'costs')
+
+SPEC_KEYS = ('name', 'baseline', 'grid', 'perturbation_sets', 'outputs', 'exp_step_offsets')
+
+
+def load_spec(path):
+    """
+    =INPUT=
+        path - str
+            JSON file, or TOML file (.toml) with Python 3.11 or higher
+    =OUTPUT=
+        spec - dict
+            With defaults for the keys that are not given
+    """
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise ValueError('TOML specs need Python 3.11 or higher, use JSON instead')
+        with open(path, 'rb') as file:
+            spec = tomllib.load(file)
+    else:
+        with open(path) as file:
+            spec = json.load(file)
+
+    unknown = set(spec) - set(SPEC_KEYS)
+    if unknown:
+        raise ValueError('unknown spec keys %s' % sorted(unknown))
+    spec.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    spec.setdefault('baseline', {})
+    spec.setdefault('grid', {})
+    spec.setdefault('perturbation_sets', {'default': {}})
+    spec.setdefault('outputs', list(OUTPUTS))
+    spec.setdefault('exp_step_offsets', None)
+    if set(spec['outputs']) - set(OUTPUTS):
+        raise ValueError('unknown outputs %s' % sorted(set(spec['outputs']) - set(OUTPUTS)))
+    return spec
+
+
+def expand_jobs(spec):
+    """
+    =OUTPUT=
+        jobs - list of tuple
+            (parameters, settings) for every combination of grid point and
+            perturbation set, parameters is a dict of the grid values and
+            the perturbation_set name
+    """
+    baseline = SimulationSettings().replace(**spec['baseline'])
+    names = list(spec['grid'])
+    jobs = []
+    for values in itertools.product(*[spec['grid'][name] for name in names]):
+        for (set_name, perturbation_set) in spec['perturbation_sets'].items():
+            parameters = dict(zip(names, values), perturbation_set=set_name)
+            settings = baseline.replace(**dict(zip(names, values))).replace(**perturbation_set)
+            jobs.append((parameters, settings))
+    return jobs
+
+
+def run_job(settings, outputs=OUTPUTS, exp_step_offsets=None):
+    """
+    Steady state gait and the responses to the perturbations in settings,
+    as in main.py.
+
+    =INPUT=
+        settings - SimulationSettings
+        outputs - sequence of str [OUTPUTS]
+        exp_step_offsets - ndarray of shape (2, P) [None]
+            See SensitivityAnalysis
+    =OUTPUT=
+        result - dict
+            The requested outputs. steps holds the time, com_pos, com_vel,
+            cop_pos and step_pos of the steady state gait and of every
+            perturbation, see DataStorage.
+    """
+    (baseline, sims) = scenario.walk(settings)
+
+    result = {}
+    if 'metrics' in outputs:
+        result['metrics'] = scenario.first_step_metrics(baseline, sims, exp_step_offsets)
+    if 'steps' in outputs:
+        result['steps'] = [{key: getattr(sim.sim_data, key) for key in ('time', 'com_pos', 'com_vel', 'cop_pos', 'step_pos')}
+                           for sim in [baseline] + sims]
+    if 'costs' in outputs:
+        result['costs'] = baseline.sim_data.cost_landscape_fullgait
+
+    return result
+
+
+class ResultCache(object):
+    """
+    Job results stored under a hash of everything they depend on: the
+    fully resolved settings (including the initial state), the outputs and
+    the experimental data. Shared between sweeps, so that extended or
+    interrupted sweeps only run the missing jobs.
+
+    =NOTES=
+        Entries are written to a temporary file that is then renamed, so
+        concurrent writers (of the same, deterministic result) and readers
+        never see a partial entry. Entries do not depend on the model code:
+        clear the cache after changing it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        return
+
+
+    def key(self, settings, outputs, exp_step_offsets=None):
+        if exp_step_offsets is not None:
+            exp_step_offsets = np.asarray(exp_step_offsets, dtype=float).tolist()
+        content = json.dumps([settings.digest(), sorted(outputs), exp_step_offsets])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+
+    def get(self, key):
+        """
+        =OUTPUT=
+            entry - dict
+                settings and result of the job, None if it is not cached
+        """
+        try:
+            with open(self.path(key)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+
+    def put(self, key, settings, result):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), suffix='.tmp', delete=False) as file:
+            json.dump(_to_json({'settings': settings_fields(settings), 'result': result}), file, allow_nan=False)
+        os.replace(file.name, path)
+        return
+
+
+class Sweep(object):
+    """
+    The jobs of a spec, run on worker processes. Jobs whose results are
+    cached are not run again.
+    """
+
+    def __init__(self, spec, results_dir='results', n_workers=None, cache_dir=None):
+        """
+        =INPUT=
+            spec - dict
+                See load_spec
+            results_dir - str ['results']
+                Results are written to results_dir/<spec name>/: spec.json
+                and summary.csv with the parameters, cache key and metrics of
+                every job
+            n_workers - int [None]
+                Number of worker processes. If None, the cpu count is used.
+                If 1, all jobs are run in the current process.
+            cache_dir - str [None]
+                ResultCache directory, holding the settings and outputs of
+                every job. If None, results_dir/cache.
+        """
+        self.spec = spec
+        self.directory = os.path.join(results_dir, spec['name'])
+        self.n_workers = n_workers
+        self.cache = ResultCache(cache_dir if cache_dir is not None else os.path.join(results_dir, 'cache'))
+        self.jobs = expand_jobs(spec)
+        self.keys = [self.cache.key(settings, spec['outputs'], spec['exp_step_offsets']) for (_, settings) in self.jobs]
+        return
+
+
+    def run(self, progress=print):
+        """
+        =INPUT=
+            progress - callable [print]
+                Called with a line of text for every finished job, None for
+                silence
+        =OUTPUT=
+            results - list of dict
+                Outputs of every job, in the order of jobs, as stored in the
+                cache: lists instead of arrays, and None for NaN
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'spec.json'), 'w') as file:
+            json.dump(self.spec, file, indent=4)
+
+        # Cached results, then the missing jobs (once per key)
+        results = [None] * len(self.jobs)
+        missing = {}
+        for (idx, key) in enumerate(self.keys):
+            entry = self.cache.get(key)
+            if entry is not None:
+                results[idx] = entry['result']
+            else:
+                missing.setdefault(key, []).append(idx)
+        if progress is not None:
+            progress('%d of %d jobs cached' % (len(self.jobs) - sum(map(len, missing.values())), len(self.jobs)))
+
+        start = time.perf_counter()
+        tasks = self.tasks([indices[0] for indices in missing.values()])
+        for (n_done, (idx, result)) in enumerate(self.map(tasks), start=1):
+            result = _to_json(result)
+            self.cache.put(self.keys[idx], self.jobs[idx][1], result)
+            for duplicate in missing[self.keys[idx]]:
+                results[duplicate] = result
+            if progress is not None:
+                progress('[%d/%d] %s (%.1f s)' % (n_done, len(tasks), _describe(self.jobs[idx][0]),
+                                                  time.perf_counter() - start))
+
+        self.write_summary(results)
+        return results
+
+
+    def tasks(self, indices):
+        exp_step_offsets = self.spec['exp_step_offsets']
+        if exp_step_offsets is not None:
+            exp_step_offsets = np.asarray(exp_step_offsets)
+        return [(idx, self.jobs[idx][1], tuple(self.spec['outputs']), exp_step_offsets) for idx in indices]
+
+
+    def map(self, tasks):
+        """
+        (index, result) of the tasks, in order of completion
+        """
+        if self.n_workers == 1:
+            for task in tasks:
+                yield _run_task(task)
+            return
+        if not tasks:
+            return
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+            for future in as_completed([executor.submit(_run_task, task) for task in tasks]):
+                yield future.result()
+
+
+    def write_summary(self, results):
+        names = list(self.spec['grid']) + ['perturbation_set']
+        with open(os.path.join(self.directory, 'summary.csv'), 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['job'] + names + ['key'] + list(METRICS))
+            for (idx, ((parameters, _), key, result)) in enumerate(zip(self.jobs, self.keys, results)):
+                metrics = result.get('metrics', {})
+                writer.writerow([idx] + [parameters[name] for name in names] + [key] +
+                                [metrics.get(metric, '') for metric in METRICS])
+        return
+
+
+def settings_fields(settings):
+    return {name: getattr(settings, name) for name in settings.__dataclass_fields__}
+
+
+def _run_task(task):
+    (idx, settings, outputs, exp_step_offsets) = task
+    return idx, run_job(settings, outputs, exp_step_offsets)
+
+
+def _describe(parameters):
+    return ', '.join('%s=%s' % item for item in parameters.items())
+
+
+def _to_json(value):
+    """
+    value with arrays as lists, numpy scalars as Python ones and NaN (or
+    infinity, which standard JSON lacks too) as None, as read back from JSON
+    """
+    if isinstance(value, dict):
+        return {key: _to_json(item) for (key, item) in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the jobs of a sweep spec')
+    parser.add_argument('spec', help='JSON or TOML job spec')
+    parser.add_argument('--results', default='results', help='results directory [results]')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes [cpu count]')
+    parser.add_argument('--cache', default=None, help='result cache directory [RESULTS/cache]')
+    arguments = parser.parse_args()
+
+    sweep = Sweep(load_spec(arguments.spec), arguments.results, arguments.workers, arguments.cache)
+    print('%d jobs, results in %s' % (len(sweep.jobs), sweep.directory))
+    sweep.run()
@@ -39,7 +39,8 @@ class SwingLeg(object):
             t_step - float
                 Time step used in computing moment profiles
             t_swing - float or ndarray of shape (N,) or (N, 1)
-                Total swing time between initial and final leg angle
+                Total swing time between initial and final leg angle,
+                rounded to a multiple of t_step
             initial_angle - float or ndarray of shape (N,) or (N, 1)
             final_angle - float or ndarray of shape (N,) or (N, 1)
                 Swing leg initial and final angle
@@ -52,6 +53,8 @@ class SwingLeg(object):
             array gets created, up to the longest t_swing, and evaluated
             for all points. This means that the horizon exceeds most t_swing.
             This is  computationally more efficient (no python loops).
+            The t_swing do not need to be uniformly spaced, the cost of each
+            is read from the cumulative cost at its own time.
         """
 
         # Check dimensions
@@ -83,10 +86,9 @@ class SwingLeg(object):
         # Obtain moment profile
         moment_profile = self.leg_moment_profile(t_leg)
         
-        # Compute the cost
-        # TODO: the diag gives problems if not square...
-        swing_cost = np.cumsum(abs(moment_profile) * t_step, axis=1).diagonal()
-        swing_cost.shape = (-1,)
+        # Compute the cost, up to the end of each swing
+        cost = np.cumsum(abs(moment_profile) * t_step, axis=1)
+        swing_cost = cost[np.arange(cost.shape[0]), swing_end_index(t_step, t_swing).reshape(-1)]
 
         # Revert to original dimensions
         if is_dimension_adjusted[0]:
@@ -99,6 +101,149 @@ class SwingLeg(object):
         return swing_cost
 
 
+    def compute_swing_cost_batch(self, t_step, t_swing, initial_angle, final_angle, block_size=2**22, window=None,
+                                 executor=None, n_block=1, dtype=float):
+        """
+        Compute swing costs for many walkers at once, see compute_swing_cost.
+
+        =INPUT=
+            t_step - float
+                Time step used in computing moment profiles
+            t_swing - ndarray of shape (N,)
+                Swing times, the horizon, increasing and rounded to
+                multiples of t_step
+            initial_angle - ndarray of shape (M,)
+                Swing leg initial angle of each of M walkers
+            final_angle - ndarray of shape (M, N)
+                Swing leg final angle of each walker for each swing time
+            block_size - int [2**22]
+                Maximum number of moment profile samples held in memory
+            window - tuple of int [None]
+                (start, stop) indices of the swing times to compute the cost
+                for, e.g. the feasible steps. If None, all swing times.
+            executor - concurrent.futures.Executor [None]
+                If given, blocks of swing times are computed on its threads
+            n_block - int [1]
+                Minimum number of blocks the window is split into
+            dtype - dtype [float]
+                Precision of the moment profiles and costs, e.g. np.float32
+                for half the memory traffic
+        =OUTPUT=
+            swing_cost - ndarray of shape (M, N)
+                Infinite outside of the window
+        =NOTES=
+            The moment profile of swing time t_swing[i] is only evaluated up
+            to t_swing[i] instead of up to the longest swing time, and the
+            phase of the cosine wave is shared between walkers. The result is
+            identical to calling compute_swing_cost for every walker.
+        """
+        t_swing = np.asarray(t_swing, dtype=dtype)
+        initial_angle = np.asarray(initial_angle, dtype=dtype).reshape(-1, 1, 1)
+        final_angle = np.asarray(final_angle, dtype=dtype)
+        (n_walker, n_time) = final_angle.shape
+
+        t_swing_max = t_swing.max()
+        t_leg = np.linspace(t_step, t_swing_max, int(round(t_swing_max / t_step)), dtype=dtype)
+        end_index = swing_end_index(t_step, t_swing)
+        swing_cost = np.full((n_walker, n_time), np.inf, dtype=dtype)
+        if window is None:
+            window = (0, n_time)
+
+        n_row = max(1, block_size // (max(n_walker, 1) * t_leg.size))
+        n_row = min(n_row, max(1, -(-(window[1] - window[0]) // n_block)))
+
+        def compute_block(start):
+            stop = min(start + n_row, window[1])
+            rows = np.arange(stop - start)
+
+            moment_profile = self._moment_profile(t_leg[:end_index[stop - 1] + 1],
+                t_swing[start:stop].reshape(1, -1, 1), initial_angle, final_angle[:, start:stop, None])
+            cost = np.cumsum(abs(moment_profile) * t_step, axis=2)
+            swing_cost[:, start:stop] = cost[:, rows, end_index[start:stop]]
+            return
+
+        # Blocks write to separate columns of swing_cost
+        starts = range(window[0], window[1], n_row)
+        if executor is None:
+            for start in starts:
+                compute_block(start)
+        else:
+            list(executor.map(compute_block, starts))
+
+        self.initial_angle = initial_angle.reshape(-1)
+        self.final_angle = final_angle
+        return swing_cost
+
+
+    def compute_swing_cost_pointwise(self, t_step, t_swing_max, t_swing, initial_angle, final_angle,
+                                     block_size=2**22):
+        """
+        Compute the swing costs of separate swings, each with its own swing
+        time, e.g. a few candidate steps of many walkers.
+
+        =INPUT=
+            t_step - float
+            t_swing_max - float
+                Longest swing time of the horizon, the moment profiles are
+                sampled on the same grid as in compute_swing_cost_batch
+            t_swing, initial_angle, final_angle - ndarray of shape (K,)
+            block_size - int [2**22]
+                Maximum number of moment profile samples held in memory
+        =OUTPUT=
+            swing_cost - ndarray of shape (K,)
+                Identical to the costs of compute_swing_cost_batch
+        """
+        t_swing = np.asarray(t_swing, dtype=float)
+        initial_angle = np.asarray(initial_angle, dtype=float)
+        final_angle = np.asarray(final_angle, dtype=float)
+        t_leg = np.linspace(t_step, t_swing_max, int(round(t_swing_max / t_step)))
+        end_index = swing_end_index(t_step, t_swing)
+        swing_cost = np.empty(t_swing.shape)
+
+        n_row = max(1, block_size // t_leg.size)
+        for start in range(0, t_swing.size, n_row):
+            block = slice(start, start + n_row)
+            moment_profile = self._moment_profile(t_leg[:end_index[block].max() + 1],
+                t_swing[block].reshape(-1, 1), initial_angle[block].reshape(-1, 1), final_angle[block].reshape(-1, 1))
+            cost = np.cumsum(abs(moment_profile) * t_step, axis=1)
+            swing_cost[block] = cost[np.arange(cost.shape[0]), end_index[block]]
+        return swing_cost
+
+
+    def _moment_profile(self, t_leg, t_swing, initial_angle, final_angle):
+        """
+        Same expressions as leg_moment_profile, for arrays that broadcast
+        against t_leg, without changing the swing leg
+        """
+        wave_frequency = 1 / (2 * t_swing)
+        wave_amplitude = final_angle - initial_angle / 2
+        cos_phase = np.cos(2 * np.pi * wave_frequency * t_leg)
+        acceleration = wave_amplitude * (2 * np.pi * wave_frequency)**2 * cos_phase
+        angle = initial_angle + wave_amplitude - wave_amplitude * cos_phase
+        return (self.mass * self.leg_length**2 * acceleration +
+            self.mass * self.gravity * self.leg_length * np.sin(angle))
+
+
+    def angle_at(self, t_leg, t_swing, initial_angle, final_angle):
+        """
+        Obtain the leg angle at t_leg of a swing from initial to final
+        angle over t_swing seconds, without computing its cost.
+
+        =INPUT=
+            t_leg - float or ndarray of shape (N,)
+            t_swing, initial_angle, final_angle - float or ndarray of shape (N,)
+                See compute_swing_cost
+        =OUTPUT=
+            leg_angle - float or ndarray of shape (N,)
+        """
+        self.initial_angle = initial_angle
+        self.final_angle = final_angle
+        self.set_frequency(t_swing)
+        self.set_amplitude()
+
+        return self.leg_angle_profile(t_leg)
+
+
     def set_frequency(self, t_swing):
         """
         =INPUT=
@@ -158,3 +303,16 @@ class SwingLeg(object):
         """
         return (self.wave_amplitude * (2 * np.pi * self.wave_frequency)**2 
         * np.cos(2 * np.pi * self.wave_frequency * t_leg))
+
+
+def swing_end_index(t_step, t_swing):
+    """
+    Index of the moment profile sample at the end of each swing, in a
+    profile sampled every t_step from t_step onwards
+    =INPUT=
+        t_step - float
+        t_swing - float or ndarray
+    =OUTPUT=
+        end_index - int or ndarray of int
+    """
+    return np.rint(np.asarray(t_swing) / t_step).astype(int) - 1
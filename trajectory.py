@@ -0,0 +1,89 @@
+"""
+Continuous trajectories of a simulation, reconstructed on demand. DataStorage
+only keeps the state at the start of every swing segment (see
+DataStorage.take_segment_sample), from which the LIP and swing leg profiles
+are evaluated analytically at any time, for all samples at once.
+"""
+
+import numpy as np
+from lip2d import LIP2D
+from swing_leg import SwingLeg
+
+
+class Trajectory(object):
+    """
+    CoM, XCoM, CoP, stance foot and swing leg angle of a simulation at any
+    time, with time 0 at the start of its first segment.
+    """
+
+    def __init__(self, sim_data, settings):
+        """
+        =INPUT=
+            sim_data - DataStorage
+                Data of the simulation, its segments
+            settings - SimulationSettings
+                Of the simulation, for the gravity and leg lengths
+        """
+        self.settings = settings
+        self.segments = {key: np.array(value, dtype=float) for (key, value) in sim_data.segments.items()}
+        if len(self.segments['duration']) == 0:
+            raise ValueError('the simulation has no segments')
+
+        # Start and end times of the segments
+        self.end_times = np.cumsum(self.segments['duration'])
+        self.start_times = self.end_times - self.segments['duration']
+        return
+
+
+    @property
+    def duration(self):
+        return self.end_times[-1]
+
+
+    def at(self, time):
+        """
+        =INPUT=
+            time - float or ndarray of shape (N,)
+                Between 0 and duration. At the end of a segment, the state
+                at the start of the next is returned.
+        =OUTPUT=
+            trajectory - dict
+                time and segment (index) of shape (N,), and com_pos,
+                com_vel, xcom_pos, cop_pos, foot_pos (stance foot) and
+                leg_angle (swing leg) of shape (2, N) as (AP, ML)
+        """
+        time = np.atleast_1d(np.asarray(time, dtype=float))
+        if np.any(time < 0) or np.any(time > self.duration):
+            raise ValueError('time outside of 0 to %g' % self.duration)
+        segment = np.minimum(np.searchsorted(self.end_times, time, side='right'), len(self.end_times) - 1)
+        t_local = time - self.start_times[segment]
+
+        trajectory = {'time': time, 'segment': segment}
+        for key in ('com_pos', 'com_vel', 'xcom_pos', 'cop_pos', 'foot_pos', 'leg_angle'):
+            trajectory[key] = np.empty((2, len(time)))
+        swing_leg = SwingLeg(mass=self.settings.mass_swing_leg, gravity=self.settings.gravity,
+                             leg_length=self.settings.swing_leg_length)
+
+        for idx in range(2):
+            (foot_pos, cop_shift) = (self.segments['foot_pos'][segment, idx], self.segments['cop_shift'][segment, idx])
+            lip = LIP2D(self.segments['com_pos'][segment, idx], self.segments['com_vel'][segment, idx],
+                        foot_pos, foot_pos, gravity=self.settings.gravity, leg_length=self.settings.leg_length)
+            lip.simulate(t_local, cop_shift)
+            trajectory['com_pos'][idx] = lip.com_pos
+            trajectory['com_vel'][idx] = lip.com_vel
+            trajectory['xcom_pos'][idx] = lip.xcom_pos
+            trajectory['cop_pos'][idx] = lip.cop_pos
+            trajectory['foot_pos'][idx] = foot_pos
+            trajectory['leg_angle'][idx] = swing_leg.angle_at(
+                t_local, self.segments['t_swing'][segment], self.segments['leg_angle'][segment, idx],
+                self.segments['final_leg_angle'][segment, idx])
+        return trajectory
+
+
+    def sample(self, rate):
+        """
+        Trajectory sampled at rate [Hz] from 0 up to and including the
+        duration, see at
+        """
+        time = np.arange(int(np.ceil(self.duration * rate))) / rate
+        return self.at(np.append(time[time < self.duration], self.duration))
@@ -0,0 +1,318 @@
+"""
+Viability or recovery maps. A dense grid of CoM velocities is imposed on
+the steady state gait at a number of perturbation timings, after which all
+grid cells are walked simultaneously with a BatchSimulator until they either
+recover to the steady state gait or fail.
+"""
+
+import copy
+import numpy as np
+from simulator_v2 import Simulator
+from batch_simulator import BatchSimulator
+
+
+class ViabilityMap(object):
+    """
+    Recovery map over initial CoM velocity (AP x ML) and perturbation timing.
+    """
+
+    def __init__(self, settings, com_vel_ap, com_vel_ml, pert_steps=(0,),
+                 tolerance=0.01, max_steps=10, max_deviation=1.0, baseline=None,
+                 use_symmetry=True, symmetry_tolerance=1e-9, n_spot_checks=8,
+                 settle_tolerance=1e-12, max_settle_steps=60):
+        """
+        =INPUT=
+            settings - SimulationSettings
+            com_vel_ap, com_vel_ml - ndarray of shape (N,) and (M,)
+                CoM velocities that replace the steady state CoM velocity
+                at the moment of perturbation
+            pert_steps - sequence of int [(0,)]
+                Number of steady state steps (of the steady state controller,
+                settings.cop_modulation_steady_state) taken from the settled
+                gait (see settle_tolerance) before the CoM velocity is
+                replaced. Consecutive timings differ in swing leg side.
+            tolerance - float [0.01]
+                Maximum deviation [m/s] of the AP and ML CoM velocity from the
+                steady state at the moment of stepping to count as recovered.
+                The steady state is that of the perturbation controller
+                (settings.cop_modulation_perturbation).
+            max_steps - int [10]
+                Number of steps after the perturbation after which a cell
+                that did not recover is counted as not viable
+            max_deviation - float [1.0]
+                Deviation [m/s] from the steady state beyond which a cell is
+                counted as not viable without simulating further
+            baseline - Simulator [None]
+                Simulator in steady state gait. If None, it is simulated
+                from settings.
+            use_symmetry - bool [True]
+                Take the cells of a timing from the mirrored cells of another
+                timing, if its state is the mirror image of that of the
+                other, see mirror_timings
+            symmetry_tolerance - float [1e-9]
+                Largest difference [m, rad] between mirrored timing states
+            n_spot_checks - int [8]
+                Number of mirrored cells that are also simulated, to verify
+                the symmetry. If one differs, all cells are simulated.
+            settle_tolerance - float [1e-12]
+                Before the first timing, the baseline is walked on until its
+                state [m, m/s, rad] changes by at most settle_tolerance over
+                a cycle of two steps, or for max_settle_steps steps. A
+                baseline after n_step_to_steady_state steps is typically
+                still converging, too far from its cycle for any timing to
+                be the mirror image of another within symmetry_tolerance. If
+                None, the timings are taken from the baseline as is.
+            max_settle_steps - int [60]
+                See settle_tolerance
+        =NOTES=
+            Positive ML velocities are to the left, regardless of the side
+            of the swing leg.
+        """
+        self.settings = settings
+        self.com_vel_ap = np.asarray(com_vel_ap, dtype=float)
+        self.com_vel_ml = np.asarray(com_vel_ml, dtype=float)
+        self.pert_steps = np.asarray(pert_steps, dtype=int)
+        self.tolerance = tolerance
+        self.max_steps = max_steps
+        self.max_deviation = max_deviation
+        self.use_symmetry = use_symmetry
+        self.symmetry_tolerance = symmetry_tolerance
+        self.n_spot_checks = n_spot_checks
+        self.settle_tolerance = settle_tolerance
+        self.max_settle_steps = max_settle_steps
+
+        if baseline is None:
+            baseline = Simulator(settings, cop_modulation=settings.cop_modulation_steady_state)
+            baseline.run(n_step=settings.n_step_to_steady_state, verbose=False)
+        self.baseline = baseline
+
+        self.n_steps = None
+
+        # Of the last compute: the number of steps taken to settle, the timing
+        # each timing is mirrored from (-1 if none), the number of simulated
+        # cells and of failed spot checks
+        self.n_settle_steps = None
+        self.mirrored_from = None
+        self.n_simulated = None
+        self.n_spot_check_failures = None
+        return
+
+
+    @property
+    def shape(self):
+        return (len(self.pert_steps), len(self.com_vel_ap), len(self.com_vel_ml))
+
+
+    @property
+    def recovered(self):
+        return self.n_steps >= 0
+
+
+    def compute(self):
+        """
+        =OUTPUT=
+            n_steps - ndarray of int16 of shape (P, N, M)
+                For every perturbation timing P and CoM velocity N x M, the
+                number of steps taken until recovery, or -1 if the walker
+                did not recover
+        =NOTES=
+            Cells of a timing that is the mirror image of another are the
+            cells of the other with the opposite ML velocity. This saves
+            simulations when the model is symmetric (is_mirror_symmetric)
+            and the gait has settled to within symmetry_tolerance of its
+            cycle: a map of consecutive timings then only simulates about
+            half of its cells. Otherwise no timing is mirrored, and all cells
+            are simulated.
+        """
+        settings = self.settings
+        cop_modulation = settings.cop_modulation_steady_state
+        n_timing = len(self.pert_steps)
+
+        # State of the steady state gait at every timing, walked by the steady
+        # state controller; the cells switch to the perturbation controller
+        steady = BatchSimulator.from_simulator(self.baseline, 1, cop_modulation=cop_modulation)
+        self.n_settle_steps = self.settle(steady)
+        timings = BatchSimulator.from_simulator(self.baseline, n_timing, cop_modulation=cop_modulation)
+        for idx_step in range(self.pert_steps.max() + 1):
+            steady.copy_state_to(timings, np.flatnonzero(self.pert_steps == idx_step))
+            if idx_step < self.pert_steps.max():
+                steady.step()
+        self.mirrored_from = self.mirror_timings(timings) if self.use_symmetry else -np.ones(n_timing, dtype=int)
+
+        # Cells to simulate, (timing, AP velocity, ML velocity), and the cell of every grid point
+        (timing, ap_idx, ml_idx) = [grid.reshape(-1) for grid in np.indices(self.shape)]
+        is_mirrored = self.mirrored_from[timing] >= 0
+        cells = [timing[~is_mirrored], self.com_vel_ap[ap_idx[~is_mirrored]], self.com_vel_ml[ml_idx[~is_mirrored]]]
+        source = -np.ones(timing.size, dtype=int)
+        source[~is_mirrored] = np.arange(np.sum(~is_mirrored))
+
+        # Mirrored grid points with the cell of the opposite ML velocity, or a new cell
+        partner = np.array([_index(self.com_vel_ml, -vel) for vel in self.com_vel_ml], dtype=int)
+        points = np.flatnonzero(is_mirrored)
+        base = self.mirrored_from[timing[points]]
+        has_partner = partner[ml_idx[points]] >= 0
+        source[points[has_partner]] = source[np.ravel_multi_index(
+            (base[has_partner], ap_idx[points[has_partner]], partner[ml_idx[points[has_partner]]]), self.shape)]
+        new = points[~has_partner]
+        source[new] = len(cells[0]) + np.arange(new.size)
+        cells = [np.concatenate(values) for values in zip(cells, (
+            base[~has_partner], self.com_vel_ap[ap_idx[new]], -self.com_vel_ml[ml_idx[new]]))]
+
+        # Spot checks: mirrored grid points that are also simulated themselves
+        checks = points[np.unique(np.linspace(0, points.size - 1, min(self.n_spot_checks, points.size)).astype(int))]
+        check_cells = len(cells[0]) + np.arange(checks.size)
+        cells = [np.concatenate(values) for values in zip(cells, (
+            timing[checks], self.com_vel_ap[ap_idx[checks]], self.com_vel_ml[ml_idx[checks]]))]
+
+        cell_steps = self.simulate_cells(timings, *cells)
+        self.n_simulated = len(cells[0])
+        self.n_spot_check_failures = int(np.sum(cell_steps[check_cells] != cell_steps[source[checks]]))
+        if self.n_spot_check_failures > 0:
+            cell_steps = self.simulate_cells(timings, timing, self.com_vel_ap[ap_idx], self.com_vel_ml[ml_idx])
+            self.n_simulated += timing.size
+            source = np.arange(timing.size)
+
+        self.n_steps = cell_steps[source].reshape(self.shape)
+        return self.n_steps
+
+
+    def simulate_cells(self, timings, timing, com_vel_ap, com_vel_ml):
+        """
+        =INPUT=
+            timings - BatchSimulator
+                The steady state gait at every timing
+            timing, com_vel_ap, com_vel_ml - ndarray of shape (K,)
+                Timing index and CoM velocities of every cell
+        =OUTPUT=
+            n_steps - ndarray of int16 of shape (K,)
+                See compute
+        """
+        settings = self.settings
+        cop_modulation = settings.cop_modulation_perturbation
+        n_cell = timing.size
+
+        # Steady state velocity of the perturbation controller, the ML
+        # velocity is mirrored after each step
+        reference = BatchSimulator.from_simulator(self.baseline, 1, cop_modulation=cop_modulation)
+        for _ in range(settings.n_step_to_steady_state):
+            reference.step()
+        ss_vel_ap = reference.com_vel_ap[0]
+        ss_vel_ml = reference.com_vel_ml[0]
+        ss_is_right_swing = reference.is_right_swing[0]
+
+        cells = BatchSimulator.from_simulator(self.baseline, n_cell, cop_modulation=cop_modulation)
+        for idx in range(len(self.pert_steps)):
+            timings.copy_state_to(cells, np.flatnonzero(timing == idx), index=idx)
+        cells.com_vel_ap[:] = com_vel_ap
+        cells.com_vel_ml[:] = com_vel_ml
+
+        n_steps = -np.ones(n_cell, dtype=np.int16)
+        is_active = np.ones(n_cell, dtype=bool)
+        sentinel = settings.gain_sts_cost * (2**64 - 1)
+
+        for n_taken in range(1, self.max_steps + 1):
+            walkers = np.flatnonzero(is_active)
+            if walkers.size == 0:
+                break
+            result = cells.step(walkers)
+
+            # Compare to steady state, then terminate recovered and failed cells
+            mirror = np.where(cells.is_right_swing[walkers] == ss_is_right_swing, 1, -1)
+            deviation = np.maximum(
+                abs(result['com_vel_ap'] - ss_vel_ap),
+                abs(result['com_vel_ml'] - mirror * ss_vel_ml))
+
+            is_recovered = deviation <= self.tolerance
+            n_steps[walkers[is_recovered]] = n_taken
+
+            is_failed = np.logical_or(deviation > self.max_deviation, result['total_cost'] >= sentinel)
+            is_failed |= n_taken >= self.max_steps
+            is_active[walkers[np.logical_or(is_recovered, is_failed)]] = False
+
+        return n_steps
+
+
+    def settle(self, steady):
+        """
+        Walk a steady state gait (a BatchSimulator of one walker) until it
+        repeats itself every two steps within settle_tolerance.
+
+        =OUTPUT=
+            n_step - int
+                Number of steps taken, max_settle_steps if the gait did not
+                settle
+        """
+        if self.settle_tolerance is None:
+            return 0
+        states = [_gait_state(steady)]
+        for n_step in range(self.max_settle_steps):
+            if len(states) >= 3 and np.max(np.abs(states[-1] - states[-3])) <= self.settle_tolerance:
+                return n_step
+            steady.step()
+            states.append(_gait_state(steady))
+        return self.max_settle_steps
+
+
+    def mirror_timings(self, timings):
+        """
+        =INPUT=
+            timings - BatchSimulator
+                The steady state gait at every timing
+        =OUTPUT=
+            mirrored_from - ndarray of int of shape (P,)
+                For every timing, an earlier timing whose state is its
+                mirror image, or -1. The CoM velocity is not compared, as
+                the cells replace it.
+        """
+        mirrored_from = -np.ones(len(self.pert_steps), dtype=int)
+        if not is_mirror_symmetric(self.settings):
+            return mirrored_from
+
+        mirrors = copy.deepcopy(timings)
+        mirrors.mirror()
+
+        for idx in range(len(self.pert_steps)):
+            for base in np.flatnonzero(mirrored_from[:idx] < 0):
+                if (mirrors.is_right_swing[base] == timings.is_right_swing[idx] and
+                        np.max(np.abs(_local_state(mirrors, base) - _local_state(timings, idx))) <= self.symmetry_tolerance):
+                    mirrored_from[idx] = base
+                    break
+        return mirrored_from
+
+
+def is_mirror_symmetric(settings):
+    """
+    Whether the model is left/right symmetric: a walker mirrored in the ML
+    direction takes the mirrored steps, see BatchSimulator.mirror.
+    =NOTES=
+        The ML dynamics, XCoM offsets (which follow the swing leg side) and
+        costs are symmetric, except for the ML CoP offsets. These are taken
+        from a grid that is symmetric about 0, and as only the first one is
+        used (see Simulator.scan_horizon), it has to be 0.
+    """
+    cop_offsets_ml = settings.cop_offsets_ml
+    return bool(np.allclose(np.sort(cop_offsets_ml), np.sort(-cop_offsets_ml), rtol=0, atol=1e-12) and
+                cop_offsets_ml[0] == 0)
+
+
+def _local_state(batch, index):
+    """
+    CoM relative to the stance foot and swing leg angles, AP and ML
+    """
+    return np.array([batch.com_pos_ap[index] - batch.foot_pos_ap[index], batch.leg_angle_ap[index],
+                     batch.com_pos_ml[index] - batch.foot_pos_ml[index], batch.leg_angle_ml[index]])
+
+
+def _gait_state(batch, index=0):
+    """
+    Local state and CoM velocity, AP and ML
+    """
+    return np.append(_local_state(batch, index), [batch.com_vel_ap[index], batch.com_vel_ml[index]])
+
+
+def _index(values, value):
+    """
+    Index of value in values, -1 if it is not in there
+    """
+    matches = np.flatnonzero(np.isclose(values, value, rtol=0, atol=1e-12))
+    return matches[0] if matches.size > 0 else -1
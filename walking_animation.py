@@ -0,0 +1,265 @@
+"""
+Live animation of the walking model. The Simulator passes a record of every
+step it takes (see Simulator.take_step) to the animation, from which the CoM,
+CoP and feet are reconstructed analytically at any moment. Frames are drawn
+with blitting from a timer at display rate, in wall-clock time, so frames
+that can not be drawn in time are dropped instead of slowing the simulation.
+"""
+
+import bisect
+import collections
+import threading
+import time
+import numpy as np
+from matplotlib import pyplot as plt
+from lip2d import LIP2D
+from swing_leg import SwingLeg
+
+
+class WalkingAnimation(object):
+    """
+    Top view (ML horizontal, AP vertical) of the CoM trajectory, the stance
+    and swing feet and the CoP.
+    """
+
+    def __init__(self, settings, fps=30, speed=1.0, max_lag=1.0, trail_rate=100, view_size=(0.6, 1.6)):
+        """
+        =INPUT=
+            settings - SimulationSettings
+            fps - float [30]
+                Display rate
+            speed - float [1.0]
+                Simulated seconds shown per wall-clock second
+            max_lag - float [1.0]
+                If the display falls more than max_lag simulated seconds
+                behind the simulation, it skips ahead
+            trail_rate - float [100]
+                Sample rate [Hz] of the CoM trail
+            view_size - tuple of float [(0.6, 1.6)]
+                Width (ML) and height (AP) of the view, which recenters when
+                the CoM leaves it
+        """
+        self.settings = settings
+        self.fps = fps
+        self.speed = speed
+        self.max_lag = max_lag
+        self.trail_rate = trail_rate
+        self.view_size = view_size
+
+        # Step records arrive from the simulation thread, see push
+        self.incoming = collections.deque()
+        self.steps = []
+        self.start_times = []
+        self.end_time = 0.0
+        self.trail = [np.empty(0), np.empty(0)]
+        self.trail_times = np.empty(0)
+
+        self.t_display = 0.0
+        self.wall_time = None
+        self.n_frames = 0
+        self.n_dropped = 0
+
+        self.swing_leg = SwingLeg(mass=settings.mass_swing_leg, gravity=settings.gravity,
+                                  leg_length=settings.swing_leg_length)
+
+        self.figure = None
+        self.background = None
+        return
+
+
+    def push(self, record):
+        """
+        Receive a step record, see Simulator.take_step. Only queues the
+        record, so it can be used as step_callback without slowing down
+        the simulator.
+        """
+        self.incoming.append(record)
+        return
+
+
+    def run(self, simulation, n_step, **run_kwargs):
+        """
+        Run a simulation in a background thread and animate it until the
+        figure is closed.
+
+        =INPUT=
+            simulation - Simulator
+            n_step - int
+                See Simulator.run
+            run_kwargs
+                Other keyword arguments of Simulator.run
+        """
+        simulation.step_callback = self.push
+        run_kwargs.setdefault('verbose', False)
+        thread = threading.Thread(target=simulation.run, args=(n_step,), kwargs=run_kwargs, daemon=True)
+
+        self.setup()
+        timer = self.figure.canvas.new_timer(interval=1000 / self.fps)
+        timer.add_callback(self.update)
+        thread.start()
+        timer.start()
+        plt.show()
+        return
+
+
+    def setup(self):
+        """
+        Create the figure and its animated artists.
+        """
+        self.figure = plt.figure()
+        ax = self.figure.add_subplot(1, 1, 1)
+        ax.set_xlabel('ML')
+        ax.set_ylabel('AP')
+        ax.set_title('Linear inverted pendulum walking model')
+        ax.set_aspect('equal')
+        ax.grid()
+
+        self.artists = {
+            'trail': ax.plot([], [], '--k', animated=True)[0],
+            'com': ax.plot([], [], 'ok', markersize=10, animated=True)[0],
+            'stance_foot': ax.plot([], [], '^', markersize=10, markerfacecolor=(1, 1, 1, 0),
+                markeredgewidth=2, markeredgecolor='b', animated=True)[0],
+            'swing_foot': ax.plot([], [], '^', markersize=10, markerfacecolor=(1, 1, 1, 0),
+                markeredgewidth=2, markeredgecolor='r', animated=True)[0],
+            'cop': ax.plot([], [], '+', markersize=10, markeredgewidth=2, markeredgecolor='g', animated=True)[0],
+            'legs': ax.plot([], [], '-', color='0.5', animated=True)[0]}
+
+        self._recenter(self.settings.initial_com_pos_ml, self.settings.initial_com_pos_ap)
+        self.figure.canvas.mpl_connect('draw_event', self._on_draw)
+        return
+
+
+    def update(self):
+        """
+        Timer callback: take in new steps, advance the display time with
+        the wall clock and draw a single frame.
+        """
+        while self.incoming:
+            self._add_step(self.incoming.popleft())
+
+        now = time.perf_counter()
+        if self.wall_time is not None:
+            elapsed = now - self.wall_time
+            self.n_dropped += max(int(elapsed * self.fps) - 1, 0)
+            self.t_display += elapsed * self.speed
+        self.wall_time = now
+
+        # Never run ahead of the simulation, skip ahead if too far behind
+        self.t_display = min(self.t_display, self.end_time)
+        self.t_display = max(self.t_display, self.end_time - self.max_lag)
+
+        if self.steps:
+            self.draw_frame(self.t_display)
+        return
+
+
+    def pose_at(self, t):
+        """
+        Reconstruct the walker at time t.
+
+        =INPUT=
+            t - float
+                Simulated time since the first received step
+        =OUTPUT=
+            pose - dict of (ML, AP) positions
+                'com', 'cop', 'stance_foot' and 'swing_foot'
+        """
+        idx = max(bisect.bisect_right(self.start_times, t) - 1, 0)
+        step = self.steps[idx]
+        t_local = min(max(t - self.start_times[idx], 0), step['t_swing'])
+
+        (com_pos, _) = self._simulate(step, t_local)
+        cop_pos = [step['foot_pos'][i] + step['cop_shift'][i] for i in range(2)]
+
+        # The swing foot is at the end of the swing leg of SwingLeg, from its initial to its final angle
+        leg_angle = [self.swing_leg.angle_at(t_local, step['t_swing'], step['leg_angle'][i], step['final_leg_angle'][i])
+                     for i in range(2)]
+        swing_foot = [com_pos[i] + self.settings.leg_length * np.tan(leg_angle[i]) for i in range(2)]
+
+        return {
+            'com': (com_pos[1], com_pos[0]),
+            'cop': (cop_pos[1], cop_pos[0]),
+            'stance_foot': (step['foot_pos'][1], step['foot_pos'][0]),
+            'swing_foot': (swing_foot[1], swing_foot[0])}
+
+
+    def draw_frame(self, t):
+        """
+        Draw the walker at time t, blitting the animated artists on the
+        cached background.
+        """
+        pose = self.pose_at(t)
+        (ax, canvas) = (self.figure.axes[0], self.figure.canvas)
+
+        (x_lim, y_lim) = (ax.get_xlim(), ax.get_ylim())
+        if not (x_lim[0] < pose['com'][0] < x_lim[1] and y_lim[0] < pose['com'][1] < y_lim[1]):
+            self._recenter(*pose['com'])
+
+        n_trail = np.searchsorted(self.trail_times, t)
+        self.artists['trail'].set_data(
+            np.append(self.trail[1][:n_trail], pose['com'][0]), np.append(self.trail[0][:n_trail], pose['com'][1]))
+        for name in ('com', 'cop', 'stance_foot', 'swing_foot'):
+            self.artists[name].set_data([pose[name][0]], [pose[name][1]])
+        self.artists['legs'].set_data(
+            [pose['stance_foot'][0], pose['com'][0], pose['swing_foot'][0]],
+            [pose['stance_foot'][1], pose['com'][1], pose['swing_foot'][1]])
+
+        if self.background is None:
+            canvas.draw()
+        canvas.restore_region(self.background)
+        for artist in self.artists.values():
+            ax.draw_artist(artist)
+        canvas.blit(ax.bbox)
+        canvas.flush_events()
+        self.n_frames += 1
+        return
+
+
+    def _add_step(self, record):
+        """
+        Append a step record and sample its CoM trajectory for the trail.
+        """
+        if self.steps:
+            start_time = self.end_time + record['t_offset']
+        else:
+            start_time = record['t_offset']
+        self.steps.append(record)
+        self.start_times.append(start_time)
+        self.end_time = start_time + record['t_swing']
+
+        t_local = np.arange(0, record['t_swing'], 1 / self.trail_rate)
+        (com_pos, _) = self._simulate(record, t_local)
+        self.trail = [np.append(self.trail[i], com_pos[i]) for i in range(2)]
+        self.trail_times = np.append(self.trail_times, start_time + t_local)
+        return
+
+
+    def _simulate(self, step, t_local):
+        """
+        CoM position and velocity (AP, ML) of a step record at t_local.
+        """
+        com_pos = []
+        com_vel = []
+        for i in range(2):
+            lip = LIP2D(step['com_pos'][i], step['com_vel'][i], step['foot_pos'][i], step['foot_pos'][i],
+                gravity=self.settings.gravity, leg_length=self.settings.leg_length)
+            lip.simulate(t_local, step['cop_shift'][i])
+            com_pos.append(lip.com_pos)
+            com_vel.append(lip.com_vel)
+        return com_pos, com_vel
+
+
+    def _recenter(self, x, y):
+        ax = self.figure.axes[0]
+        ax.set_xlim(x - self.view_size[0] / 2, x + self.view_size[0] / 2)
+        ax.set_ylim(y - self.view_size[1] / 4, y + 3 * self.view_size[1] / 4)
+        self.background = None
+        return
+
+
+    def _on_draw(self, event):
+        """
+        Cache the static background after every full redraw.
+        """
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.axes[0].bbox)
+        return